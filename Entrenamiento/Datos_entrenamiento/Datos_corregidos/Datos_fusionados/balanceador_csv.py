@@ -1,5 +1,10 @@
 import pandas as pd
 import os
+import sys
+
+# Caché columnar del dataset (Entrenamiento/dataset_cache.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from dataset_cache import read_pandas
 
 # --- Configuración del Usuario ---
 INPUT_CSV_PATH = "/home/ruben/TFG/Entrenamiento/Datos_entrenamiento/Datos_corregidos/Datos_fusionados/Dataset_definitivo_filtrado.csv"
@@ -22,7 +27,10 @@ SEED = 32
 def balance_dataset_attack3xnormal(input_path, output_path, label_col, columns_to_keep, attack_samples, normal_samples, seed):
     print(f"🔄 Cargando el dataset desde: {input_path}")
     try:
-        df = pd.read_csv(input_path, low_memory=False)
+        df = read_pandas(input_path, columns=columns_to_keep)
+        from_cache = df is not None
+        if not from_cache:
+            df = pd.read_csv(input_path, low_memory=False)
         print(f"✅ Dataset cargado con forma: {df.shape}")
     except Exception as e:
         print(f"❌ Error al cargar el archivo CSV: {e}")
@@ -57,7 +65,8 @@ def balance_dataset_attack3xnormal(input_path, output_path, label_col, columns_t
     print(f"   ➤ Ataques (1): {(df_balanced[label_col] == 1).sum()} | No ataques (0): {(df_balanced[label_col] == 0).sum()}")
 
     try:
-        df_balanced.to_csv(output_path, index=False)
+        # Desde la caché las numéricas son float64: sin ".0" en los enteros
+        df_balanced.to_csv(output_path, index=False, float_format="%.15g" if from_cache else None)
         print(f"💾 Guardado en: {output_path}")
         size_mb = os.path.getsize(output_path) / (1024 * 1024)
         print(f"📦 Tamaño final del archivo: {size_mb:.2f} MB")
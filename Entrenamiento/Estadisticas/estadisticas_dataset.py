@@ -1,6 +1,14 @@
 import pandas as pd
-import numpy as np 
-import pandas.api.types
+import numpy as np
+import os
+import sys
+import time
+
+# Caché columnar del dataset (Entrenamiento/dataset_cache.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from dataset_cache import find_cache
+# Motor de una sola pasada por bloques (Welford + KLL, combinable entre procesos)
+from stream_stats import compute
 
 # --- Configuración ---
 ruta_csv = "/home/ruben/TFG/Entrenamiento/Datos_entrenamiento/Datos_corregidos/Datos_fusionados/Dataset_definitivo.csv"  # Ruta de tu dataset
@@ -11,6 +19,7 @@ output_states_csv = "states_detectados_entrenamiento.csv"
 output_label_distribution_csv = "distribucion_label.csv"
 output_attack_category_csv = "categorias_ataque_detectadas_entrenamiento.csv"
 output_http_features_csv = "estadisticas_http_features.csv"
+workers = int(os.getenv("STATS_WORKERS", os.cpu_count()))   # procesos del recorrido
 
 
 numeric_cols_to_analyze = [
@@ -20,210 +29,158 @@ numeric_cols_to_analyze = [
     "stime", "ltime", "sintpkt", "dintpkt", "tcprtt", "synack", "ackdat"
 ]
 
-http_features = ["trans_depth", "response_body_len", "ct_flw_http_mthd"] 
+http_features = ["trans_depth", "response_body_len", "ct_flw_http_mthd"]
 short_flow_features_to_analyze = ["sjit", "djit", "sintpkt", "dintpkt"]
 max_packets_for_short_flow_analysis = 3
-
-# --- Cargar el Dataset ---
-print(f"🔄 Cargando el dataset desde: {ruta_csv}")
-try:
-    df = pd.read_csv(ruta_csv, low_memory=False)
-    print(f"✅ Dataset cargado. Forma: {df.shape}")
-    print(f"💡 Nombres de columnas en el CSV: {df.columns.tolist()}")
-except FileNotFoundError:
-    print(f"❌ Error: No se encontró el archivo en la ruta: {ruta_csv}")
-    exit()
-except Exception as e:
-    print(f"❌ Error al cargar el CSV: {e}")
-    exit()
-
-# --- Análisis de Protocolos y Estados (mejorado) ---
-print("\n--- Análisis de Protocolos y Estados ---")
-if "proto" in df.columns:
-    conteo_protocolos = df["proto"].value_counts(dropna=False) # dropna=False para contar NaNs si existen
-    print("\n✅ Conteo de Protocolos (incluyendo NaN si hay):")
-    print(conteo_protocolos)
-    conteo_protocolos.to_csv(output_protocolos_csv, header=['count'], index_label='protocol')
-    print(f"📁 Guardado: {output_protocolos_csv}")
-else:
-    print("⚠️ Advertencia: No se encontró la columna 'proto'.")
-
-if "state" in df.columns:
-    conteo_state = df["state"].value_counts(dropna=False) # dropna=False para contar NaNs si existen
-    print("\n✅ Conteo de Estados (incluyendo NaN si hay):")
-    print(conteo_state)
-    conteo_state.to_csv(output_states_csv, header=['count'], index_label='state')
-    print(f"📁 Guardado: {output_states_csv}")
-else:
-    print("⚠️ Advertencia: No se encontró la columna 'state'.")
-
-# --- Análisis de la columna 'label' (Binaria: Normal/Ataque) ---
-print("\n--- Análisis de la columna 'label' (Binaria: Normal/Ataque) ---")
-if "label" in df.columns:
-    # Asegúrate de que 'label' sea numérica si es posible (0 o 1)
-    df['label'] = pd.to_numeric(df['label'], errors='coerce')
-    conteo_label = df["label"].value_counts(dropna=False)
-    print("\n✅ Conteo de Valores en 'label' (0=Normal, 1=Ataque, incluyendo NaN):")
-    print(conteo_label)
-    conteo_label.to_csv(output_label_distribution_csv, header=['count'], index_label='label_value')
-    print(f"📁 Guardado: {output_label_distribution_csv}")
-
-    # Si tienes ambos 0 y 1, puedes calcular el porcentaje de ataques
-    if 0 in conteo_label and 1 in conteo_label:
-        total_samples = conteo_label.sum()
-        normal_count = conteo_label.get(0, 0)
-        attack_count = conteo_label.get(1, 0)
-        print(f"   Porcentaje de Tráfico Normal: {((normal_count / total_samples) * 100):.2f}%")
-        print(f"   Porcentaje de Tráfico de Ataque: {((attack_count / total_samples) * 100):.2f}%")
-    elif 0 in conteo_label:
-        print("   Solo tráfico Normal detectado en el dataset (label=0).")
-    elif 1 in conteo_label:
-        print("   Solo tráfico de Ataque detectado en el dataset (label=1).")
+general_percentiles = [.01, .05, .25, .5, .75, .95, .99]
+
+
+def save_counts(conteo, path, index_label, titulo):
+    print(f"\n✅ {titulo}:")
+    print(conteo)
+    conteo.to_csv(path, header=['count'], index_label=index_label)
+    print(f"📁 Guardado: {path}")
+
+
+def main():
+    # --- Recorrer el Dataset (una pasada) ---
+    print(f"🔄 Recorriendo el dataset desde: {ruta_csv}")
+    if not os.path.isfile(ruta_csv):
+        print(f"❌ Error: No se encontró el archivo en la ruta: {ruta_csv}")
+        return
+    cache = find_cache(ruta_csv)
+    t0 = time.perf_counter()
+    try:
+        stats = compute(ruta_csv, workers=workers, cache_dir=cache,
+                        numeric_cols=numeric_cols_to_analyze, http_cols=http_features,
+                        short_features=short_flow_features_to_analyze,
+                        max_packets=max_packets_for_short_flow_analysis)
+    except Exception as e:
+        print(f"❌ Error al leer el dataset: {e}")
+        return
+    columns = stats.columns or []
+    print(f"✅ Dataset recorrido en {time.perf_counter() - t0:.1f} s ({stats.rows} filas, "
+          f"{workers} procesos, {'caché columnar' if cache else 'CSV'})")
+    print(f"💡 Columnas analizadas: {columns}")
+
+    # --- Análisis de Protocolos y Estados ---
+    print("\n--- Análisis de Protocolos y Estados ---")
+    for col, path, label, titulo in (("proto", output_protocolos_csv, 'protocol', "Conteo de Protocolos (incluyendo NaN si hay)"),
+                                     ("state", output_states_csv, 'state', "Conteo de Estados (incluyendo NaN si hay)")):
+        if col in columns:
+            save_counts(stats.counts[col].series(), path, label, titulo)
+        else:
+            print(f"⚠️ Advertencia: No se encontró la columna '{col}'.")
+
+    # --- Análisis de la columna 'label' (Binaria: Normal/Ataque) ---
+    print("\n--- Análisis de la columna 'label' (Binaria: Normal/Ataque) ---")
+    if "label" in columns:
+        conteo_label = stats.counts["label"].series(numeric=True)
+        save_counts(conteo_label, output_label_distribution_csv, 'label_value',
+                    "Conteo de Valores en 'label' (0=Normal, 1=Ataque, incluyendo NaN)")
+
+        if 0 in conteo_label and 1 in conteo_label:
+            total_samples = conteo_label.sum()
+            normal_count = conteo_label.get(0, 0)
+            attack_count = conteo_label.get(1, 0)
+            print(f"   Porcentaje de Tráfico Normal: {((normal_count / total_samples) * 100):.2f}%")
+            print(f"   Porcentaje de Tráfico de Ataque: {((attack_count / total_samples) * 100):.2f}%")
+        elif 0 in conteo_label:
+            print("   Solo tráfico Normal detectado en el dataset (label=0).")
+        elif 1 in conteo_label:
+            print("   Solo tráfico de Ataque detectado en el dataset (label=1).")
+        else:
+            print("   No se encontraron valores 0 o 1 en la columna 'label'.")
     else:
-        print("   No se encontraron valores 0 o 1 en la columna 'label'.")
-else:
-    print("⚠️ Advertencia: No se encontró la columna 'label'. Esta columna es crucial para tu TFG.")
-
-# --- Análisis de la columna 'attack_cat' (Categorías de Ataque) ---
-print("\n--- Análisis de la columna 'attack_cat' (Categorías de Ataque) ---")
-if "attack_cat" in df.columns:
-    conteo_attack_cat = df["attack_cat"].value_counts(dropna=False)
-    print("\n✅ Conteo de Categorías de Ataque (incluyendo NaN si hay):")
-    print(conteo_attack_cat)
-    conteo_attack_cat.to_csv(output_attack_category_csv, header=['count'], index_label='attack_category')
-    print(f"📁 Guardado: {output_attack_category_csv}")
-
-    # Opcional: Mostrar ataques por categoría solo para flujos etiquetados como ataque (label=1)
-    if "label" in df.columns and 1 in df['label'].unique():
-        attack_df = df[df['label'] == 1]
-        conteo_attack_cat_only_attacks = attack_df["attack_cat"].value_counts(dropna=False)
-        print("\n✅ Conteo de Categorías de Ataque (SOLO para flujos con label=1):")
-        print(conteo_attack_cat_only_attacks)
+        print("⚠️ Advertencia: No se encontró la columna 'label'. Esta columna es crucial para tu TFG.")
+
+    # --- Análisis de la columna 'attack_cat' (Categorías de Ataque) ---
+    print("\n--- Análisis de la columna 'attack_cat' (Categorías de Ataque) ---")
+    if "attack_cat" in columns:
+        save_counts(stats.counts["attack_cat"].series(), output_attack_category_csv, 'attack_category',
+                    "Conteo de Categorías de Ataque (incluyendo NaN si hay)")
+        if stats.attack_cat_attacks.counts:
+            print("\n✅ Conteo de Categorías de Ataque (SOLO para flujos con label=1):")
+            print(stats.attack_cat_attacks.series())
+        else:
+            print("⚠️ No se puede analizar 'attack_cat' solo para ataques porque la columna 'label' no existe o no contiene ataques (label=1).")
     else:
-        print("⚠️ No se puede analizar 'attack_cat' solo para ataques porque la columna 'label' no existe o no contiene ataques (label=1).")
-else:
-    print("⚠️ Advertencia: No se encontró la columna 'attack_cat'. Asegúrate de que esta columna esté presente en tu dataset si esperas categorías de ataque.")
-
+        print("⚠️ Advertencia: No se encontró la columna 'attack_cat'. Asegúrate de que esta columna esté presente en tu dataset si esperas categorías de ataque.")
 
-# --- Estadísticas Descriptivas Generales ---
-print(f"\n--- Estadísticas Descriptivas Generales para Columnas Numéricas ---")
+    # --- Estadísticas Descriptivas Generales ---
+    print(f"\n--- Estadísticas Descriptivas Generales para Columnas Numéricas ---")
+    valid_numeric_cols = [c for c in numeric_cols_to_analyze if c in columns]
+    for col in numeric_cols_to_analyze:
+        if col not in columns:
+            print(f"⚠️ Advertencia: La columna numérica '{col}' no se encontró en el dataset.")
 
-# Validar y convertir columnas a numérico
-valid_numeric_cols = []
-for col in numeric_cols_to_analyze:
-    if col in df.columns:
-        # Intentar convertir a numérico. Los errores se convertirán en NaN.
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-        valid_numeric_cols.append(col)
+    if not valid_numeric_cols:
+        print("❌ Error: Ninguna de las columnas numéricas especificadas para análisis general se encontró o es válida.")
     else:
-        print(f"⚠️ Advertencia: La columna numérica '{col}' no se encontró en el dataset.")
-
-if not valid_numeric_cols:
-    print("❌ Error: Ninguna de las columnas numéricas especificadas para análisis general se encontró o es válida.")
-else:
-    # Calcular estadísticas descriptivas básicas
-    # Añadimos percentiles que pueden ser útiles para entender la distribución
-    desc_stats = df[valid_numeric_cols].describe(percentiles=[.01, .05, .25, .5, .75, .95, .99]).transpose()
-
-    # Contar valores 0.0, -1.0 y NaN para cada columna
-    stats_extended = []
-    for col in valid_numeric_cols:
-        zeros = (df[col] == 0).sum()
-        minus_ones = (df[col] == -1).sum()
-        nans = df[col].isnull().sum()
-        stats_extended.append({
-            'zeros_count': zeros,
-            'zeros_percentage': (zeros / len(df[col])) * 100 if len(df[col]) > 0 else 0,
-            'minus_ones_count': minus_ones,
-            'minus_ones_percentage': (minus_ones / len(df[col])) * 100 if len(df[col]) > 0 else 0,
-            'NaN_count': nans,
-            'NaN_percentage': (nans / len(df[col])) * 100 if len(df[col]) > 0 else 0,
-        })
-    if 'spkts' in df.columns and 'dpkts' in df.columns:
-        print("\n💡 Tipos de datos para 'spkts' y 'dpkts' después de la conversión a numérico:")
-        print(df[['spkts', 'dpkts']].info())
+        rows = []
+        for col in valid_numeric_cols:
+            st = stats.numeric[col]
+            n = st.rows
+            rows.append({
+                **st.describe(general_percentiles),
+                'zeros_count': st.zeros,
+                'zeros_percentage': (st.zeros / n) * 100 if n > 0 else 0,
+                'minus_ones_count': st.minus_ones,
+                'minus_ones_percentage': (st.minus_ones / n) * 100 if n > 0 else 0,
+                'NaN_count': st.nans,
+                'NaN_percentage': (st.nans / n) * 100 if n > 0 else 0,
+            })
+        desc_stats = pd.DataFrame(rows, index=valid_numeric_cols)
+
+        print("\nEstadísticas Descriptivas Generales Completas:")
+        print(desc_stats)
+        desc_stats.to_csv(output_stats_general_csv)
+        print(f"📁 Guardado: {output_stats_general_csv}")
+
+    # --- Análisis Específico para Flujos Cortos (`sjit`, `djit`, `sintpkt`, `dintpkt`) ---
+    print(f"\n--- Análisis Específico para Flujos Cortos (spkts/dpkts <= {max_packets_for_short_flow_analysis}) ---")
+    valid_short_flow_analysis_features = [col for col in short_flow_features_to_analyze if col in valid_numeric_cols]
+    short_flow_stats_list = []
+
+    if not ('spkts' in columns and 'dpkts' in columns):
+        print("⚠️ Advertencia: Columnas 'spkts' o 'dpkts' no encontradas. Omitiendo análisis de flujos cortos.")
+    elif not valid_short_flow_analysis_features:
+        print(f"⚠️ Advertencia: Ninguna de las características para análisis de flujos cortos ({short_flow_features_to_analyze}) es válida o fue encontrada.")
     else:
-        print("⚠️ 'spkts' o 'dpkts' no encontradas para mostrar sus dtypes.")
-    
-    extended_df = pd.DataFrame(stats_extended, index=valid_numeric_cols)
-    desc_stats = pd.concat([desc_stats, extended_df], axis=1)
-
-    print("\nEstadísticas Descriptivas Generales Completas:")
-    print(desc_stats)
-    desc_stats.to_csv(output_stats_general_csv)
-    print(f"📁 Guardado: {output_stats_general_csv}")
+        for feature_to_analyze in valid_short_flow_analysis_features:
+            packet_count_column = 'spkts' if feature_to_analyze.startswith('s') else 'dpkts'
+            for N in range(1, max_packets_for_short_flow_analysis + 1):
+                st = stats.short[(feature_to_analyze, N)]
+                current_stats = {
+                    'feature': feature_to_analyze,
+                    'packet_count_type': packet_count_column,
+                    'packet_count_value': N,
+                    'subset_flow_count': st.rows
+                }
+                if st.rows:
+                    desc_subset = st.describe()
+                    current_stats.update({
+                        'mean': desc_subset['mean'],
+                        'std': desc_subset['std'],
+                        'min': desc_subset['min'],
+                        'max': desc_subset['max'],
+                        '25%': desc_subset['25%'],
+                        '50% (median)': desc_subset['50%'],
+                        '75%': desc_subset['75%'],
+                        'zeros_count': st.zeros,
+                        'minus_ones_count': st.minus_ones,
+                        'NaN_count': st.nans
+                    })
+                else: # Si no hay flujos con N paquetes
+                    current_stats.update({
+                        'mean': np.nan, 'std': np.nan, 'min': np.nan, 'max': np.nan,
+                        '25%': np.nan, '50% (median)': np.nan, '75%': np.nan,
+                        'zeros_count': 0, 'minus_ones_count': 0, 'NaN_count': 0
+                    })
+                short_flow_stats_list.append(current_stats)
 
-# --- Análisis Específico para Flujos Cortos (`sjit`, `djit`, `sintpkt`, `dintpkt`) ---
-print(f"\n--- Análisis Específico para Flujos Cortos (spkts/dpkts <= {max_packets_for_short_flow_analysis}) ---")
-
-# Validar que las columnas necesarias existen y son numéricas
-spkts_col_exists_and_is_numeric = 'spkts' in df.columns and pd.api.types.is_numeric_dtype(df['spkts'].dtype)
-dpkts_col_exists_and_is_numeric = 'dpkts' in df.columns and pd.api.types.is_numeric_dtype(df['dpkts'].dtype)
-
-valid_short_flow_analysis_features = [col for col in short_flow_features_to_analyze if col in valid_numeric_cols]
-short_flow_stats_list = []
-
-
-if not (spkts_col_exists_and_is_numeric and dpkts_col_exists_and_is_numeric):
-    print("⚠️ Advertencia: Columnas 'spkts' o 'dpkts' no encontradas o no son numéricas. Omitiendo análisis de flujos cortos.")
-    if 'spkts' in df.columns and not pd.api.types.is_numeric_dtype(df['spkts'].dtype):
-        print(f"   Tipo de 'spkts': {df['spkts'].dtype}")
-    if 'dpkts' in df.columns and not pd.api.types.is_numeric_dtype(df['dpkts'].dtype):
-        print(f"   Tipo de 'dpkts': {df['dpkts'].dtype}")
-elif not valid_short_flow_analysis_features:
-    print(f"⚠️ Advertencia: Ninguna de las características para análisis de flujos cortos ({short_flow_features_to_analyze}) es válida o fue encontrada.")
-else:
-    for feature_to_analyze in valid_short_flow_analysis_features:
-        packet_count_column = ''
-        if feature_to_analyze.startswith('s'): # ej. sjit, sintpkt
-            packet_count_column = 'spkts'
-        elif feature_to_analyze.startswith('d'): # ej. djit, dintpkt
-            packet_count_column = 'dpkts'
-        
-        if not packet_count_column:
-            print(f"❓ No se pudo determinar la columna de conteo de paquetes para '{feature_to_analyze}'. Se omitirá.")
-            continue
-
-        print(f"\nAnalizando '{feature_to_analyze}' basado en '{packet_count_column}':")
-        for N in range(1, max_packets_for_short_flow_analysis + 1):
-            # Subconjunto de datos donde el conteo de paquetes es exactamente N
-            subset_df = df[df[packet_count_column] == N]
-            
-            current_stats = {
-                'feature': feature_to_analyze,
-                'packet_count_type': packet_count_column,
-                'packet_count_value': N,
-                'subset_flow_count': len(subset_df)
-            }
-
-            if not subset_df.empty:
-                feature_data = subset_df[feature_to_analyze]
-                desc_subset = feature_data.describe() # Basic stats for this specific feature in the subset
-                
-                current_stats.update({
-                    'mean': desc_subset.get('mean', np.nan),
-                    'std': desc_subset.get('std', np.nan),
-                    'min': desc_subset.get('min', np.nan),
-                    'max': desc_subset.get('max', np.nan),
-                    '25%': desc_subset.get('25%', np.nan),
-                    '50% (median)': desc_subset.get('50%', np.nan),
-                    '75%': desc_subset.get('75%', np.nan),
-                    'zeros_count': (feature_data == 0).sum(),
-                    'minus_ones_count': (feature_data == -1).sum(),
-                    'NaN_count': feature_data.isnull().sum()
-                })
-            else: # Si no hay flujos con N paquetes
-                current_stats.update({
-                    'mean': np.nan, 'std': np.nan, 'min': np.nan, 'max': np.nan,
-                    '25%': np.nan, '50% (median)': np.nan, '75%': np.nan,
-                    'zeros_count': 0, 'minus_ones_count': 0, 'NaN_count': 0
-                })
-            short_flow_stats_list.append(current_stats)
-
-    if short_flow_stats_list:
         short_flow_summary_df = pd.DataFrame(short_flow_stats_list)
         print("\nEstadísticas Detalladas para Flujos Cortos:")
-        # Imprimir de forma más legible
         for _, row in short_flow_summary_df.iterrows():
             if row['subset_flow_count'] > 0:
                 print(f"  Para {row['feature']} con {row['packet_count_type']} == {row['packet_count_value']} ({row['subset_flow_count']} flujos):")
@@ -231,46 +188,39 @@ else:
                 print(f"    Ceros: {row['zeros_count']}, MenosUnos: {row['minus_ones_count']}, NaNs: {row['NaN_count']}")
             else:
                 print(f"  No hay datos para {row['feature']} con {row['packet_count_type']} == {row['packet_count_value']}")
-        
+
         short_flow_summary_df.to_csv(output_stats_short_flows_csv, index=False)
         print(f"\n📁 Guardado: {output_stats_short_flows_csv}")
-    else:
-        print("ℹ️ No se generaron estadísticas para flujos cortos (posiblemente por falta de datos o columnas adecuadas).")
 
-for col in http_features:
-    if col in df.columns:
-        df[col] = pd.to_numeric(df[col], errors="coerce")
+    # --- Features HTTP ---
+    for col in http_features:
+        if col not in columns:
+            print(f"⚠️ No se encontró la columna '{col}' en el dataset.")
+
+    existing_http = [col for col in http_features if col in columns]
+    if existing_http:
+        rows = []
+        for col in existing_http:
+            st = stats.http[col]
+            n = st.rows
+            rows.append({
+                **st.describe(general_percentiles),
+                "zeros_count":       st.zeros,
+                "zeros_pct":         st.zeros / n * 100,
+                "minus_ones_count":  st.minus_ones,
+                "minus_ones_pct":    st.minus_ones / n * 100,
+                "nan_count":         st.nans,
+                "nan_pct":           st.nans / n * 100,
+            })
+        http_stats = pd.DataFrame(rows, index=existing_http)
+        print(http_stats)
+        http_stats.to_csv(output_http_features_csv)
+        print(f"📁 Guardado: {output_http_features_csv}")
     else:
-        print(f"⚠️ No se encontró la columna '{col}' en el dataset.")
-
-# 2) Calculamos describe con percentiles útiles
-existing_http = [col for col in http_features if col in df.columns]
-if existing_http:
-    desc_http = df[existing_http] \
-        .describe(percentiles=[.01, .05, .25, .5, .75, .95, .99]) \
-        .transpose()
-
-    # 3) Contamos ceros, -1 y NaN
-    ext_stats = []
-    for col in existing_http:
-        ser = df[col]
-        ext_stats.append({
-            "zeros_count":       (ser == 0).sum(),
-            "zeros_pct":         (ser == 0).mean() * 100,
-            "minus_ones_count":  (ser == -1).sum(),
-            "minus_ones_pct":    (ser == -1).mean() * 100,
-            "nan_count":         ser.isna().sum(),
-            "nan_pct":           ser.isna().mean() * 100,
-        })
-    ext_df = pd.DataFrame(ext_stats, index=existing_http)
+        print("❌ Ninguna de las columnas HTTP específicas está disponible para analizar.")
 
-    # 4) Unimos y guardamos
-    http_stats = pd.concat([desc_http, ext_df], axis=1)
-    print(http_stats)
-    http_stats.to_csv(output_http_features_csv)
-    print(f"📁 Guardado: {output_http_features_csv}")
-else:
-    print("❌ Ninguna de las columnas HTTP específicas está disponible para analizar.")
+    print("\n✅ Análisis estadístico completado.")
 
 
-print("\n✅ Análisis estadístico completado.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,21 @@
+import os
+import sys
+
 import pandas as pd
 
+# Caché columnar del dataset (Entrenamiento/dataset_cache.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from dataset_cache import read_pandas
+
 # Definir el archivo de entrada
 input_file = "/home/ruben/TFG/Entrenamiento/Datos_entrenamiento/Datos_corregidos/Datos_fusionados/Dataset_definitivo.csv"
 
 # Cargar el archivo CSV
 try:
-    df = pd.read_csv(input_file)
+    # Solo hace falta 'label': de la caché si existe
+    df = read_pandas(input_file, columns=["label"])
+    if df is None:
+        df = pd.read_csv(input_file)
 except FileNotFoundError:
     print(f"Error: El archivo '{input_file}' no existe.")
     exit(1)
@@ -0,0 +1,298 @@
+"""
+Motor de estadísticas en streaming para estadisticas_dataset.py.
+
+Recorre el dataset UNA vez, por bloques y con memoria acotada, y acumula
+en estados combinables (merge) entre procesos:
+
+    ColumnStats     filas, no nulos, NaN, ceros, -1, min/max, media y
+                    varianza (Welford/Chan) y percentiles aproximados (KLL)
+    ValueCounts     conteos de valores con NaN (proto, state, label…)
+    DatasetStats    todo lo que necesita el informe, incluidos los flujos
+                    cortos (feature por spkts/dpkts == N)
+
+Entrada: la caché Parquet del CSV (Entrenamiento/dataset_cache.py) si
+existe, repartiendo sus ficheros entre procesos, o el CSV en rangos de
+bytes alineados a fin de línea.
+"""
+import io
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+CHUNK_BYTES = 16 << 20          # bytes de CSV por bloque de pandas
+SKETCH_K    = 4096              # capacidad por nivel del KLL (error de rango ~ 1/K por nivel)
+
+
+# ─── Percentiles aproximados ─────────────────────────────────────────
+class QuantileSketch:
+    """
+    KLL simplificado: niveles de capacidad K; cuando uno se llena se ordena
+    y la mitad de sus elementos (pares o impares al azar) sube al siguiente
+    con el doble de peso. Mientras no se compacta nada es exacto.
+    """
+
+    def __init__(self, k=SKETCH_K, seed=0):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        if len(values):
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self.n += len(values)
+            self._compress()
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, buf in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], buf])
+        self.n += other.n
+        self._compress()
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            buf = self.levels[h]
+            if len(buf) > self.k:
+                buf = np.sort(buf)
+                odd = len(buf) % 2
+                self.levels[h] = buf[len(buf) - odd:]
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                promoted = buf[int(self.rng.integers(2)):len(buf) - odd:2]
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+            h += 1
+
+    def quantiles(self, qs):
+        """Como Series.quantile (interpolación lineal); exacto si no hubo compactación."""
+        if self.n == 0:
+            return [np.nan] * len(qs)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(b), 2.0 ** h) for h, b in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        items, weights = items[order], weights[order]
+        # Posición (rango 0..n-1) del centro de cada elemento según su peso
+        centers = np.cumsum(weights) - weights + (weights - 1) / 2
+        total = weights.sum()
+        return [float(np.interp(q * (total - 1), centers, items)) for q in qs]
+
+
+# ─── Estadísticas de una columna ─────────────────────────────────────
+class ColumnStats:
+    def __init__(self):
+        self.rows = 0               # filas vistas (con NaN)
+        self.count = 0              # valores no nulos
+        self.zeros = 0
+        self.minus_ones = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sketch = QuantileSketch()
+
+    @property
+    def nans(self):
+        return self.rows - self.count
+
+    def _combine(self, n, mean, m2):
+        # Fórmula de Chan et al.: une dos (n, media, M2) sin volver a los datos
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+
+    def update(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        self.rows += len(x)
+        valid = x[~np.isnan(x)]
+        if not len(valid):
+            return
+        self.zeros += int(np.count_nonzero(valid == 0))
+        self.minus_ones += int(np.count_nonzero(valid == -1))
+        self.min = min(self.min, float(valid.min()))
+        self.max = max(self.max, float(valid.max()))
+        mean = float(valid.mean())
+        self._combine(len(valid), mean, float(((valid - mean) ** 2).sum()))
+        self.sketch.update(valid)
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.zeros += other.zeros
+        self.minus_ones += other.minus_ones
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if other.count:
+            self._combine(other.count, other.mean, other.m2)
+        self.sketch.merge(other.sketch)
+
+    def describe(self, percentiles=(.25, .5, .75)):
+        """Lo mismo que Series.describe() (count, mean, std, min, percentiles, max)."""
+        out = {"count": float(self.count)}
+        if self.count:
+            out["mean"] = self.mean
+            out["std"] = np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+            out["min"] = self.min
+        else:
+            out.update(mean=np.nan, std=np.nan, min=np.nan)
+        for q, v in zip(percentiles, self.sketch.quantiles(percentiles)):
+            out[f"{q * 100:g}%"] = v
+        out["max"] = self.max if self.count else np.nan
+        return out
+
+
+class ValueCounts:
+    """Conteo de valores con NaN incluido (value_counts(dropna=False)), combinable."""
+    NAN = ("NaN",)
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def update(self, series):
+        for value, n in series.value_counts(dropna=False).items():
+            self.counts[self.NAN if pd.isna(value) else value] += int(n)
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+
+    def series(self, numeric=False):
+        items = sorted(self.counts.items(), key=lambda kv: -kv[1])
+        keys = [np.nan if k == self.NAN else k for k, _ in items]
+        if numeric and self.NAN not in self.counts and all(float(k).is_integer() for k in keys):
+            keys = [int(k) for k in keys]     # como pd.to_numeric sin NaN: enteros
+        return pd.Series([n for _, n in items], index=pd.Index(keys, dtype=object), name="count")
+
+
+# ─── Estado completo del informe ─────────────────────────────────────
+class DatasetStats:
+    def __init__(self, numeric_cols, http_cols, short_features, max_packets):
+        self.numeric = {c: ColumnStats() for c in numeric_cols}
+        self.http = {c: ColumnStats() for c in http_cols}
+        self.short = {(f, n): ColumnStats() for f in short_features
+                      for n in range(1, max_packets + 1)}
+        self.counts = {c: ValueCounts() for c in ("proto", "state", "label", "attack_cat")}
+        self.attack_cat_attacks = ValueCounts()
+        self.columns = None         # columnas presentes en el dataset
+        self.rows = 0
+
+    def update(self, df):
+        if self.columns is None:
+            self.columns = list(df.columns)
+        self.rows += len(df)
+        num = {}
+
+        def numeric(col):
+            if col not in num:
+                num[col] = pd.to_numeric(df[col], errors="coerce").to_numpy(np.float64)
+            return num[col]
+
+        for col in ("proto", "state", "attack_cat"):
+            if col in df.columns:
+                self.counts[col].update(df[col])
+        if "label" in df.columns:
+            label = pd.Series(numeric("label"))
+            self.counts["label"].update(label)
+            if "attack_cat" in df.columns:
+                self.attack_cat_attacks.update(df["attack_cat"][(label == 1).to_numpy()])
+        for group in (self.numeric, self.http):
+            for col, st in group.items():
+                if col in df.columns:
+                    st.update(numeric(col))
+        for (feat, n), st in self.short.items():
+            pkt_col = "spkts" if feat.startswith("s") else "dpkts"
+            if feat in df.columns and pkt_col in df.columns:
+                st.update(numeric(feat)[numeric(pkt_col) == n])
+
+    def merge(self, other):
+        if other.columns is not None:
+            self.columns = self.columns or other.columns
+        self.rows += other.rows
+        for mine, theirs in ((self.numeric, other.numeric), (self.http, other.http),
+                             (self.short, other.short), (self.counts, other.counts)):
+            for key, st in theirs.items():
+                mine[key].merge(st)
+        self.attack_cat_attacks.merge(other.attack_cat_attacks)
+        return self
+
+
+# ─── Lectura por bloques ─────────────────────────────────────────────
+TEXT_COLS = ("proto", "state", "attack_cat")
+
+
+def csv_ranges(path, parts):
+    """Divide el CSV (sin la cabecera) en `parts` rangos de bytes alineados a fin de línea."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as fh:
+        fh.readline()
+        start = fh.tell()
+        bounds = [start]
+        for i in range(1, parts):
+            fh.seek(max(bounds[-1], start + (size - start) * i // parts))
+            fh.readline()
+            bounds.append(min(fh.tell(), size))
+    bounds.append(size)
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+def iter_csv_chunks(path, usecols, start, end, chunk_bytes=CHUNK_BYTES):
+    """DataFrames de las líneas del rango [start, end) con la cabecera del CSV."""
+    with open(path, "rb") as fh:
+        header = fh.readline()
+        names = pd.read_csv(io.BytesIO(header), nrows=0).columns
+        cols = [c for c in usecols if c in names]
+        fh.seek(start)
+        while fh.tell() < end:
+            block = fh.read(min(chunk_bytes, end - fh.tell()))
+            if fh.tell() < end and not block.endswith(b"\n"):
+                block += fh.readline()          # completar la última línea
+            yield pd.read_csv(io.BytesIO(header + block), usecols=cols, low_memory=False,
+                              dtype={c: str for c in TEXT_COLS if c in cols})
+
+
+def iter_cache_chunks(cache_dir, files, usecols):
+    import pyarrow.parquet as pq
+    for name in files:
+        pf = pq.ParquetFile(os.path.join(cache_dir, name))
+        cols = [c for c in usecols if c in pf.schema_arrow.names]
+        for batch in pf.iter_batches(columns=cols):
+            df = batch.to_pandas()
+            for c in df.columns:
+                if isinstance(df[c].dtype, pd.CategoricalDtype):
+                    df[c] = df[c].astype(object)
+            yield df
+
+
+def _partial(spec, config):
+    stats = DatasetStats(**config)
+    kind, source, part = spec
+    usecols = ["proto", "state", "label", "attack_cat", "spkts", "dpkts",
+               *config["numeric_cols"], *config["http_cols"], *config["short_features"]]
+    usecols = list(dict.fromkeys(usecols))
+    chunks = iter_cache_chunks(source, part, usecols) if kind == "cache" \
+        else iter_csv_chunks(source, usecols, *part)
+    for df in chunks:
+        stats.update(df)
+    return stats
+
+
+def compute(path, workers=1, cache_dir=None, **config):
+    """Estadísticas del dataset en una pasada, con `workers` procesos combinados al final."""
+    workers = max(1, workers)
+    if cache_dir:
+        files = sorted(f for f in os.listdir(cache_dir) if f.endswith(".parquet"))
+        specs = [("cache", cache_dir, files[i::workers]) for i in range(min(workers, len(files)))]
+    else:
+        specs = [("csv", path, r) for r in csv_ranges(path, workers)]
+    if len(specs) == 1:
+        return _partial(specs[0], config)
+    with ProcessPoolExecutor(len(specs)) as pool:
+        partials = list(pool.map(_partial, specs, [config] * len(specs)))
+    total = partials[0]
+    for p in partials[1:]:
+        total.merge(p)
+    return total
@@ -0,0 +1,163 @@
+"""
+Carga columnar del dataset de entrenamiento para train_rf.py.
+
+La versión anterior pasaba por VectorAssembler → toPandas() → una lista de
+Python por fila → np.array: varias copias completas del dataset como objetos
+Python. Aquí la matriz float32 y las etiquetas int32 se rellenan columna a
+columna desde Arrow:
+
+    spark_to_numpy(df, columnas)       desde un DataFrame de Spark (Arrow)
+    load_csv_columnar(csv, num, cat)   sin Spark: caché Parquet del CSV
+                                       (dataset_cache.py) o lector CSV de pyarrow
+
+Los índices de las categóricas siguen la regla de StringIndexer
+(frecuencia descendente, empate alfabético, nulos fuera del ajuste y
+handleInvalid="keep"), así que los JSON exportados no cambian.
+"""
+import contextlib
+import resource
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+
+import dataset_cache
+
+
+def peak_rss_mb():
+    """Pico de memoria residente de este proceso (MB; el JVM de Spark va aparte)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@contextlib.contextmanager
+def measure(stage):
+    t0 = time.perf_counter()
+    yield
+    print(f"⏱️  {stage}: {time.perf_counter() - t0:.1f} s · pico RSS {peak_rss_mb():.0f} MB")
+
+
+def fill_matrix(columns, n_rows, dtype=np.float32):
+    """Matriz (n_rows, len(columns)) rellenada columna a columna (arrays de Arrow o NumPy)."""
+    X = np.empty((n_rows, len(columns)), dtype=dtype)
+    for j, column in enumerate(columns):
+        if isinstance(column, (pa.Array, pa.ChunkedArray)):
+            column = column.to_numpy(zero_copy_only=False)
+        X[:, j] = column
+    return X
+
+
+def spark_to_numpy(df, feature_columns, target_column="target"):
+    """
+    Recoge las columnas numéricas crudas (ya casteadas en Spark a float/int)
+    con Arrow y devuelve (X float32, y int32) sin vectores por fila.
+    """
+    from pyspark.sql.functions import col
+
+    df.sparkSession.conf.set("spark.sql.execution.arrow.pyspark.enabled", "true")
+    sel = df.select(*[col(c).cast("float").alias(c) for c in feature_columns],
+                    col(target_column).cast("int").alias(target_column))
+    if hasattr(sel, "toArrow"):          # Spark ≥ 4.0: tabla Arrow sin pasar por pandas
+        table = sel.toArrow()
+        cols = [table.column(c) for c in feature_columns]
+        y = table.column(target_column).to_numpy().astype(np.int32)
+        n = table.num_rows
+    else:
+        pdf = sel.toPandas()
+        cols = [pdf[c].to_numpy() for c in feature_columns]
+        y = pdf[target_column].to_numpy(np.int32)
+        n = len(pdf)
+    X = fill_matrix(cols, n)
+    return X, y
+
+
+# ─── Sin Spark ─────────────────────────────────────────────────────
+def indexer_labels(values):
+    """Etiquetas en el orden de StringIndexer (frequencyDesc, empate alfabético)."""
+    counts = pc.value_counts(pc.drop_null(values)).to_pylist()
+    return [c["values"] for c in sorted(counts, key=lambda c: (-c["counts"], c["values"]))]
+
+
+def index_column(values, labels):
+    """Índice float de cada valor; nulos y desconocidos → len(labels) ("keep")."""
+    idx = pc.index_in(values, value_set=pa.array(labels, type=pa.string()))
+    return pc.fill_null(idx, len(labels)).to_numpy(zero_copy_only=False).astype(np.float32)
+
+
+def to_float(column):
+    """
+    Como cast("double") de Spark + fillna(-1) sobre una columna leída como
+    texto (o ya numérica, desde la caché): lo que no sea número → -1.
+    """
+    return pc.fill_null(dataset_cache.to_numeric(column), -1.0).to_numpy(zero_copy_only=False)
+
+
+def load_csv_columnar(path, numeric_features, categorical_features,
+                      label_column="label", attack_value=1):
+    """
+    Lee en streaming solo las columnas necesarias (de la caché Parquet si
+    existe, si no del CSV) y devuelve un dict
+    con X (float32), y (int32), feature_columns, maps (StringIndexer por
+    categórica) y attack_labels (orden de "Attack"/"Normal").
+    """
+    numeric = [c for c in numeric_features if c != label_column]
+    wanted = numeric + list(categorical_features) + [label_column]
+    cache = dataset_cache.find_cache(path)
+    if cache:
+        print(f"⚡ Leyendo de la caché columnar {cache}")
+        reader = dataset_cache.iter_batches(cache, wanted)
+    else:
+        reader = pacsv.open_csv(
+            path,
+            convert_options=pacsv.ConvertOptions(
+                include_columns=wanted,
+                include_missing_columns=True,
+                null_values=[""],           # nulo solo el campo vacío, como Spark
+                strings_can_be_null=True,
+                column_types={c: pa.string() for c in wanted},
+            ),
+        )
+
+    # Bloque a bloque: las numéricas pasan ya a float32; las categóricas se
+    # guardan como texto hasta conocer sus frecuencias en todo el fichero
+    blocks, cats, attack = [], {c: [] for c in categorical_features}, []
+    for batch in reader:
+        block = np.empty((batch.num_rows, len(numeric)), dtype=np.float32)
+        for j, c in enumerate(numeric):
+            block[:, j] = to_float(batch.column(c))
+        blocks.append(block)
+        for c in categorical_features:
+            cats[c].append(pc.cast(batch.column(c), pa.string()))
+        attack.append(to_float(batch.column(label_column)) == attack_value)
+
+    n_rows = sum(len(b) for b in blocks)
+    X = np.empty((n_rows, len(numeric) + len(categorical_features)), dtype=np.float32)
+    row = 0
+    while blocks:
+        block = blocks.pop(0)
+        X[row:row + len(block), :len(numeric)] = block
+        row += len(block)
+
+    maps = {}
+    for j, c in enumerate(categorical_features, start=len(numeric)):
+        values = pa.chunked_array(cats.pop(c), type=pa.string())
+        labels = indexer_labels(values)
+        maps[c] = {label: float(i) for i, label in enumerate(labels)}
+        X[:, j] = index_column(values, labels)
+
+    # attack_type = "Attack" si label == 1, si no "Normal"; indexado como StringIndexer
+    attack_type = pa.array(np.where(np.concatenate(attack), "Attack", "Normal"))
+    attack_labels = indexer_labels(attack_type)
+    y = index_column(attack_type, attack_labels).astype(np.int32)
+
+    feature_columns = numeric + [f"{c}_index" for c in categorical_features]
+    return {"X": X, "y": y, "feature_columns": feature_columns,
+            "maps": maps, "attack_labels": attack_labels}
+
+
+def train_test_split_rows(n_rows, test_fraction=0.2, seed=42):
+    """Índices (train, test) barajados con semilla, como randomSplit([0.8, 0.2])."""
+    perm = np.random.default_rng(seed).permutation(n_rows)
+    n_test = int(round(n_rows * test_fraction))
+    return np.sort(perm[n_test:]), np.sort(perm[:n_test])
@@ -0,0 +1,199 @@
+"""
+Búsqueda de hiperparámetros con validación cruzada en paralelo para train_rf.py.
+
+Cada par (parámetros, fold) es un trabajo independiente:
+
+    backend "cpu"  RandomForest de scikit-learn en un pool de procesos; la
+                   matriz de entrenamiento va en memoria compartida y cada
+                   worker calcula los folds (StratifiedKFold es determinista)
+    backend "gpu"  RandomForest de cuML en hilos, cada uno con su handle
+                   (y su stream de CUDA)
+
+Con eta > 1 se hace successive halving: todos los juegos de parámetros se
+evalúan en pocos folds, solo el mejor 1/eta pasa al siguiente escalón
+(más folds) y así hasta completar los num_folds. Cada trabajo se apunta en
+results_file (CSV) con sus tiempos y su puntuación; con un ExperimentStore
+(experiment_store.py) los folds ya calculados se reutilizan en lugar de
+volver a entrenarse.
+"""
+import csv
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+RESULT_FIELDS = ["rung", "params_id", "params", "fold", "score", "fit_s", "predict_s",
+                 "worker", "backend", "cached"]
+
+
+def make_estimator(params, backend, handle=None):
+    """RandomForest del backend con los hiperparámetros de param_grid."""
+    if backend == "gpu":
+        from cuml.ensemble import RandomForestClassifier as cuRF
+        kwargs = {} if handle is None else {"handle": handle}
+        return cuRF(
+            n_estimators=params["n_estimators"],
+            max_depth=params["max_depth"],
+            max_features=params["max_features"],
+            min_samples_leaf=params.get("min_samples_leaf", None),
+            min_samples_split=params.get("min_samples_split", None),
+            **kwargs,
+        )
+    from sklearn.ensemble import RandomForestClassifier
+    return RandomForestClassifier(
+        n_estimators=params["n_estimators"],
+        max_depth=params["max_depth"],
+        max_features=params["max_features"],
+        min_samples_leaf=params.get("min_samples_leaf") or 1,
+        min_samples_split=params.get("min_samples_split") or 2,
+        n_jobs=1,                    # el paralelismo lo pone el pool
+        random_state=42,
+    )
+
+
+# ─── Estado de cada worker ─────────────────────────────────────────────
+_X = _y = _folds = None
+_shm = []
+_local = threading.local()
+
+
+def _attach(x_name, x_shape, y_name, y_shape, cv):
+    """Inicializador de proceso: vistas NumPy sobre la memoria compartida (sin copia)."""
+    global _X, _y, _folds
+    xs, ys = shared_memory.SharedMemory(name=x_name), shared_memory.SharedMemory(name=y_name)
+    _shm.extend((xs, ys))
+    _X = np.ndarray(x_shape, dtype=np.float32, buffer=xs.buf)
+    _y = np.ndarray(y_shape, dtype=np.int32, buffer=ys.buf)
+    _folds = list(cv.split(np.zeros(len(_y)), _y))
+
+
+def _run_job(params, fold, backend, model_path=None):
+    handle = None
+    if backend == "gpu":
+        if not hasattr(_local, "handle"):
+            import cuml
+            _local.handle = cuml.Handle()        # un stream por hilo
+        handle = _local.handle
+    train_idx, val_idx = _folds[fold]
+    model = make_estimator(params, backend, handle)
+    t0 = time.perf_counter()
+    model.fit(_X[train_idx], _y[train_idx])
+    t1 = time.perf_counter()
+    y_pred = np.asarray(model.predict(_X[val_idx]))
+    t2 = time.perf_counter()
+    if model_path:
+        import joblib
+        joblib.dump(model, f"{model_path}.tmp")
+        os.replace(f"{model_path}.tmp", model_path)
+    worker = f"{os.getpid()}/{threading.current_thread().name}"
+    return float(np.mean(y_pred == _y[val_idx])), t1 - t0, t2 - t1, worker
+
+
+def _row(rung, i, params, fold, record, backend, cached):
+    return {"rung": rung, "params_id": i, "params": json.dumps(params, sort_keys=True),
+            "fold": fold, "score": f"{record['score']:.6f}", "fit_s": f"{record['fit_s']:.3f}",
+            "predict_s": f"{record['predict_s']:.3f}", "worker": record["worker"],
+            "backend": backend, "cached": cached}
+
+
+def rung_budgets(n_folds, eta, min_folds=2):
+    """Folds acumulados por escalón: p. ej. 15 folds, eta=3 → [2, 5, 15]."""
+    if eta <= 1:
+        return [n_folds]
+    budgets, b = [], n_folds
+    while b >= min_folds:
+        budgets.insert(0, b)
+        b = math.ceil(b / eta) if b > min_folds else 0
+    return budgets or [n_folds]
+
+
+def search(X, y, param_grid, cv, backend="cpu", workers=None, eta=3,
+           results_file="cv_results.csv", store=None):
+    """
+    Devuelve (mejores parámetros, su precisión media en los num_folds).
+    Solo compiten al final los juegos que han llegado al último escalón.
+    """
+    global _X, _y, _folds
+    n_folds = cv.get_n_splits()
+    workers = workers or (os.cpu_count() if backend == "cpu" else 2)
+    budgets = rung_budgets(n_folds, eta) if len(param_grid) > 1 else [n_folds]
+    scores = {i: {} for i in range(len(param_grid))}    # params_id → {fold: score}
+    cached = {i: store.load_folds(p) if store else {} for i, p in enumerate(param_grid)}
+
+    if backend == "cpu":
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        y = np.ascontiguousarray(y, dtype=np.int32)
+        xs = shared_memory.SharedMemory(create=True, size=max(1, X.nbytes))
+        ys = shared_memory.SharedMemory(create=True, size=max(1, y.nbytes))
+        np.ndarray(X.shape, np.float32, buffer=xs.buf)[:] = X
+        np.ndarray(y.shape, np.int32, buffer=ys.buf)[:] = y
+        pool = ProcessPoolExecutor(workers, mp_context=get_context("spawn"), initializer=_attach,
+                                   initargs=(xs.name, X.shape, ys.name, y.shape, cv))
+        owned = (xs, ys)
+    else:
+        _X, _y = X, y
+        _folds = list(cv.split(np.zeros(len(y)), y))
+        pool = ThreadPoolExecutor(workers, thread_name_prefix="cv-gpu")
+        owned = ()
+
+    n_cached = sum(len(c) for c in cached.values())
+    print(f"🔎 Búsqueda CV: {len(param_grid)} juegos × {n_folds} folds, backend {backend.upper()}, "
+          f"{workers} workers, escalones {budgets}, {n_cached} folds ya en caché")
+    alive = list(range(len(param_grid)))
+    t_start = time.perf_counter()
+    try:
+        with open(results_file, "w", newline="") as fh:
+            out = csv.DictWriter(fh, fieldnames=RESULT_FIELDS)
+            out.writeheader()
+            for rung, budget in enumerate(budgets):
+                jobs = {}
+                for i in alive:
+                    for fold in range(budget):
+                        if fold in scores[i]:
+                            continue
+                        record = cached[i].get(fold)
+                        if record:
+                            # Celda ya calculada en un barrido anterior
+                            scores[i][fold] = record["score"]
+                            out.writerow(_row(rung, i, param_grid[i], fold, record, backend, 1))
+                            continue
+                        model_path = store.model_path(param_grid[i], fold) if store else None
+                        fut = pool.submit(_run_job, param_grid[i], fold, backend, model_path)
+                        jobs[fut] = (i, fold)
+                pending = set(jobs)
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        i, fold = jobs[fut]
+                        score, fit_s, predict_s, worker = fut.result()
+                        scores[i][fold] = score
+                        record = {"score": score, "fit_s": fit_s, "predict_s": predict_s,
+                                  "worker": worker}
+                        if store:
+                            store.save_fold(param_grid[i], fold, record)
+                        out.writerow(_row(rung, i, param_grid[i], fold, record, backend, 0))
+                        fh.flush()
+                        print(f"   escalón {rung} · juego {i} · fold {fold + 1}/{n_folds}: "
+                              f"{score * 100:.2f}% ({fit_s:.1f} s)")
+                if rung < len(budgets) - 1:
+                    # Successive halving: sigue el mejor 1/eta según la media en estos folds
+                    alive.sort(key=lambda i: -np.mean([scores[i][f] for f in range(budget)]))
+                    keep = max(1, math.ceil(len(alive) / eta))
+                    alive, dropped = alive[:keep], alive[keep:]
+                    if dropped:
+                        print(f"✂️  Escalón {rung}: descartados {dropped}, siguen {alive}")
+    finally:
+        pool.shutdown()
+        for shm in owned:
+            shm.close()
+            shm.unlink()
+
+    best = max(alive, key=lambda i: np.mean(list(scores[i].values())))
+    best_score = float(np.mean(list(scores[best].values())))
+    print(f"⏱️  Búsqueda CV: {time.perf_counter() - t_start:.1f} s · resultados en {results_file}")
+    return param_grid[best], best_score
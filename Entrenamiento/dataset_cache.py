@@ -0,0 +1,243 @@
+"""
+Caché columnar (Parquet) de los CSV de entrenamiento.
+
+Convierte una vez el CSV (p. ej. Dataset_definitivo.csv) en un directorio de
+ficheros Parquet tipados, identificado por el hash del contenido del CSV:
+
+    <CSV dir>/.cache_columnar/<nombre>-<hash16>/part-00000.parquet …
+                                               /_meta.json
+
+  · columnas numéricas → float64 con la semántica de cast("double") de
+    Spark (lo que no es número queda nulo); el relleno con -1 de
+    train_rf.py se aplica al leer (fill_numeric=True), así los scripts de
+    estadísticas siguen pudiendo contar los NaN originales.
+  · columnas de texto (proto, state, attack_cat, IPs…) → diccionario.
+
+Los scripts leen de la caché si existe para ese CSV (read_table /
+read_pandas con proyección de columnas) y si no, del CSV como siempre.
+
+Uso:
+    python dataset_cache.py <dataset.csv> [--rows-per-part 1000000]
+"""
+import csv
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+CACHE_DIR     = os.getenv("DATASET_CACHE_DIR")    # None → .cache_columnar junto al CSV
+FORMAT        = 1
+ROWS_PER_PART = 1_000_000
+
+# Numéricas de train_rf.py (y de UNSW-NB15): siempre float64, aunque haya
+# valores como "0x0303" (→ nulo, igual que cast("double") en Spark)
+NUMERIC_COLUMNS = {
+    "sport", "dport", "dsport", "dur", "sbytes", "dbytes", "sttl", "dttl", "sloss", "dloss",
+    "sload", "dload", "spkts", "dpkts", "swin", "dwin", "stcpb", "dtcpb", "smeansz", "dmeansz",
+    "sjit", "djit", "stime", "ltime", "sintpkt", "dintpkt", "tcprtt", "synack", "ackdat",
+    "trans_depth", "response_body_len", "res_bdy_len", "is_sm_ips_ports", "ct_state_ttl",
+    "ct_flw_http_mthd", "is_ftp_login", "ct_ftp_cmd", "ct_srv_src", "ct_srv_dst", "ct_dst_ltm",
+    "ct_src_ltm", "ct_src_dport_ltm", "ct_dst_sport_ltm", "ct_dst_src_ltm", "label",
+}
+# Texto → diccionario. Cualquier otra columna es numérica si el primer bloque
+# del CSV lo es (casi) entero
+TEXT_COLUMNS = {"srcip", "dstip", "saddr", "daddr", "proto", "state", "attack_cat", "service"}
+
+
+# ─── Hash del origen (memorizado por tamaño y fecha) ─────────────────
+def _cache_root(csv_path):
+    return CACHE_DIR or os.path.join(os.path.dirname(os.path.abspath(csv_path)), ".cache_columnar")
+
+
+def source_hash(csv_path):
+    """blake2b del contenido del CSV; solo se recalcula si cambian tamaño o mtime."""
+    st = os.stat(csv_path)
+    memo_file = os.path.join(_cache_root(csv_path), "_hashes.json")
+    key = os.path.abspath(csv_path)
+    try:
+        with open(memo_file) as fh:
+            memo = json.load(fh)
+    except (OSError, ValueError):
+        memo = {}
+    entry = memo.get(key)
+    if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+        return entry["hash"]
+
+    h = hashlib.blake2b(digest_size=16)
+    with open(csv_path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 24), b""):
+            h.update(chunk)
+    memo[key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "hash": h.hexdigest()}
+    os.makedirs(os.path.dirname(memo_file), exist_ok=True)
+    with open(f"{memo_file}.tmp", "w") as fh:
+        json.dump(memo, fh, indent=2)
+    os.replace(f"{memo_file}.tmp", memo_file)
+    return memo[key]["hash"]
+
+
+def cache_path(csv_path):
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(_cache_root(csv_path), f"{stem}-{source_hash(csv_path)}")
+
+
+def find_cache(csv_path):
+    """Directorio de la caché del CSV si ya existe (y está completa), si no None."""
+    if not os.path.isfile(csv_path):
+        return None
+    path = cache_path(csv_path)
+    return path if os.path.isfile(os.path.join(path, "_meta.json")) else None
+
+
+# ─── Conversión CSV → Parquet ─────────────────────────────────────────
+def to_numeric(column):
+    """Texto → float64 como cast("double") de Spark: lo que no sea número → nulo."""
+    try:
+        return pc.cast(column, pa.float64())
+    except pa.ArrowInvalid:
+        return pa.array(pd.to_numeric(column.to_pandas(), errors="coerce"), type=pa.float64())
+
+
+def _schema_for(batch):
+    fields = []
+    for name, column in zip(batch.schema.names, batch.columns):
+        numeric = name not in TEXT_COLUMNS
+        if numeric and name not in NUMERIC_COLUMNS:
+            try:
+                pc.cast(column, pa.float64())
+            except pa.ArrowInvalid:
+                # Columna desconocida con texto: solo es numérica si casi todo es número
+                valid = pc.sum(pc.is_valid(to_numeric(column))).as_py() or 0
+                numeric = valid >= 0.99 * max(1, len(column) - column.null_count)
+        fields.append(pa.field(name, pa.float64() if numeric else pa.dictionary(pa.int32(), pa.string())))
+    return pa.schema(fields)
+
+
+def _convert(batch, schema):
+    columns = []
+    for field, column in zip(schema, batch.columns):
+        if pa.types.is_floating(field.type):
+            columns.append(to_numeric(column))
+        else:
+            columns.append(pc.dictionary_encode(column).cast(field.type))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def _header(csv_path):
+    with open(csv_path, newline="") as fh:
+        return next(csv.reader(fh))
+
+
+def build_cache(csv_path, rows_per_part=ROWS_PER_PART):
+    """Convierte el CSV en streaming; escribe en un directorio temporal y lo renombra."""
+    dest = cache_path(csv_path)
+    if os.path.isfile(os.path.join(dest, "_meta.json")):
+        return dest
+    tmp = f"{dest}.tmp{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    t0 = time.perf_counter()
+    reader = pacsv.open_csv(
+        csv_path,
+        read_options=pacsv.ReadOptions(block_size=1 << 24),
+        # Todo como texto (nulo solo el campo vacío, igual que Spark): los tipos
+        # los decide _schema_for con el primer bloque
+        convert_options=pacsv.ConvertOptions(
+            column_types={name: pa.string() for name in _header(csv_path)},
+            null_values=[""], strings_can_be_null=True),
+    )
+    schema, writer, part, rows, part_rows = None, None, 0, 0, 0
+    for batch in reader:
+        if schema is None:
+            schema = _schema_for(batch)
+        if writer is None:
+            writer = pq.ParquetWriter(os.path.join(tmp, f"part-{part:05d}.parquet"), schema,
+                                      compression="zstd")
+        writer.write_batch(_convert(batch, schema))
+        rows += batch.num_rows
+        part_rows += batch.num_rows
+        if part_rows >= rows_per_part:
+            writer.close()
+            writer, part, part_rows = None, part + 1, 0
+    if writer is not None:
+        writer.close()
+
+    meta = {
+        "format": FORMAT,
+        "source": os.path.abspath(csv_path),
+        "source_hash": source_hash(csv_path),
+        "rows": rows,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "columns": {f.name: "numeric" if pa.types.is_floating(f.type) else "dictionary"
+                    for f in schema} if schema else {},
+    }
+    with open(os.path.join(tmp, "_meta.json"), "w") as fh:
+        json.dump(meta, fh, indent=2)
+    shutil.rmtree(dest, ignore_errors=True)
+    os.replace(tmp, dest)
+    print(f"✅ Caché columnar: {rows} filas en {time.perf_counter() - t0:.1f} s → {dest}")
+    return dest
+
+
+# ─── Lectura ──────────────────────────────────────────────────────────
+def read_table(cache_dir, columns=None, fill_numeric=True):
+    """
+    Tabla Arrow con solo `columns` (las que no existan se omiten, como en el
+    CSV); numéricas con nulos → -1 si fill_numeric.
+    """
+    if columns is not None:
+        with open(os.path.join(cache_dir, "_meta.json")) as fh:
+            present = json.load(fh)["columns"]
+        columns = [c for c in columns if c in present]
+    table = pq.read_table(cache_dir, columns=columns)
+    if fill_numeric:
+        for i, field in enumerate(table.schema):
+            if pa.types.is_floating(field.type) and table.column(i).null_count:
+                table = table.set_column(i, field, pc.fill_null(table.column(i), -1.0))
+    return table
+
+
+def iter_batches(cache_dir, columns=None):
+    """Lotes Arrow de la caché (sin rellenar), para cargas en streaming."""
+    for name in sorted(os.listdir(cache_dir)):
+        if name.endswith(".parquet"):
+            yield from pq.ParquetFile(os.path.join(cache_dir, name)).iter_batches(columns=columns)
+
+
+def read_pandas(csv_path, columns=None, fill_numeric=False):
+    """
+    DataFrame desde la caché del CSV, o None si no hay caché (el script lee
+    entonces el CSV como siempre). Las columnas de texto vuelven como str y
+    las enteras sin nulos como int64, igual que con pd.read_csv.
+    """
+    cache = find_cache(csv_path)
+    if cache is None:
+        return None
+    df = read_table(cache, columns, fill_numeric).to_pandas()
+    for name in df.columns:
+        col = df[name]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            df[name] = col.astype(object)
+        elif col.dtype == "float64" and not col.isna().any() and (col == col.round()).all():
+            df[name] = col.astype("int64")      # como infiere pd.read_csv los enteros
+    print(f"⚡ Leído de la caché columnar {cache} ({len(df)} filas, {len(df.columns)} columnas)")
+    return df
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Crea la caché Parquet de un CSV de entrenamiento")
+    ap.add_argument("csv")
+    ap.add_argument("--rows-per-part", type=int, default=ROWS_PER_PART)
+    args = ap.parse_args()
+    if not os.path.isfile(args.csv):
+        sys.exit(f"❌ No existe {args.csv}")
+    build_cache(args.csv, args.rows_per_part)
@@ -0,0 +1,225 @@
+"""
+Almacén de experimentos de train_rf.py: memoriza en disco la puntuación (y
+opcionalmente el modelo) de cada fold de cada juego de hiperparámetros.
+
+Un experimento se identifica por (hash del dataset, lista de
+características, reparto train/test con la huella de las filas de
+entrenamiento, semilla y nº de folds, backend, parámetros). Repetir o ampliar un barrido solo calcula las celdas
+(parámetros, fold) que faltan, y un barrido interrumpido sigue donde se
+quedó: cada fold se guarda de forma atómica al terminar.
+
+    experimentos/<clave>/experiment.json      contexto y parámetros
+                        /fold_03.json         puntuación y tiempos del fold
+                        /fold_03.pkl          modelo del fold (EXP_SAVE_MODELS=1)
+                        /final.npz + final.json   predicciones del modelo final en test
+
+CLI:
+    python experiment_store.py list [--root experimentos]
+    python experiment_store.py report <clave|prefijo> [--out Matriz_confusion]
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+STORE_DIR   = os.getenv("EXP_STORE_DIR", "experimentos")
+SAVE_MODELS = os.getenv("EXP_SAVE_MODELS", "1") == "1"
+
+
+def _write_json(path, data):
+    with open(f"{path}.tmp", "w", encoding="utf-8") as fh:
+        json.dump(data, fh, indent=2, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+
+def split_fingerprint(X, y, chunk_rows=65536):
+    """
+    blake2b de la partición de entrenamiento tal y como llega a la CV (forma,
+    dtype y bytes de X e y). Con Spark las filas de randomSplit dependen del
+    particionado (CSV o caché Parquet, configuración), así que la semilla
+    sola no identifica el reparto.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for arr in (X, y):
+        h.update(f"{arr.shape}|{arr.dtype.str}".encode())
+        for i in range(0, len(arr), chunk_rows):
+            h.update(np.ascontiguousarray(arr[i:i + chunk_rows]).data)
+    return h.hexdigest()
+
+
+def param_string(params, n_folds):
+    """Nombre corto de un juego de parámetros, el de los ficheros de Matriz_confusion."""
+    return (f"n{params['n_estimators']}_d{params['max_depth']}_f{params['max_features']}"
+            f"_l{params.get('min_samples_leaf', 'NA')}_s{params.get('min_samples_split', 'NA')}"
+            f"_cv{n_folds}")
+
+
+class ExperimentStore:
+    def __init__(self, root=STORE_DIR, *, dataset, features, split, cv_seed, n_folds, backend,
+                 save_models=SAVE_MODELS):
+        self.root = root
+        self.context = {"dataset": dataset, "features": list(features), "split": split,
+                        "cv_seed": cv_seed, "n_folds": n_folds, "backend": backend}
+        self.save_models = save_models
+
+    def key(self, params):
+        blob = json.dumps({**self.context, "params": params}, sort_keys=True)
+        return hashlib.sha256(blob.encode()).hexdigest()[:16]
+
+    def path(self, params):
+        path = os.path.join(self.root, self.key(params))
+        if not os.path.isfile(os.path.join(path, "experiment.json")):
+            os.makedirs(path, exist_ok=True)
+            _write_json(os.path.join(path, "experiment.json"), {
+                "key": self.key(params), "params": params, **self.context,
+                "param_str": param_string(params, self.context["n_folds"]),
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            })
+        return path
+
+    def load_folds(self, params):
+        """{fold: registro} de los folds ya calculados para estos parámetros."""
+        path = os.path.join(self.root, self.key(params))
+        folds = {}
+        if os.path.isdir(path):
+            for name in os.listdir(path):
+                if name.startswith("fold_") and name.endswith(".json"):
+                    with open(os.path.join(path, name), encoding="utf-8") as fh:
+                        record = json.load(fh)
+                    folds[record["fold"]] = record
+        return folds
+
+    def model_path(self, params, fold):
+        """Dónde debe guardar el worker el modelo del fold (None si no se guardan)."""
+        if not self.save_models:
+            return None
+        return os.path.join(self.path(params), f"fold_{fold:02d}.pkl")
+
+    def save_fold(self, params, fold, record):
+        _write_json(os.path.join(self.path(params), f"fold_{fold:02d}.json"),
+                    {"fold": fold, **record, "saved": time.strftime("%Y-%m-%dT%H:%M:%S")})
+
+    def save_final(self, params, y_test, y_pred, labels, cv_accuracy, test_accuracy):
+        """Predicciones del modelo final en test: bastan para rehacer la matriz y el informe."""
+        path = self.path(params)
+        tmp = os.path.join(path, "final.tmp.npz")
+        np.savez_compressed(tmp, y_test=np.asarray(y_test), y_pred=np.asarray(y_pred))
+        os.replace(tmp, os.path.join(path, "final.npz"))
+        _write_json(os.path.join(path, "final.json"), {
+            "labels": list(labels), "cv_accuracy": float(cv_accuracy),
+            "test_accuracy": float(test_accuracy), "saved": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        })
+
+
+# ─── Informe (matriz de confusión + classification_report) ─────────────
+def write_report(y_test, y_pred, labels, param_str, output_dir="Matriz_confusion",
+                 suffix="_balanceado"):
+    """Escribe <output_dir>/matriz_<param_str><suffix>.png/.txt; devuelve la ruta base."""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from sklearn.metrics import classification_report, confusion_matrix
+
+    labels = list(labels)
+    test_accuracy = np.mean(y_pred == y_test)
+    if "Normal" in labels:
+        normal_idx = labels.index("Normal")
+        attack_mask = y_test != normal_idx
+        if np.sum(attack_mask) > 0:
+            attack_type_accuracy = np.mean(y_pred[attack_mask] == y_test[attack_mask])
+        else:
+            attack_type_accuracy = 0.0
+    else:
+        attack_type_accuracy = None
+
+    os.makedirs(output_dir, exist_ok=True)
+    filename_base = os.path.join(output_dir, f"matriz_{param_str}{suffix}")
+
+    conf_matrix = confusion_matrix(y_test, y_pred)
+
+    plt.figure(figsize=(6, 5))
+    sns.heatmap(conf_matrix, annot=True, fmt="d", cmap="Blues",
+                xticklabels=labels, yticklabels=labels)
+    plt.xlabel("Predicción")
+    plt.ylabel("Real")
+    plt.title(f"Matriz de Confusión ({param_str})")
+    plt.tight_layout()
+    if attack_type_accuracy is not None:
+        plt.text(0.5, -0.15, f"Precisión en tipo de ataque: {attack_type_accuracy*100:.2f}%",
+                 transform=plt.gca().transAxes, fontsize=10, ha='center')
+    plt.savefig(f"{filename_base}.png")
+    plt.close()
+
+    report = classification_report(y_test, y_pred, target_names=labels)
+    with open(f"{filename_base}.txt", "w", encoding="utf-8") as f:
+        f.write(f"Reporte de Clasificación - {param_str}\n\n")
+        f.write(f"Precisión General en Conjunto de Prueba: {test_accuracy*100:.2f}%\n")
+        if attack_type_accuracy is not None:
+            f.write(f"Precisión Específica en Tipos de Ataque (excluyendo 'Normal'): {attack_type_accuracy*100:.2f}%\n\n")
+        f.write(report)
+
+    print(f"✅ Matriz de confusión guardada en {filename_base}.png")
+    print(f"✅ Reporte de clasificación guardado en {filename_base}.txt")
+    return filename_base
+
+
+# ─── CLI ───────────────────────────────────────────────────────────────
+def list_experiments(root=STORE_DIR):
+    rows = []
+    for key in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+        meta_file = os.path.join(root, key, "experiment.json")
+        if not os.path.isfile(meta_file):
+            continue
+        with open(meta_file, encoding="utf-8") as fh:
+            meta = json.load(fh)
+        folds = [json.load(open(os.path.join(root, key, n), encoding="utf-8"))
+                 for n in os.listdir(os.path.join(root, key))
+                 if n.startswith("fold_") and n.endswith(".json")]
+        final_file = os.path.join(root, key, "final.json")
+        final = json.load(open(final_file, encoding="utf-8")) if os.path.isfile(final_file) else {}
+        rows.append((meta, folds, final))
+    return rows
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Experimentos memorizados de train_rf.py")
+    ap.add_argument("--root", default=STORE_DIR)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list", help="lista los experimentos y sus puntuaciones")
+    rep = sub.add_parser("report", help="rehace la matriz PNG/TXT sin reentrenar")
+    rep.add_argument("key", help="clave del experimento (o un prefijo único)")
+    rep.add_argument("--out", default="Matriz_confusion")
+    args = ap.parse_args()
+
+    if args.cmd == "list":
+        rows = list_experiments(args.root)
+        if not rows:
+            print(f"ℹ️  No hay experimentos en {args.root}/")
+        rows.sort(key=lambda r: -np.mean([f["score"] for f in r[1]]) if r[1] else 0)
+        for meta, folds, final in rows:
+            cv = f"{np.mean([f['score'] for f in folds]) * 100:6.2f}%" if folds else "   —   "
+            test = f"{final['test_accuracy'] * 100:6.2f}%" if final else "   —   "
+            print(f"{meta['key']}  {meta['param_str']:<32} folds {len(folds):>2}/{meta['n_folds']:<2} "
+                  f"CV {cv}  test {test}  {meta['backend']}  {meta['split']}  {meta['created']}")
+        return
+
+    matches = [k for k in os.listdir(args.root) if k.startswith(args.key)] \
+        if os.path.isdir(args.root) else []
+    if len(matches) != 1:
+        sys.exit(f"❌ '{args.key}' coincide con {len(matches)} experimentos")
+    path = os.path.join(args.root, matches[0])
+    if not os.path.isfile(os.path.join(path, "final.npz")):
+        sys.exit(f"❌ {matches[0]} no tiene predicciones finales guardadas")
+    with open(os.path.join(path, "experiment.json"), encoding="utf-8") as fh:
+        meta = json.load(fh)
+    with open(os.path.join(path, "final.json"), encoding="utf-8") as fh:
+        final = json.load(fh)
+    data = np.load(os.path.join(path, "final.npz"))
+    write_report(data["y_test"], data["y_pred"], final["labels"], meta["param_str"], args.out)
+
+
+if __name__ == "__main__":
+    main()
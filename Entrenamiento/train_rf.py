@@ -1,39 +1,32 @@
-from pyspark.sql import SparkSession
-from pyspark.ml.feature import VectorAssembler, StringIndexer
-from pyspark.sql.functions import col, when
-from cuml.ensemble import RandomForestClassifier as cuRF
-from sklearn.metrics import confusion_matrix, classification_report
 from sklearn.model_selection import StratifiedKFold
-from joblib import Parallel, delayed, parallel_backend
-import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
 import pandas as pd
 import joblib
 import json
 import os
+import sys
+import time
+
+from columnar_loader import load_csv_columnar, measure, peak_rss_mb, spark_to_numpy, train_test_split_rows
+from dataset_cache import find_cache, source_hash
+from cv_search import make_estimator, search
+from experiment_store import ExperimentStore, param_string, split_fingerprint, write_report
+
+# Exportador del bosque aplanado para el backend CPU de ml_processor.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Recoleccion", "IA_Predictor"))
+from forest_cpu import export_forest
+from model_bundle import write_bundle
 
 os.environ["CUPY_NO_PINNED_MEMORY"] = "1"
 
 num_folds = 15
 
-# ─── Configurar Spark ─────────────────────────────────────────────
-spark = SparkSession.builder \
-    .appName("IDS_Training_GPU_AntiOverfit_Fixed") \
-    .config("spark.driver.memory", "16g") \
-    .config("spark.executor.memory", "16g") \
-    .config("spark.executor.heartbeatInterval", "60s") \
-    .getOrCreate()
-
-spark.conf.set("spark.sql.debug.maxToStringFields", 500)
+# "spark": mismo reparto train/test que siempre (randomSplit) · "arrow": sin
+# Spark, lector CSV de pyarrow (otro reparto aleatorio, mismos mapas)
+loader = os.getenv("TRAIN_LOADER", "spark")
 
 # ─── Cargar dataset ya fusionado ─
 dataset_path = "/home/ruben/TFG/Entrenamiento/Datos_entrenamiento/Datos_corregidos/Datos_fusionados/Dataset_definitivo.csv"
-df = spark.read.csv(dataset_path, header=True, inferSchema=True)
-print(f"✅ Dataset cargado desde {dataset_path}")
-
-# ─── Crear la nueva etiqueta multiclase "attack_type" ───────────────────
-df = df.withColumn("attack_type", when(col("label") == 1, "Attack").otherwise("Normal"))
 
 numeric_features = [
     "sport","dport","dur","sbytes","dbytes","sttl","dttl","sloss","dloss",
@@ -46,171 +39,201 @@ numeric_features = [
     "label"
 ]
 
-
-
-for col_name in numeric_features:
-    if col_name in df.columns:
-        df = df.withColumn(col_name, col(col_name).cast("double"))
-print("✅ Columnas numéricas convertidas correctamente.")
-
-df = df.fillna(-1, subset=numeric_features)
-
 categorical_features = ["proto", "state"]
-string_indexer_models = {}
-string_indexer_maps_for_export = {}
 
 mapping_output_dir = "string_indexer_maps"
-os.makedirs(mapping_output_dir, exist_ok=True)
-print(f"ℹ️  Los mapeos de StringIndexer se guardarán en: {mapping_output_dir}/")
-
-for col_name in categorical_features:
-    if col_name in df.columns:
-        print(f"Procesando StringIndexer para: {col_name}")
-        indexer = StringIndexer(inputCol=col_name, outputCol=f"{col_name}_index", handleInvalid="keep")
-        indexer_model = indexer.fit(df)
-        df = indexer_model.transform(df)
-        string_indexer_models[col_name] = indexer_model
-        labels = indexer_model.labels
-        label_map = {label: float(i) for i, label in enumerate(labels)}
-        string_indexer_maps_for_export[col_name] = label_map
+
+
+def main():
+    # Todo el entrenamiento va aquí: con CV_BACKEND=cpu los workers de la
+    # búsqueda se lanzan con spawn y reimportan este módulo
+    t_start = time.perf_counter()
+    string_indexer_maps_for_export = {}
+    os.makedirs(mapping_output_dir, exist_ok=True)
+    print(f"ℹ️  Los mapeos de StringIndexer se guardarán en: {mapping_output_dir}/")
+
+    if loader == "arrow":
+        with measure("Carga columnar (pyarrow)"):
+            data = load_csv_columnar(dataset_path, numeric_features, categorical_features)
+        print(f"✅ Dataset cargado desde {dataset_path} ({len(data['y'])} filas, sin Spark)")
+        string_indexer_maps_for_export = data["maps"]
+        attack_labels_list = data["attack_labels"]
+        final_feature_columns = data["feature_columns"]
+        train_idx, test_idx = train_test_split_rows(len(data["y"]))
+        with measure("Reparto train/test"):
+            X_train, y_train = data["X"][train_idx], data["y"][train_idx]
+            X_test, y_test = data["X"][test_idx], data["y"][test_idx]
+            del data
+    else:
+        from pyspark.sql import SparkSession
+        from pyspark.ml.feature import StringIndexer
+        from pyspark.sql.functions import col, when
+
+        # ─── Configurar Spark ─────────────────────────────────────────────
+        spark = SparkSession.builder \
+            .appName("IDS_Training_GPU_AntiOverfit_Fixed") \
+            .config("spark.driver.memory", "16g") \
+            .config("spark.executor.memory", "16g") \
+            .config("spark.executor.heartbeatInterval", "60s") \
+            .getOrCreate()
+
+        spark.conf.set("spark.sql.debug.maxToStringFields", 500)
+
+        # Con caché columnar (python dataset_cache.py <csv>) no hay inferSchema
+        cache = find_cache(dataset_path)
+        if cache:
+            df = spark.read.parquet(cache)
+            print(f"✅ Dataset cargado desde la caché {cache}")
+        else:
+            df = spark.read.csv(dataset_path, header=True, inferSchema=True)
+            print(f"✅ Dataset cargado desde {dataset_path}")
+
+        # ─── Crear la nueva etiqueta multiclase "attack_type" ───────────────────
+        df = df.withColumn("attack_type", when(col("label") == 1, "Attack").otherwise("Normal"))
+
+        for col_name in numeric_features:
+            if col_name in df.columns:
+                df = df.withColumn(col_name, col(col_name).cast("double"))
+        print("✅ Columnas numéricas convertidas correctamente.")
+
+        df = df.fillna(-1, subset=numeric_features)
+
+        for col_name in categorical_features:
+            if col_name in df.columns:
+                print(f"Procesando StringIndexer para: {col_name}")
+                indexer = StringIndexer(inputCol=col_name, outputCol=f"{col_name}_index", handleInvalid="keep")
+                indexer_model = indexer.fit(df)
+                df = indexer_model.transform(df)
+                labels = indexer_model.labels
+                string_indexer_maps_for_export[col_name] = {label: float(i) for i, label in enumerate(labels)}
+
+        indexer_attack = StringIndexer(inputCol="attack_type", outputCol="target", handleInvalid="keep")
+        indexer_attack_model = indexer_attack.fit(df)
+        df = indexer_attack_model.transform(df)
+        attack_labels_list = indexer_attack_model.labels
+
+        # ─── Seleccionar características ───────────────────
+        final_feature_columns = [f for f in numeric_features if f != "label"] + \
+                                [f"{c}_index" for c in categorical_features if f"{c}_index" in df.columns]
+
+        (train_data, test_data) = df.randomSplit([0.8, 0.2], seed=42)
+
+        # Columnas crudas por Arrow directamente a float32/int32 (sin VectorAssembler
+        # ni listas de Python por fila)
+        with measure("Recogida train (Arrow)"):
+            X_train, y_train = spark_to_numpy(train_data, final_feature_columns)
+        with measure("Recogida test (Arrow)"):
+            X_test, y_test = spark_to_numpy(test_data, final_feature_columns)
+
+    for col_name, label_map in string_indexer_maps_for_export.items():
         map_filename = os.path.join(mapping_output_dir, f"string_indexer_{col_name}_map.json")
         with open(map_filename, 'w') as f:
             json.dump(label_map, f, indent=4)
         print(f"✅ Mapeo para '{col_name}' guardado en {map_filename}")
 
-indexer_attack = StringIndexer(inputCol="attack_type", outputCol="target", handleInvalid="keep")
-indexer_attack_model = indexer_attack.fit(df)
-df = indexer_attack_model.transform(df)
-
-attack_labels_list = indexer_attack_model.labels
-attack_map_filename = os.path.join(mapping_output_dir, "attack_type_map.json")
-attack_label_map_for_export = {label: float(i) for i, label in enumerate(attack_labels_list)}
-with open(attack_map_filename, 'w') as f:
-    json.dump(attack_label_map_for_export, f, indent=4)
-print(f"✅ Mapeo para 'attack_type' guardado en {attack_map_filename}")
-
-# ─── Seleccionar características y vectorizarlas ───────────────────
-final_feature_columns = [f for f in numeric_features if f != "label"] + \
-                        [f"{c}_index" for c in categorical_features if f"{c}_index" in df.columns]
-
-print(f"ℹ️  Características finales para el VectorAssembler: {final_feature_columns}")
-
-assembler = VectorAssembler(inputCols=final_feature_columns, outputCol="features_vector")
-df = assembler.transform(df)
-
-df = df.withColumn("target", col("target").cast("double"))
-
-(train_data, test_data) = df.randomSplit([0.8, 0.2], seed=42)
-
-train_pd = train_data.select("features_vector", "target").toPandas()
-test_pd = test_data.select("features_vector", "target").toPandas()
-
-X_train = np.array(train_pd["features_vector"].apply(lambda x: x.toArray()).tolist()).astype(np.float32)
-y_train = train_pd["target"].values.astype(np.int32)
-X_test = np.array(test_pd["features_vector"].apply(lambda x: x.toArray()).tolist()).astype(np.float32)
-y_test = test_pd["target"].values.astype(np.int32)
-
-# ─── Configuración de Hiperparámetros (alineado con el primer script) ─────
-param_grid = [
-    {
-        "n_estimators": 300,      
-        "max_depth": 20,           
-        "max_features": "sqrt",    
-        "min_samples_leaf": 9,    
-        "min_samples_split": 6    
-    },
-]
-
-cv = StratifiedKFold(n_splits=num_folds, shuffle=True, random_state=42)
-
-def evaluate_params(params, X, y, cv):
-    accuracies = []
-    fold_num = 1
-    for train_idx, val_idx in cv.split(X, y):
-        print(f"Evaluando fold {fold_num}/{cv.get_n_splits()}...")
-        model = cuRF(
-            n_estimators=params["n_estimators"],
-            max_depth=params["max_depth"],
-            max_features=params["max_features"],
-            min_samples_leaf=params.get("min_samples_leaf", None),
-            min_samples_split=params.get("min_samples_split", None)
-        )
-        model.fit(X[train_idx], y[train_idx])
-        y_pred = model.predict(X[val_idx])
-        accuracies.append(np.mean(y_pred == y[val_idx]))
-        fold_num += 1
-    return np.mean(accuracies)
-
-with parallel_backend("threading", n_jobs=-1):
-    results = Parallel()(
-        delayed(lambda p: (p, evaluate_params(p, X_train, y_train, cv)))(params)
-        for params in param_grid
-    )
-
-best_params, best_cv_accuracy = max(results, key=lambda x: x[1])
-print(f"Mejores hiperparámetros: {best_params} con precisión CV: {best_cv_accuracy*100:.2f}%")
-
-best_model = cuRF(
-    n_estimators=best_params["n_estimators"],
-    max_depth=best_params["max_depth"],
-    max_features=best_params["max_features"],
-    min_samples_leaf=best_params.get("min_samples_leaf", None),
-    min_samples_split=best_params.get("min_samples_split", None),
-)
-best_model.fit(X_train, y_train)
-
-y_test_pred = best_model.predict(X_test)
-test_accuracy = np.mean(y_test_pred == y_test)
-print(f"🎯 Precisión en conjunto de prueba: {test_accuracy*100:.2f}%")
-
-if "Normal" in attack_labels_list:
-    normal_idx = attack_labels_list.index("Normal")
-    attack_mask = y_test != normal_idx
-    if np.sum(attack_mask) > 0:
-        attack_type_accuracy = np.mean(y_test_pred[attack_mask] == y_test[attack_mask])
-    else:
-        attack_type_accuracy = 0.0
-else:
-    attack_type_accuracy = None
-
-output_dir = "Matriz_confusion"
-os.makedirs(output_dir, exist_ok=True)
-
-param_str = f"n{best_params['n_estimators']}_d{best_params['max_depth']}_f{best_params['max_features']}_l{best_params.get('min_samples_leaf', 'NA')}_s{best_params.get('min_samples_split', 'NA')}_cv{num_folds}"
-filename_base = os.path.join(output_dir, f"matriz_{param_str}_balanceado") # Modificado nombre base
-
-conf_matrix = confusion_matrix(y_test, y_test_pred)
-
-plt.figure(figsize=(6, 5))
-sns.heatmap(conf_matrix, annot=True, fmt="d", cmap="Blues",
-            xticklabels=attack_labels_list, yticklabels=attack_labels_list)
-plt.xlabel("Predicción")
-plt.ylabel("Real")
-plt.title(f"Matriz de Confusión ({param_str})")
-plt.tight_layout()
-if attack_type_accuracy is not None:
-    plt.text(0.5, -0.15, f"Precisión en tipo de ataque: {attack_type_accuracy*100:.2f}%",
-             transform=plt.gca().transAxes, fontsize=10, ha='center')
-plt.savefig(f"{filename_base}.png")
-plt.close()
-
-report = classification_report(y_test, y_test_pred, target_names=attack_labels_list)
-with open(f"{filename_base}.txt", "w", encoding="utf-8") as f:
-    f.write(f"Reporte de Clasificación - {param_str}\n\n")
-    f.write(f"Precisión General en Conjunto de Prueba: {test_accuracy*100:.2f}%\n")
-    if attack_type_accuracy is not None:
-        f.write(f"Precisión Específica en Tipos de Ataque (excluyendo 'Normal'): {attack_type_accuracy*100:.2f}%\n\n")
-    f.write(report)
-
-print(f"✅ Matriz de confusión guardada en {filename_base}.png")
-print(f"✅ Reporte de clasificación guardado en {filename_base}.txt")
-
-joblib.dump(best_model, "random_forest_gpu_model.pkl") # Se guarda con el mismo nombre
-print("✅ Modelo entrenado con Validación Cruzada (corregido) y guardado como 'random_forest_gpu_model.pkl'.")
-
-feature_order_filename = "model_feature_order.json"
-with open(feature_order_filename, 'w') as f:
-    json.dump(final_feature_columns, f, indent=4) # final_feature_columns ya está corregido
-print(f"✅ Orden de características del modelo guardado en {feature_order_filename}")
-
-spark.stop()
\ No newline at end of file
+    attack_map_filename = os.path.join(mapping_output_dir, "attack_type_map.json")
+    attack_label_map_for_export = {label: float(i) for i, label in enumerate(attack_labels_list)}
+    with open(attack_map_filename, 'w') as f:
+        json.dump(attack_label_map_for_export, f, indent=4)
+    print(f"✅ Mapeo para 'attack_type' guardado en {attack_map_filename}")
+
+    print(f"ℹ️  Características finales del modelo: {final_feature_columns}")
+    print(f"ℹ️  X_train {X_train.shape} {X_train.dtype} ({X_train.nbytes / 1e6:.0f} MB) · "
+          f"X_test {X_test.shape} · datos listos en {time.perf_counter() - t_start:.1f} s, "
+          f"pico RSS {peak_rss_mb():.0f} MB")
+
+    # ─── Configuración de Hiperparámetros (alineado con el primer script) ─────
+    param_grid = [
+        {
+            "n_estimators": 300,      
+            "max_depth": 20,           
+            "max_features": "sqrt",    
+            "min_samples_leaf": 9,    
+            "min_samples_split": 6    
+        },
+    ]
+
+    cv = StratifiedKFold(n_splits=num_folds, shuffle=True, random_state=42)
+
+    # Pares (parámetros, fold) repartidos entre workers, con successive halving
+    # si hay varios juegos; cada trabajo queda apuntado en cv_results.csv
+    cv_backend = os.getenv("CV_BACKEND", "gpu")
+    cv_workers = int(os.getenv("CV_WORKERS", 0)) or None
+    cv_eta     = float(os.getenv("CV_HALVING_ETA", 3))        # ≤ 1 → sin descarte
+    # Folds memorizados en experimentos/: repetir o ampliar el barrido solo calcula lo nuevo.
+    # El reparto se identifica por sus filas: con Spark la semilla no basta
+    store = ExperimentStore(dataset=source_hash(dataset_path), features=final_feature_columns,
+                            split=f"{loader}:42:{split_fingerprint(X_train, y_train)}",
+                            cv_seed=42, n_folds=num_folds, backend=cv_backend)
+    best_params, best_cv_accuracy = search(X_train, y_train, param_grid, cv, backend=cv_backend,
+                                           workers=cv_workers, eta=cv_eta, results_file="cv_results.csv",
+                                           store=store)
+    print(f"Mejores hiperparámetros: {best_params} con precisión CV: {best_cv_accuracy*100:.2f}%")
+
+    best_model = make_estimator(best_params, cv_backend)
+    best_model.fit(X_train, y_train)
+
+    y_test_pred = best_model.predict(X_test)
+    test_accuracy = np.mean(y_test_pred == y_test)
+    print(f"🎯 Precisión en conjunto de prueba: {test_accuracy*100:.2f}%")
+
+    param_str = param_string(best_params, num_folds)
+    write_report(y_test, y_test_pred, attack_labels_list, param_str, "Matriz_confusion")
+    # Predicciones en test guardadas: `python experiment_store.py report <clave>` rehace el informe
+    store.save_final(best_params, y_test, y_test_pred, attack_labels_list, best_cv_accuracy, test_accuracy)
+
+    # Solo el modelo cuML sirve para ML_BACKEND=gpu; el de scikit-learn
+    # (CV_BACKEND=cpu) se guarda aparte y no se anuncia en el manifiesto
+    model_filename = "random_forest_gpu_model.pkl" if cv_backend == "gpu" else "random_forest_sklearn_model.pkl"
+    joblib.dump(best_model, model_filename)
+    print(f"✅ Modelo entrenado con Validación Cruzada (corregido) y guardado como '{model_filename}'.")
+
+    flat = export_forest(best_model, "random_forest_flat.npz")
+    print(f"✅ Bosque aplanado para CPU ({flat.n_trees} árboles) guardado como 'random_forest_flat.npz' (ML_BACKEND=cpu)")
+
+    feature_order_filename = "model_feature_order.json"
+    with open(feature_order_filename, 'w') as f:
+        json.dump(final_feature_columns, f, indent=4) # final_feature_columns ya está corregido
+    print(f"✅ Orden de características del modelo guardado en {feature_order_filename}")
+
+    model_version = f"{time.strftime('%Y%m%d-%H%M%S')}_{param_str}"
+
+    # Paquete único para ml_processor.py: bosque + orden de características +
+    # mapas + clase "Attack" (StringIndexer la numera por frecuencia)
+    bundle_filename = "model_bundle.idsb"
+    write_bundle(bundle_filename, flat, final_feature_columns, string_indexer_maps_for_export,
+                 version=model_version,
+                 attack_class=attack_labels_list.index("Attack"),
+                 metadata={
+                     "params": best_params,
+                     "cv_accuracy": float(best_cv_accuracy),
+                     "test_accuracy": float(test_accuracy),
+                     "cv_folds": num_folds,
+                     "dataset": dataset_path,
+                     "labels": list(attack_labels_list),
+                     "train_rows": int(len(y_train)),
+                 })
+    print(f"✅ Paquete del modelo guardado en {bundle_filename}")
+
+    # El manifiesto se escribe el último: ml_processor.py recarga el modelo en
+    # caliente cuando ve una versión nueva (ML_ARTIFACTS_DIR)
+    manifest = {
+        "version": model_version,
+        "bundle": bundle_filename,
+        "cpu_model": "random_forest_flat.npz",
+        "feature_order": feature_order_filename,
+        "maps_dir": mapping_output_dir,
+    }
+    if cv_backend == "gpu":
+        manifest["gpu_model"] = model_filename
+    with open("manifest.json.tmp", "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace("manifest.json.tmp", "manifest.json")
+    print(f"✅ Manifiesto del modelo {manifest['version']} guardado en manifest.json")
+
+    if loader != "arrow":
+        spark.stop()
+
+
+if __name__ == "__main__":
+    main()
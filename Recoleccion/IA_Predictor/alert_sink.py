@@ -0,0 +1,206 @@
+"""
+Salida de alertas de ml_processor en su propio hilo.
+
+process_batch solo encola una lista de tuplas por lote; este hilo formatea
+las líneas, las escribe en bloque (consola y fichero de ataques siempre
+abierto), rota el fichero por tamaño o antigüedad, agrupa alertas repetidas
+del mismo par saddr→daddr dentro de una ventana y, opcionalmente, publica
+los ataques en una lista Redis con un pipeline por lote.
+"""
+import json
+import os
+import sys
+import time
+from queue import Queue, Empty
+from threading import Thread
+from typing import Callable, Dict, List, Optional, Tuple
+
+# (tipo, saddr, sport, daddr, dport, prob, latencia, motivo, versión del modelo)
+# · tipo: "attack" | "ignored" | "normal"
+Alert = Tuple[str, str, str, str, str, float, float, str, str]
+
+NORMAL_MODES = ("all", "summary", "none")
+
+
+class RotatingFile:
+    """Fichero en modo append que rota a `path.1`, `path.2`… por tamaño o tiempo."""
+
+    def __init__(self, path: str, max_bytes: int = 0, max_age: float = 0, backups: int = 5):
+        self.path      = path
+        self.max_bytes = max_bytes
+        self.max_age   = max_age
+        self.backups   = backups
+        self._open()
+
+    def _open(self):
+        self.fh = open(self.path, "a", encoding="utf-8")
+        self.size = self.fh.tell()
+        self.opened = time.time()
+
+    def _due(self) -> bool:
+        if self.max_bytes and self.size >= self.max_bytes:
+            return True
+        return bool(self.max_age) and self.size > 0 and time.time() - self.opened >= self.max_age
+
+    def rotate(self):
+        self.fh.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def write(self, text: str):
+        if not text:
+            return
+        if self._due():
+            self.rotate()
+        self.fh.write(text)
+        self.fh.flush()
+        self.size += len(text.encode("utf-8"))
+
+    def close(self):
+        self.fh.close()
+
+
+class AlertSink:
+    """
+    Hilo consumidor de alertas.
+
+    - `normal`: "all" imprime cada flujo normal, "summary" una línea con el
+      recuento cada `summary_every` s, "none" nada.
+    - `window` > 0: dentro de la ventana solo se informa la primera alerta de
+      cada par saddr→daddr; al cerrarla se imprime cuántas se agruparon.
+    - La cola está acotada: si el hilo no da abasto, `emit` bloquea
+      (contrapresión) en lugar de perder alertas.
+    - `done` (opcional en `emit`) se llama desde este hilo cuando el lote
+      ya está escrito: ml_processor confirma ahí (XACK) los mensajes.
+    """
+
+    def __init__(self, attack_log: str, threshold: float, normal: str = "all",
+                 window: float = 0.0, max_bytes: int = 0, max_age: float = 0,
+                 backups: int = 5, redis_client=None, redis_key: str = "",
+                 queue_size: int = 256, flush_interval: float = 0.2,
+                 summary_every: float = 10.0):
+        if normal not in NORMAL_MODES:
+            raise ValueError(f"normal debe ser uno de {NORMAL_MODES}: {normal!r}")
+        self.threshold      = threshold
+        self.normal         = normal
+        self.window         = window
+        self.redis          = redis_client if redis_key else None
+        self.redis_key      = redis_key
+        self.flush_interval = flush_interval
+        self.summary_every  = summary_every
+        self.log            = RotatingFile(attack_log, max_bytes, max_age, backups)
+
+        self._q: "Queue[Optional[Tuple[List[Alert], Optional[Callable[[], None]]]]]" = Queue(maxsize=queue_size)
+        self._seen: Dict[Tuple[str, str], List] = {}   # (sip, dip) → [inicio ventana, agrupadas]
+        self._normal_count = 0
+        self._last_summary = time.time()
+        self._last_sweep   = time.time()
+        self._thread = Thread(target=self._run, name="alert-sink", daemon=True)
+        self._thread.start()
+
+    # ───────── lado productor ─────────
+    def emit(self, alerts: List[Alert], done: Optional[Callable[[], None]] = None):
+        if alerts or done:
+            self._q.put((alerts, done))
+
+    def close(self):
+        self._q.put(None)
+        self._thread.join()
+
+    # ───────── hilo ─────────
+    def _run(self):
+        running = True
+        while running:
+            batches = []
+            try:
+                batches.append(self._q.get(timeout=self.flush_interval))
+                while True:
+                    batches.append(self._q.get_nowait())
+            except Empty:
+                pass
+            if None in batches:
+                running = False
+                batches = batches[:batches.index(None)]
+            self._write([a for alerts, _ in batches for a in alerts])
+            for _, done in batches:
+                if done is not None:
+                    try:
+                        done()
+                    except Exception as e:
+                        sys.stderr.write(f"[WARN] Confirmación del lote: {e}\n")
+        self._write([], final=True)
+        self.log.close()
+
+    def _throttled(self, sip: str, dip: str, now: float) -> bool:
+        """True si el par ya alertó en la ventana actual (y se cuenta como agrupada)."""
+        if self.window <= 0:
+            return False
+        entry = self._seen.get((sip, dip))
+        if entry is None or now - entry[0] >= self.window:
+            self._seen[(sip, dip)] = [now, 0]
+            return False
+        entry[1] += 1
+        return True
+
+    def _expired_windows(self, now: float, final: bool) -> List[str]:
+        lines = []
+        for pair, (start, count) in list(self._seen.items()):
+            if final or now - start >= self.window:
+                if count:
+                    lines.append(f"🔁 {count} alertas más {pair[0]} -> {pair[1]} "
+                                 f"en {self.window:.0f}s\n")
+                del self._seen[pair]
+        return lines
+
+    def _write(self, alerts: List[Alert], final: bool = False):
+        now = time.time()
+        out, err, log, pub = [], [], [], []
+
+        for kind, sip, sp, dip, dp, prob, latency, reason, version in alerts:
+            arrow = f"{sip}:{sp} -> {dip}:{dp}"
+            if kind == "normal":
+                if self.normal == "all":
+                    out.append(f"✅ Normal conf={prob:.3f} lat={latency:.3f}s {arrow}\n")
+                else:
+                    self._normal_count += 1
+            elif kind == "ignored":
+                out.append(f"⏩ IGNORADO({reason}) {arrow} lat={latency:.3f}s\n")
+            elif not self._throttled(sip, dip, now):
+                tag = "🚨" if prob >= self.threshold else "⚠️"
+                dest = err if prob >= self.threshold else out
+                dest.append(f"{tag} Ataque conf={prob:.3f} {arrow} lat={latency:.3f}s modelo={version}\n")
+                log.append(f"{arrow}\n")
+                if self.redis is not None:
+                    pub.append(json.dumps({"ts": now, "saddr": sip, "sport": sp, "daddr": dip,
+                                           "dport": dp, "prob": round(prob, 4),
+                                           "latency": round(latency, 3), "model": version}))
+
+        if self.window > 0 and (final or now - self._last_sweep >= 1.0):
+            out.extend(self._expired_windows(now, final))
+            self._last_sweep = now
+        if self.normal == "summary" and self._normal_count and \
+                (final or now - self._last_summary >= self.summary_every):
+            out.append(f"✅ {self._normal_count} flujos normales en {now - self._last_summary:.0f}s\n")
+            self._normal_count = 0
+            self._last_summary = now
+
+        if out:
+            sys.stdout.write("".join(out))
+            sys.stdout.flush()
+        if err:
+            sys.stderr.write("".join(err))
+            sys.stderr.flush()
+        self.log.write("".join(log))
+        if pub:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.rpush(self.redis_key, *pub)
+                pipe.execute()
+            except Exception as e:
+                sys.stderr.write(f"[WARN] Redis alertas: {e}\n")
@@ -0,0 +1,225 @@
+"""
+Conversión vectorizada de lotes CSV (merge_data_stream) a la matriz de
+entrada del modelo, solo con NumPy (válida en máquinas sin GPU).
+
+El lote se une y se parte una única vez; cada columna numérica se toma
+como un corte de esa lista plana y se convierte entera en C con
+`np.array(..., dtype=float64)`, y las categóricas (`proto`, `state`) se
+resuelven con una pasada de diccionario por columna. Produce exactamente la
+misma matriz que el relleno campo a campo anterior de `build_gpu_batch`.
+
+Con MERGE_FORMAT=record el merge publica registros binarios de tamaño fijo
+(RECORD_DTYPE) en vez de líneas CSV: el lote se une con b"".join y se lee
+con un único np.frombuffer, sin parsear texto.
+"""
+import json, os, socket
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+CSV_COLUMNS = (
+    "stime,proto,saddr,sport,daddr,dport,state,ltime,spkts,dpkts,sbytes,dbytes,"
+    "sttl,dttl,sload,dload,sloss,dloss,sintpkt,dintpkt,sjit,djit,stcpb,dtcpb,"
+    "tcprtt,synack,ackdat,smeansz,dmeansz,dur,"
+    "ct_state_ttl,ct_flw_http_mthd,is_ftp_login,ct_ftp_cmd,"
+    "ct_srv_src,ct_srv_dst,ct_dst_ltm,ct_src_ltm,"
+    "ct_src_dport_ltm,ct_dst_sport_ltm,ct_dst_src_ltm"
+)
+COLS    = CSV_COLUMNS.split(',')
+COL_IDX = {c: i for i, c in enumerate(COLS)}
+
+NUMERIC_COLS     = [
+    "sport","dport","dur","sbytes","dbytes","sttl","dttl","sloss","dloss",
+    "sload","dload","spkts","dpkts","stcpb","dtcpb","smeansz","dmeansz",
+    "sjit","djit","stime","ltime","sintpkt","dintpkt","tcprtt","synack","ackdat"
+]
+CATEGORICAL_COLS = ["proto", "state"]
+
+# Registro binario del merge: columnas en el orden de COLS, little-endian y
+# sin relleno. stime/ltime f8, proto/state u2 (índice en el vocabulario del
+# merge, len(vocabulario) si es desconocida), IPs 16 bytes (IPv4 como
+# ::ffff:a.b.c.d) y el resto f4.
+# Copia de merge_argus_zeek.RECORD_FIELDS: deben coincidir.
+RECORD_FIELDS = tuple(
+    (col, "<f8" if col in ("stime", "ltime") else "<u2" if col in CATEGORICAL_COLS
+     else "S16" if col in ("saddr", "daddr") else "<f4")
+    for col in COLS
+)
+RECORD_DTYPE = np.dtype(list(RECORD_FIELDS))
+V4_MAPPED    = b"\0" * 10 + b"\xff\xff"
+
+
+def str2f(txt):
+    try:
+        return float(txt)
+    except:
+        return 0.0
+
+
+def default_sources(feat_order: Sequence[str]) -> Dict[str, str]:
+    """
+    Columna CSV de la que sale cada característica, tal y como se rellenaba
+    hasta ahora: las NUMERIC_COLS (dport → "dsport" si el modelo la llama
+    así) y `<cat>_index` para las categóricas. El resto queda a 0.
+    """
+    feats = set(feat_order)
+    sources = {}
+    for col in NUMERIC_COLS:
+        name = "dsport" if (col == "dport" and "dsport" in feats) else col
+        if name in feats:
+            sources[name] = col
+    for cat in CATEGORICAL_COLS:
+        sources[f"{cat}_index"] = cat
+    return sources
+
+
+class BatchParser:
+    """
+    Precalcula los índices columna CSV → característica para `feat_order`.
+
+    `sources` (característica → columna CSV) viene del paquete del modelo;
+    sin él se usa default_sources. `vocab` (categórica → palabras en el
+    orden de los códigos del merge) permite leer registros binarios.
+    """
+
+    def __init__(self, feat_order: Sequence[str], str_maps: Dict[str, Dict[str, float]],
+                 sources: Optional[Dict[str, str]] = None,
+                 vocab: Optional[Dict[str, Sequence[str]]] = None):
+        feat2idx = {f: i for i, f in enumerate(feat_order)}
+        self.n_feats = len(feat_order)
+        if sources is None:
+            sources = default_sources(feat_order)
+
+        src, dst = [], []
+        # (columna CSV, característica, mapa, valor para categorías desconocidas)
+        self.cats = []
+        for feat, col in sources.items():
+            if col in CATEGORICAL_COLS:
+                self.cats.append((COL_IDX[col], feat2idx[feat], str_maps[col], float(len(str_maps[col]))))
+            elif feat in feat2idx:
+                src.append(COL_IDX[col])
+                dst.append(feat2idx[feat])
+        self.num_src = np.array(src, dtype=np.intp)
+        self.num_dst = np.array(dst, dtype=np.intp)
+
+        # Registros binarios: código del merge → valor del modelo (tabla
+        # con una entrada más, la de desconocida, para códigos fuera de rango)
+        self.record_cats = []
+        if vocab:
+            for src, dst, mapping, unknown in self.cats:
+                words = vocab[COLS[src]]
+                lut = np.array([mapping.get(w, unknown) for w in words] + [unknown], dtype=np.float32)
+                self.record_cats.append((COLS[src], dst, lut))
+
+    def split(self, lines: List[str]) -> List[str]:
+        """Campos de todo el lote en una lista plana de n * len(COLS) cadenas."""
+        n_cols = len(COLS)
+        fields = ",".join(lines).split(",")
+        if len(fields) == len(lines) * n_cols:
+            return fields
+        # Alguna línea con más o menos campos: se ajusta una a una
+        fields = []
+        for line in lines:
+            f = line.split(',')
+            fields.extend((f + [""] * n_cols)[:n_cols])
+        return fields
+
+    def parse(self, lines: List, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Rellena `out[:n]` (o una matriz nueva) y devuelve la vista de n filas."""
+        n = len(lines)
+        if out is None:
+            out = np.zeros((n, self.n_feats), dtype=np.float32)
+        else:
+            out = out[:n]
+            out.fill(0.0)
+        if not n:
+            return out
+        if isinstance(lines[0], bytes):
+            return self.parse_records(lines, out)
+
+        n_cols = len(COLS)
+        fields = self.split(lines)
+        for src, dst in zip(self.num_src, self.num_dst):
+            col = fields[src::n_cols]
+            if "" in col:
+                # Campos vacíos (sjit, sintpkt… sin muestras): str2f → 0.0
+                col = [v or "0" for v in col]
+            try:
+                # Conversión en C de toda la columna
+                out[:, dst] = np.array(col, dtype=np.float64)
+            except ValueError:
+                # "None", puertos hex…: semántica de str2f (→ 0.0)
+                out[:, dst] = [str2f(v) for v in col]
+
+        for src, dst, mapping, unknown in self.cats:
+            out[:, dst] = [mapping.get(v, unknown) for v in fields[src::n_cols]]
+        return out
+
+    def parse_records(self, records: List[bytes], out: np.ndarray) -> np.ndarray:
+        """Como parse, para registros binarios del merge (ver RECORD_DTYPE)."""
+        if not self.record_cats and self.cats:
+            raise ValueError("BatchParser sin vocabulario: no puede leer registros binarios")
+        recs = as_records(records)
+        for src, dst in zip(self.num_src, self.num_dst):
+            col = recs[COLS[src]]
+            if col.dtype.kind == "f" and col.dtype.itemsize == 8:
+                # stime/ltime no numéricos viajan como NaN: str2f → 0.0
+                col = np.where(np.isnan(col), 0.0, col)
+            out[:, dst] = col
+        for col, dst, lut in self.record_cats:
+            out[:, dst] = lut[np.minimum(recs[col], len(lut) - 1)]
+        return out
+
+
+def as_records(records: List[bytes]) -> np.ndarray:
+    """Vista estructurada (RECORD_DTYPE) de un lote de registros binarios."""
+    buf = b"".join(records)
+    if len(buf) != len(records) * RECORD_DTYPE.itemsize:
+        raise ValueError(f"registros de tamaño inesperado (se esperan {RECORD_DTYPE.itemsize} bytes)")
+    return np.frombuffer(buf, dtype=RECORD_DTYPE)
+
+
+def unpack_ip(raw: bytes) -> str:
+    # S16 pierde los ceros finales: se recuperan antes de decodificar
+    raw = raw.ljust(16, b"\0")
+    if raw.startswith(V4_MAPPED):
+        return socket.inet_ntoa(raw[12:])
+    if not any(raw):
+        return ""
+    return socket.inet_ntop(socket.AF_INET6, raw)
+
+
+def alert_fields(lines: List) -> Tuple[list, list, list, list, list]:
+    """
+    (saddr, sport, daddr, dport, stime) de cada flujo del lote, en CSV o en
+    registros binarios: IPs y puertos como texto, stime como float (None si
+    no es numérico).
+    """
+    if lines and isinstance(lines[0], bytes):
+        recs = as_records(lines)
+        sips = [unpack_ip(ip) for ip in recs["saddr"].tolist()]
+        dips = [unpack_ip(ip) for ip in recs["daddr"].tolist()]
+        sports, dports = ([str(p) for p in np.nan_to_num(recs[c], nan=0.0, posinf=0.0, neginf=0.0)
+                           .astype(np.int64).tolist()] for c in ("sport", "dport"))
+        stimes = [None if t != t else t for t in recs["stime"].tolist()]
+        return sips, sports, dips, dports, stimes
+
+    fields = [raw.split(',') for raw in lines]
+    stimes = []
+    for f in fields:
+        try:
+            stimes.append(float(f[COL_IDX['stime']]))
+        except ValueError:
+            stimes.append(None)
+    return ([f[COL_IDX['saddr']] for f in fields], [f[COL_IDX['sport']] for f in fields],
+            [f[COL_IDX['daddr']] for f in fields], [f[COL_IDX['dport']] for f in fields], stimes)
+
+
+def load_vocab(maps_dir: str) -> Dict[str, List[str]]:
+    """Vocabulario del merge (string_indexer_<cat>_map.json): palabras por código."""
+    vocab = {}
+    for cat in CATEGORICAL_COLS:
+        with open(os.path.join(maps_dir, f"string_indexer_{cat}_map.json")) as fh:
+            mapping = json.load(fh)
+        vocab[cat] = sorted(mapping, key=lambda w: mapping[w])
+    return vocab
@@ -0,0 +1,185 @@
+"""
+Planificador adaptativo de micro-lotes para ml_processor.
+
+En lugar de llenar siempre GPU_BATCH filas o esperar 1 s, cada lote se
+cierra al llegar a un tamaño objetivo o al agotar una espera máxima contada
+desde la llegada de su primera fila. Ambos valores se recalculan cada
+`adjust_every` segundos:
+
+- espera: baja ×0.7 si el p99 de latencia local (desde que el lector
+  recibe la línea hasta que termina la inferencia) supera el SLO y sube
+  poco a poco mientras quede margen, como máximo SLO/2;
+- tamaño: lo que llega en una espera al ritmo medido, limitado por
+  GPU_BATCH_MAX y por el coste de inferencia estimado (a + b·n ≤ SLO/2).
+  Si la cola acumula más filas, se vacía de golpe hasta ese límite.
+
+La latencia local se mide con el reloj de esta máquina; la de extremo a
+extremo (desde `stime`) se exporta también, pero depende de los relojes
+de Argus.
+"""
+import json
+import os
+import time
+from queue import Queue, Empty
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+Item = Tuple[float, str]   # (time.monotonic() de llegada, línea CSV)
+
+
+class LatencyHistogram:
+    """Histograma acumulado con cubos fijos (segundos)."""
+    BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.counts = np.zeros(len(self.BOUNDS) + 1, dtype=np.int64)
+
+    def add(self, values: np.ndarray):
+        idx = np.searchsorted(self.BOUNDS, values, side="left")
+        self.counts += np.bincount(idx, minlength=len(self.counts))
+
+    def to_dict(self) -> dict:
+        labels = [f"≤{b:g}s" for b in self.BOUNDS] + [f">{self.BOUNDS[-1]:g}s"]
+        return dict(zip(labels, self.counts.tolist()))
+
+    def __str__(self) -> str:
+        return " ".join(f"{k}:{v}" for k, v in self.to_dict().items() if v)
+
+
+class AdaptiveBatcher:
+    def __init__(self, slo: float, max_batch: int, initial_batch: int = 1024,
+                 min_batch: int = 16, adjust_every: float = 0.5,
+                 stats_every: float = 10.0, stats_file: str = ""):
+        self.slo          = slo
+        self.max_batch    = max_batch
+        self.min_batch    = min(min_batch, max_batch)
+        self.target       = max(self.min_batch, min(initial_batch, max_batch))
+        self.max_wait     = slo / 4
+        self.adjust_every = adjust_every
+        self.stats_every  = stats_every
+        self.stats_file   = stats_file
+        self.closed       = False   # el lector envió el centinela None
+
+        # Coste de inferencia t ≈ a + b·n (medias exponenciales de n, t, n², n·t)
+        self._m = None
+        self.cost_a, self.cost_b = 0.0, 0.0
+
+        self.hist_local = LatencyHistogram()
+        self.hist_e2e   = LatencyHistogram()
+        self._win_lat: List[np.ndarray] = []
+        self._win_rows = 0
+        self._win_start = self._last_stats = time.monotonic()
+        self._stats_rows = self._stats_batches = 0
+        self._stats_infer = 0.0
+        self._queue_depth = 0
+
+    # ───────── recogida del lote ─────────
+    def collect(self, q: "Queue[Optional[Item]]", timeout: float = 1.0) -> List[Item]:
+        """Devuelve el siguiente lote ([] si no llegó nada en `timeout`)."""
+        try:
+            first = q.get(timeout=timeout)
+        except Empty:
+            return []
+        if first is None:
+            self.closed = True
+            return []
+
+        self._queue_depth = q.qsize()
+        # Con atasco se vacía la cola hasta el límite de coste sin esperar
+        target = max(self.target, min(self._queue_depth + 1, self._size_cap()))
+        deadline = first[0] + self.max_wait
+        items = [first]
+        while len(items) < target:
+            remaining = deadline - time.monotonic()
+            try:
+                itm = q.get_nowait() if remaining <= 0 else q.get(timeout=remaining)
+            except Empty:
+                break
+            if itm is None:
+                self.closed = True
+                break
+            items.append(itm)
+        return items
+
+    # ───────── realimentación ─────────
+    def record(self, arrivals: Sequence[float], infer_seconds: float, e2e: np.ndarray):
+        """Se llama tras cada lote con las llegadas, el tiempo de inferencia y las latencias desde stime."""
+        now = time.monotonic()
+        local = now - np.asarray(arrivals, dtype=np.float64)
+        self.hist_local.add(local)
+        self.hist_e2e.add(np.asarray(e2e, dtype=np.float64))
+        self._win_lat.append(local)
+        self._win_rows += len(local)
+        self._update_cost(len(local), infer_seconds)
+
+        self._stats_rows += len(local)
+        self._stats_batches += 1
+        self._stats_infer += infer_seconds
+
+        if now - self._win_start >= self.adjust_every:
+            self._adjust(now)
+        if now - self._last_stats >= self.stats_every:
+            self._report(now)
+
+    def _update_cost(self, n: int, t: float, alpha: float = 0.05):
+        x = np.array([n, t, n * n, n * t], dtype=np.float64)
+        self._m = x if self._m is None else (1 - alpha) * self._m + alpha * x
+        mn, mt, mnn, mnt = self._m
+        var = mnn - mn * mn
+        if var > 1e-9 * max(mnn, 1.0):
+            self.cost_b = max((mnt - mn * mt) / var, 0.0)
+            self.cost_a = max(mt - self.cost_b * mn, 0.0)
+        else:
+            # Siempre el mismo tamaño: todo el coste se atribuye a las filas
+            self.cost_a, self.cost_b = 0.0, mt / max(mn, 1.0)
+
+    def _size_cap(self) -> int:
+        budget = self.slo / 2 - self.cost_a
+        if self.cost_b <= 0:
+            return self.max_batch
+        return int(max(self.min_batch, min(self.max_batch, budget / self.cost_b)))
+
+    def _adjust(self, now: float):
+        p99 = float(np.percentile(np.concatenate(self._win_lat), 99))
+        if p99 > self.slo:
+            self.max_wait *= 0.7
+        elif p99 < 0.7 * self.slo:
+            self.max_wait = self.max_wait * 1.2 + 0.0005
+        self.max_wait = min(max(self.max_wait, 0.001), self.slo / 2)
+
+        rate = self._win_rows / (now - self._win_start)
+        self.target = max(self.min_batch, min(int(rate * self.max_wait) + 1, self._size_cap()))
+        self._win_lat.clear()
+        self._win_rows = 0
+        self._win_start = now
+
+    # ───────── exportación ─────────
+    def snapshot(self) -> dict:
+        return {
+            "slo_s"          : self.slo,
+            "batch_target"   : self.target,
+            "batch_cap"      : self._size_cap(),
+            "max_wait_ms"    : round(self.max_wait * 1000, 2),
+            "cost_ms"        : {"a": round(self.cost_a * 1000, 3), "b_per_row": round(self.cost_b * 1000, 5)},
+            "queue_depth"    : self._queue_depth,
+            "latency_local"  : self.hist_local.to_dict(),
+            "latency_e2e"    : self.hist_e2e.to_dict(),
+        }
+
+    def _report(self, now: float):
+        elapsed = now - self._last_stats
+        mean_batch = self._stats_rows / max(self._stats_batches, 1)
+        mean_infer = self._stats_infer / max(self._stats_batches, 1)
+        print(f"[SCHED] {self._stats_rows / elapsed:.0f} filas/s, lote medio={mean_batch:.0f} "
+              f"(objetivo {self.target}, tope {self._size_cap()}), espera={self.max_wait * 1000:.1f}ms, "
+              f"inferencia={mean_infer * 1000:.1f}ms, cola={self._queue_depth}")
+        print(f"[SCHED] latencia local {self.hist_local}")
+        if self.stats_file:
+            tmp = f"{self.stats_file}.tmp"
+            with open(tmp, "w") as fh:
+                json.dump(self.snapshot(), fh, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.stats_file)
+        self._stats_rows = self._stats_batches = 0
+        self._stats_infer = 0.0
+        self._last_stats = now
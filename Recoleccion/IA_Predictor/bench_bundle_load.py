@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Arranque de ml_processor según el formato del modelo: cada carga se mide en
+un proceso nuevo (tiempo hasta el primer lote predicho y RSS máximo):
+
+    pkl     joblib + model_feature_order.json + string_indexer_maps/
+    npz     FlatForest.load + los mismos JSON
+    bundle  model_bundle.load_bundle (un fichero, arrays por mmap)
+
+Si no existe, crea el paquete a partir del npz y los JSON, y comprueba que
+las tres vías dan las mismas probabilidades.
+
+Uso (desde este directorio, con los artefactos exportados por train_rf.py):
+    python bench_bundle_load.py [--pkl random_forest_gpu_model.pkl]
+                                [--flat random_forest_flat.npz]
+                                [--bundle model_bundle.idsb] [--runs 5]
+"""
+import argparse, json, os, random, resource, subprocess, sys, time
+
+import numpy as np
+
+from batch_parser import BatchParser, CATEGORICAL_COLS
+from bench_batch_parser import synthetic_lines
+
+
+def load_maps(maps_dir):
+    return {cat: json.load(open(os.path.join(maps_dir, f"string_indexer_{cat}_map.json")))
+            for cat in CATEGORICAL_COLS}
+
+
+def load(kind, args):
+    """Devuelve (parser, predict(X) → P(ataque)) para la vía `kind`."""
+    if kind == "bundle":
+        from model_bundle import load_bundle
+        b = load_bundle(args.bundle)
+        return BatchParser(b.feature_order, b.maps, b.sources), b.predict_attack
+    feat_order = json.load(open(args.feature_order))
+    parser = BatchParser(feat_order, load_maps(args.maps_dir))
+    if kind == "pkl":
+        import joblib
+        model = joblib.load(args.pkl)
+        return parser, lambda X: np.asarray(model.predict_proba(X))[:, 1]
+    from forest_cpu import FlatForest
+    forest = FlatForest.load(args.flat)
+    return parser, lambda X: forest.predict_proba(X)[:, 1]
+
+
+def child(kind, args):
+    # Proceso hijo: importar, cargar y predecir un lote; imprime una línea JSON
+    t0 = time.perf_counter()
+    parser, predict = load(kind, args)
+    t_load = time.perf_counter() - t0
+    proba = predict(parser.parse(synthetic_lines(args.rows, random.Random(5))))
+    t_first = time.perf_counter() - t0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"load": t_load, "first": t_first, "rss": rss,
+                      "proba": proba.astype(float).tolist()}))
+
+
+def build_bundle(args):
+    from forest_cpu import FlatForest
+    from model_bundle import write_bundle
+    write_bundle(args.bundle, FlatForest.load(args.flat), json.load(open(args.feature_order)),
+                 load_maps(args.maps_dir), version="bench")
+    print(f"📦 Paquete creado: {args.bundle} ({os.path.getsize(args.bundle) / 1e6:.1f} MB)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Tiempo de arranque por formato de modelo")
+    ap.add_argument("--pkl", default="random_forest_gpu_model.pkl")
+    ap.add_argument("--flat", default="random_forest_flat.npz")
+    ap.add_argument("--bundle", default="model_bundle.idsb")
+    ap.add_argument("--feature-order", default="model_feature_order.json")
+    ap.add_argument("--maps-dir", default="string_indexer_maps")
+    ap.add_argument("--rows", type=int, default=256)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--child", choices=("pkl", "npz", "bundle"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        return child(args.child, args)
+    if not os.path.exists(args.bundle):
+        build_bundle(args)
+
+    kinds = [k for k, p in (("pkl", args.pkl), ("npz", args.flat), ("bundle", args.bundle))
+             if os.path.exists(p)]
+    results = {}
+    for kind in kinds:
+        runs = []
+        for _ in range(args.runs):
+            out = subprocess.run([sys.executable, __file__, *sys.argv[1:], "--child", kind],
+                                 check=True, capture_output=True, text=True).stdout
+            runs.append(json.loads(out.strip().splitlines()[-1]))
+        results[kind] = runs
+        med = lambda key: float(np.median([r[key] for r in runs]))
+        print(f"{kind:>6}: carga {med('load') * 1e3:>8.1f} ms · primer lote "
+              f"{med('first') * 1e3:>8.1f} ms · RSS {med('rss'):>7.1f} MB")
+
+    ref = np.array(results[kinds[0]][0]["proba"])
+    for kind in kinds[1:]:
+        if not np.allclose(results[kind][0]["proba"], ref, atol=1e-6):
+            raise SystemExit(f"❌ {kind}: probabilidades distintas de {kinds[0]}")
+    print(f"✅ Probabilidades idénticas en {', '.join(kinds)}")
+
+
+if __name__ == "__main__":
+    main()
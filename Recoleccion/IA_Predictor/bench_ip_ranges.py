@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Compara la cadena anterior de exclusión por rangos (ip_in_net con
+`ipaddress` para Meta, GCloud, AWS, Google, Canonical y SUSE) con el
+RangeIndex compilado sobre un lote sintético: verifica que el motivo es el
+mismo para cada flujo y muestra flujos/s de cada uno.
+
+La versión anterior es demasiado lenta para el lote completo; se mide
+sobre las primeras --legacy_rows filas.
+
+Uso:
+    python bench_ip_ranges.py [--rows 100000] [--legacy_rows 2000]
+"""
+import argparse, ipaddress, random, time
+
+from ip_ranges import META_IP, RangeIndex
+
+# Tamaños aproximados de las listas IPv4 publicadas por cada proveedor
+SIZES = {"gcloud": 900, "aws": 8000, "ggen": 90}
+FIXED = {
+    "canonical": ["185.125.188.0/22", "91.189.88.0/21"],
+    "suse"     : ["195.135.223.0/24"],
+}
+ORDER = [("Meta", None), ("GCloud", "gcloud"), ("AWS", "aws"),
+         ("Google", "ggen"), ("Canonical", "canonical"), ("SUSE", "suse")]
+
+
+def synthetic_networks(rng):
+    nets = {}
+    for key, n in SIZES.items():
+        nets[key] = [
+            ipaddress.ip_network(f"{rng.randint(1, 223)}.{rng.randint(0, 255)}."
+                                 f"{rng.randint(0, 255)}.0/{rng.randint(12, 28)}", strict=False)
+            for _ in range(n)
+        ]
+    for key, cidrs in FIXED.items():
+        nets[key] = [ipaddress.ip_network(c) for c in cidrs]
+    return nets
+
+
+def synthetic_ips(n, nets, rng):
+    """Mezcla de IPs privadas, públicas al azar, dentro de rangos y no IPv4."""
+    all_nets = [net for lst in nets.values() for net in lst]
+    ips = []
+    for _ in range(n):
+        k = rng.random()
+        if k < 0.3:
+            net = rng.choice(all_nets)
+            ips.append(str(net.network_address + rng.randrange(net.num_addresses)))
+        elif k < 0.35:
+            ips.append(META_IP)
+        elif k < 0.37:
+            ips.append(rng.choice(["::1", "fe80::1", "", "0"]))
+        elif k < 0.6:
+            ips.append(f"10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}")
+        else:
+            ips.append(str(ipaddress.IPv4Address(rng.getrandbits(32))))
+    return ips
+
+
+def legacy_reason(nets, sip, dip):
+    """Cadena if/elif de la versión anterior de process_batch."""
+    def ip_in_net(key, ipstr):
+        try:
+            ip = ipaddress.ip_address(ipstr)
+            return any(ip in net for net in nets[key])
+        except ValueError:
+            return False
+
+    if sip == META_IP or dip == META_IP:
+        return "Meta"
+    for reason, key in ORDER[1:]:
+        if ip_in_net(key, sip) or ip_in_net(key, dip):
+            return reason
+    return ""
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark del índice de rangos excluidos")
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--legacy_rows", type=int, default=2000)
+    ap.add_argument("--seed", type=int, default=3)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    nets = synthetic_networks(rng)
+    sips = synthetic_ips(args.rows, nets, rng)
+    dips = synthetic_ips(args.rows, nets, rng)
+
+    t0 = time.perf_counter()
+    index = RangeIndex.build((r, [META_IP] if k is None else nets[k]) for r, k in ORDER)
+    t_build = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    got = index.reasons_for(sips, dips)
+    t_new = time.perf_counter() - t0
+
+    m = min(args.legacy_rows, args.rows)
+    t0 = time.perf_counter()
+    ref = [legacy_reason(nets, s, d) for s, d in zip(sips[:m], dips[:m])]
+    t_old = time.perf_counter() - t0
+
+    if got[:m] != ref:
+        bad = next(i for i, (a, b) in enumerate(zip(got, ref)) if a != b)
+        raise SystemExit(f"❌ Motivo distinto en la fila {bad}: {got[bad]!r} ≠ {ref[bad]!r}")
+
+    print(f"Redes: {sum(len(v) for v in nets.values())} → {len(index)} segmentos "
+          f"(compilado en {t_build * 1000:.0f} ms)")
+    print(f"ip_in_net   : {m / t_old:>12.0f} flujos/s ({m} filas)")
+    print(f"RangeIndex  : {args.rows / t_new:>12.0f} flujos/s ({args.rows} filas)")
+    excl = sum(1 for g in got if g)
+    print(f"✅ Motivos idénticos ({excl} de {args.rows} flujos excluidos)")
+
+
+if __name__ == "__main__":
+    main()
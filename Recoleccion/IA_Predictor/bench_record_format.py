@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Compara la cola merge → ml en CSV y en registros binarios (MERGE_FORMAT /
+ML_FORMAT = record) con registros fusionados sintéticos:
+
+1. Coste de generar la salida en el merge (línea CSV vs RecordEncoder).
+2. Bytes por registro en la cola.
+3. Filas/s de BatchParser.parse con cada formato, y que la matriz del
+   modelo y los campos de las alertas (alert_fields) son los mismos.
+4. Con --redis, ida y vuelta por una lista de Redis (RPUSH + RPOP en lote)
+   más el parseo, en registros/s de extremo a extremo.
+
+Uso (el Redis indicado se vacía con FLUSHDB):
+    python bench_record_format.py [--rows 1024] [--batches 50] [--redis 127.0.0.1:6379]
+"""
+import argparse, json, os, random, sys, time
+
+import numpy as np
+
+from batch_parser import BatchParser, CATEGORICAL_COLS, alert_fields, load_vocab
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "dockers", "procesar_merge"))
+from merge_argus_zeek import ML_COLS, RecordEncoder  # noqa: E402
+
+
+def synthetic_records(n, rng):
+    """Registros como los deja finish_merged: texto de Argus, números de Zeek y ct_*."""
+    protos = ["tcp", "udp", "icmp", "arp", "desconocido"]
+    states = ["CON", "FIN", "INT", "REQ", "RST", "??"]
+    recs = []
+    for _ in range(n):
+        rec = {}
+        for c in ML_COLS:
+            if c == "proto":
+                rec[c] = rng.choice(protos)
+            elif c == "state":
+                rec[c] = rng.choice(states)
+            elif c in ("saddr", "daddr"):
+                rec[c] = f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+            elif c in ("sport", "dport"):
+                rec[c] = str(rng.randint(0, 65535))
+            elif c in ("stime", "ltime"):
+                rec[c] = f"{1749615290 + rng.random() * 10000:.6f}"
+            elif c.startswith("ct_") or c == "is_ftp_login":
+                rec[c] = rng.randint(0, 100)
+            else:
+                rec[c] = rng.choice(["", "0", f"{rng.random() * 1000:.6f}",
+                                     rng.randint(0, 4_000_000_000), rng.random() * 10])
+        recs.append(rec)
+    return recs
+
+
+def csv_line(rec):
+    # Igual que finish_merged con --merge_format csv
+    return ",".join(str(rec.get(c, "")) for c in ML_COLS)
+
+
+def timed(fn, batches):
+    t0 = time.perf_counter()
+    out = [fn(b) for b in batches]
+    return out, time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Cola merge → ml: CSV frente a registros binarios")
+    ap.add_argument("--rows", type=int, default=1024)
+    ap.add_argument("--batches", type=int, default=50)
+    ap.add_argument("--feature_order", default="model_feature_order.json")
+    ap.add_argument("--maps_dir", default="string_indexer_maps")
+    ap.add_argument("--redis", default="", help="host:puerto de un Redis de pruebas")
+    args = ap.parse_args()
+
+    feat_order = json.load(open(args.feature_order))
+    str_maps = {cat: json.load(open(f"{args.maps_dir}/string_indexer_{cat}_map.json"))
+                for cat in CATEGORICAL_COLS}
+    parser = BatchParser(feat_order, str_maps, vocab=load_vocab(args.maps_dir))
+    encoder = RecordEncoder(args.maps_dir)
+
+    rng = random.Random(42)
+    recs = [synthetic_records(args.rows, rng) for _ in range(args.batches)]
+    total = args.rows * args.batches
+
+    # 1) y 2) Salida del merge
+    csv_batches, t_csv = timed(lambda b: [csv_line(r) for r in b], recs)
+    rec_batches, t_rec = timed(lambda b: [encoder.encode(r) for r in b], recs)
+    csv_bytes = sum(len(l.encode()) for b in csv_batches for l in b) / total
+    rec_bytes = sum(len(r) for b in rec_batches for r in b) / total
+    print(f"Merge   · CSV   : {total / t_csv:>10,.0f} reg/s · {csv_bytes:6.1f} bytes/registro")
+    print(f"Merge   · record: {total / t_rec:>10,.0f} reg/s · {rec_bytes:6.1f} bytes/registro "
+          f"({rec_bytes / csv_bytes:.0%} del CSV)")
+
+    # 3) Parseo en ml_processor y paridad
+    buf_csv = np.empty((args.rows, len(feat_order)), dtype=np.float32)
+    buf_rec = np.empty_like(buf_csv)
+    for lines, records in zip(csv_batches, rec_batches):
+        if not np.array_equal(parser.parse(lines, out=buf_csv), parser.parse(records, out=buf_rec)):
+            raise SystemExit("❌ Las matrices del modelo difieren")
+        if alert_fields(lines) != alert_fields(records):
+            raise SystemExit("❌ Los campos de las alertas difieren")
+    print("✅ Misma matriz del modelo y mismos campos de alerta en los dos formatos")
+
+    _, p_csv = timed(lambda b: parser.parse(b, out=buf_csv), csv_batches)
+    _, p_rec = timed(lambda b: parser.parse(b, out=buf_rec), rec_batches)
+    _, a_csv = timed(alert_fields, csv_batches)
+    _, a_rec = timed(alert_fields, rec_batches)
+    print(f"Parseo  · CSV   : {total / p_csv:>10,.0f} filas/s · alert_fields {total / a_csv:>10,.0f} filas/s")
+    print(f"Parseo  · record: {total / p_rec:>10,.0f} filas/s · alert_fields {total / a_rec:>10,.0f} filas/s "
+          f"(×{p_csv / p_rec:.1f} / ×{a_csv / a_rec:.1f})")
+
+    # 4) Ida y vuelta por Redis
+    if args.redis:
+        import redis
+        host, port = args.redis.rsplit(":", 1)
+        r = redis.Redis(host=host, port=int(port))
+        r.flushdb()
+        for name, batches in (("CSV   ", csv_batches), ("record", rec_batches)):
+            t0 = time.perf_counter()
+            for b in batches:
+                r.rpush("bench_record_format", *b)
+            mem = r.memory_usage("bench_record_format") or 0
+            got = 0
+            while got < total:
+                items = r.rpop("bench_record_format", args.rows)
+                if name == "CSV   ":
+                    items = [i.decode() for i in items]
+                parser.parse(items, out=buf_csv)
+                alert_fields(items)
+                got += len(items)
+            dt = time.perf_counter() - t0
+            print(f"Redis   · {name}: {total / dt:>10,.0f} reg/s (push + pop + parseo) · "
+                  f"{mem / total:6.1f} bytes/registro en memoria")
+        r.flushdb()
+
+
+if __name__ == "__main__":
+    main()
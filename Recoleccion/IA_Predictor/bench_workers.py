@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Escalado de la inferencia en paralelo de ml_processor (backend CPU) con
+1..N workers sobre líneas CSV sintéticas. Usa el mismo reparto y
+re-ordenación que el servicio (make_pool / run_ordered) y comprueba que los
+lotes vuelven en orden y con las mismas probabilidades que en un proceso.
+
+Uso (desde este directorio, con random_forest_flat.npz exportado):
+    python bench_workers.py [--workers 4] [--rows 1024] [--batches 64]
+"""
+import argparse, os, random, time
+
+os.environ.setdefault("ML_BACKEND", "cpu")
+
+import numpy as np
+
+import ml_processor as m
+from bench_batch_parser import synthetic_lines
+
+
+def run(n_workers, batches):
+    m.WORKERS = n_workers
+    pool = m.make_pool()
+    # Calentamiento: cada worker carga el modelo antes de medir
+    list(pool.map(m.infer_batch, [batches[0][1]] * n_workers, [m.artifact_set] * n_workers))
+
+    got = []
+    t0 = time.perf_counter()
+    m.run_ordered(pool, iter(batches), lambda arr, lines, proba, atk, s, v: got.append((arr, proba)))
+    elapsed = time.perf_counter() - t0
+    pool.shutdown()
+    return elapsed, got
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Escalado de ML_WORKERS con backend CPU")
+    ap.add_argument("--workers", type=int, default=os.cpu_count())
+    ap.add_argument("--rows", type=int, default=1024)
+    ap.add_argument("--batches", type=int, default=64)
+    args = ap.parse_args()
+
+    m.artifact_set = m.read_artifact_set()
+    m.active = m.load_artifacts(m.artifact_set)
+    pool_lines = synthetic_lines(args.rows * 4, random.Random(11))
+    batches = [([i], pool_lines[(i % 4) * args.rows:(i % 4 + 1) * args.rows])
+               for i in range(args.batches)]
+    expected = [m.active.predict(lines).copy() for _, lines in batches[:4]]
+
+    total = args.rows * args.batches
+    base = None
+    print(f"{args.batches} lotes × {args.rows} filas, {os.cpu_count()} CPUs")
+    for n in range(1, args.workers + 1):
+        elapsed, got = run(n, batches)
+        if [arr[0] for arr, _ in got] != list(range(args.batches)):
+            raise SystemExit(f"❌ {n} workers: lotes fuera de orden")
+        if any(not np.array_equal(p, expected[i % 4]) for i, (_, p) in enumerate(got)):
+            raise SystemExit(f"❌ {n} workers: probabilidades distintas")
+        rate = total / elapsed
+        base = base or rate
+        print(f"{n:>2} workers: {rate:>10.0f} filas/s  ×{rate / base:.2f}")
+    print("✅ Orden y probabilidades idénticos")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Comprueba que el bosque exportado para CPU (forest_cpu.FlatForest) da las
+mismas probabilidades que el modelo original (scikit-learn o cuML) sobre
+líneas CSV sintéticas parseadas con BatchParser, y muestra filas/s.
+
+Uso:
+    python check_forest_parity.py [--model random_forest_gpu_model.pkl]
+                                  [--flat random_forest_flat.npz] [--rows 4096]
+"""
+import argparse, json, random, sys, time
+
+import joblib
+import numpy as np
+
+from batch_parser import BatchParser, CATEGORICAL_COLS
+from bench_batch_parser import synthetic_lines
+from forest_cpu import FlatForest
+
+
+def reference_proba(model, X):
+    proba = model.predict_proba(X)
+    return proba.get() if hasattr(proba, "get") else np.asarray(proba)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Paridad del bosque CPU frente al modelo original")
+    ap.add_argument("--model", default="random_forest_gpu_model.pkl")
+    ap.add_argument("--flat", default="random_forest_flat.npz")
+    ap.add_argument("--rows", type=int, default=4096)
+    ap.add_argument("--tol", type=float, default=1e-5)
+    ap.add_argument("--feature_order", default="model_feature_order.json")
+    ap.add_argument("--maps_dir", default="string_indexer_maps")
+    args = ap.parse_args()
+
+    feat_order = json.load(open(args.feature_order))
+    str_maps = {cat: json.load(open(f"{args.maps_dir}/string_indexer_{cat}_map.json"))
+                for cat in CATEGORICAL_COLS}
+    X = BatchParser(feat_order, str_maps).parse(synthetic_lines(args.rows, random.Random(7)))
+
+    model = joblib.load(args.model)
+    forest = FlatForest.load(args.flat)
+
+    t0 = time.perf_counter()
+    ref = reference_proba(model, X)
+    t_ref = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    got = forest.predict_proba(X)
+    t_flat = time.perf_counter() - t0
+
+    diff = float(np.abs(ref - got).max())
+    print(f"{forest.n_trees} árboles, profundidad {forest.max_depth}, {args.rows} filas")
+    print(f"Modelo original : {args.rows / t_ref:>10.0f} filas/s")
+    print(f"FlatForest (CPU): {args.rows / t_flat:>10.0f} filas/s")
+    print(f"Diferencia máxima de probabilidad: {diff:.2e}")
+    if diff > args.tol:
+        sys.exit(f"❌ Supera la tolerancia {args.tol}")
+    print("✅ Probabilidades equivalentes")
+
+
+if __name__ == "__main__":
+    main()
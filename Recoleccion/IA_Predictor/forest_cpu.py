@@ -0,0 +1,148 @@
+"""
+Random Forest "aplanado" para inferencia en CPU con NumPy.
+
+Todos los árboles se guardan en arrays planos de nodos (característica,
+umbral, hijo izquierdo/derecho y probabilidades de hoja) y se evalúan a la
+vez para todo el lote: en cada paso todos los pares (fila, árbol) que aún
+no han llegado a una hoja bajan un nivel, así que el coste en Python es
+proporcional a la profundidad, no al número de filas × árboles.
+
+Exportación (desde `train_rf.py` o a mano):
+    python forest_cpu.py random_forest_gpu_model.pkl random_forest_flat.npz
+"""
+import json, sys
+from typing import List
+
+import numpy as np
+
+LEAF = -1
+
+
+class FlatForest:
+    """Bosque en arrays planos; un hijo izquierdo LEAF marca una hoja."""
+
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth):
+        self.feature   = np.asarray(feature, dtype=np.int32)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.left      = np.asarray(left, dtype=np.int32)
+        self.right     = np.asarray(right, dtype=np.int32)
+        self.value     = np.asarray(value, dtype=np.float32)    # (n_nodos, n_clases)
+        self.roots     = np.asarray(roots, dtype=np.int32)      # nodo raíz de cada árbol
+        self.max_depth = int(max_depth)
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    def apply(self, X: np.ndarray) -> np.ndarray:
+        """Índice de la hoja alcanzada por cada fila en cada árbol: (n, n_arboles)."""
+        n, n_feats = X.shape
+        Xf = np.ascontiguousarray(X).ravel()
+        # Un elemento por par (fila, árbol); solo se avanzan los que no están en hoja
+        idx = np.tile(self.roots, n)
+        row_off = np.repeat(np.arange(n, dtype=np.int64) * n_feats, self.n_trees)
+        active = np.flatnonzero(self.left.take(idx) != LEAF)
+        while active.size:
+            cur = idx.take(active)
+            go_left = Xf.take(row_off.take(active) + self.feature.take(cur)) <= self.threshold.take(cur)
+            nxt = np.where(go_left, self.left.take(cur), self.right.take(cur))
+            idx[active] = nxt
+            active = active[self.left.take(nxt) != LEAF]
+        return idx.reshape(n, self.n_trees)
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Media de las probabilidades de hoja de todos los árboles: (n, n_clases)."""
+        return self.value[self.apply(X)].mean(axis=1)
+
+    def save(self, path: str) -> None:
+        np.savez(path, feature=self.feature, threshold=self.threshold,
+                 left=self.left, right=self.right, value=self.value,
+                 roots=self.roots, max_depth=np.int32(self.max_depth))
+
+    @classmethod
+    def load(cls, path: str) -> "FlatForest":
+        with np.load(path) as z:
+            return cls(z["feature"], z["threshold"], z["left"], z["right"],
+                       z["value"], z["roots"], int(z["max_depth"]))
+
+
+# ═════════════ Exportadores ═════════════
+
+def _from_sklearn(model) -> FlatForest:
+    feature, threshold, left, right, value, roots = [], [], [], [], [], []
+    max_depth, base = 0, 0
+    for est in model.estimators_:
+        t = est.tree_
+        roots.append(base)
+        is_leaf = t.children_left == -1
+        feature.append(np.where(is_leaf, 0, t.feature))
+        threshold.append(t.threshold)
+        left.append(np.where(is_leaf, LEAF, t.children_left + base))
+        right.append(np.where(is_leaf, LEAF, t.children_right + base))
+        v = t.value[:, 0, :].astype(np.float64)
+        value.append(v / np.maximum(v.sum(axis=1, keepdims=True), 1e-300))
+        max_depth = max(max_depth, t.max_depth)
+        base += t.node_count
+    return FlatForest(np.concatenate(feature), np.concatenate(threshold),
+                      np.concatenate(left), np.concatenate(right),
+                      np.concatenate(value), roots, max_depth)
+
+
+def _from_cuml(model) -> FlatForest:
+    """Recorre el volcado JSON de cuML (split_feature/split_threshold/yes/no/leaf_value)."""
+    trees = json.loads(model.get_json())
+    n_classes = int(getattr(model, "n_classes_", 2))
+    feature: List[int] = []
+    threshold: List[float] = []
+    left: List[int] = []
+    right: List[int] = []
+    value: List[np.ndarray] = []
+    roots: List[int] = []
+    max_depth = 0
+
+    def add(node: dict, depth: int) -> int:
+        nonlocal max_depth
+        max_depth = max(max_depth, depth)
+        i = len(feature)
+        feature.append(0); threshold.append(0.0); left.append(LEAF); right.append(LEAF)
+        if "children" not in node:
+            leaf = node["leaf_value"]
+            if np.ndim(leaf) == 0:  # versiones que guardan solo la clase
+                probs = np.zeros(n_classes)
+                probs[int(leaf)] = 1.0
+            else:
+                probs = np.asarray(leaf, dtype=np.float64)
+            value.append(probs)
+            return i
+        value.append(np.zeros(n_classes))
+        feature[i] = int(node["split_feature"])
+        threshold[i] = float(node["split_threshold"])
+        children = {c["nodeid"]: c for c in node["children"]}
+        left[i] = add(children[node["yes"]], depth + 1)
+        right[i] = add(children[node["no"]], depth + 1)
+        return i
+
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    for tree in trees:
+        roots.append(add(tree, 0))
+    return FlatForest(feature, threshold, left, right, np.vstack(value), roots, max_depth)
+
+
+def export_forest(model, path: str) -> FlatForest:
+    """Convierte un RandomForestClassifier (scikit-learn o cuML) y lo guarda en `path`."""
+    if hasattr(model, "get_json"):
+        forest = _from_cuml(model)
+    elif hasattr(model, "estimators_"):
+        forest = _from_sklearn(model)
+    else:
+        raise TypeError(f"Modelo no soportado: {type(model).__name__}")
+    forest.save(path)
+    return forest
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("Uso: python forest_cpu.py <modelo.pkl> <salida.npz>")
+    import joblib
+    f = export_forest(joblib.load(sys.argv[1]), sys.argv[2])
+    print(f"✅ {f.n_trees} árboles, {len(f.left)} nodos, profundidad {f.max_depth} → {sys.argv[2]}")
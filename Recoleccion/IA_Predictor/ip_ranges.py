@@ -0,0 +1,155 @@
+"""
+Índice compilado de rangos IPv4 excluidos (Meta, GCloud, AWS, Google…).
+
+Todas las redes de todas las categorías se funden en segmentos disjuntos
+ordenados: `starts[i]` es la primera dirección del segmento i (como entero)
+y `prio[i]` la categoría de mayor prioridad que lo cubre (o "ninguna").
+Una consulta es un `np.searchsorted` sobre el lote entero de direcciones,
+en lugar de recorrer miles de redes con `ipaddress` por cada flujo.
+
+Las listas descargadas y el índice compilado se guardan en un snapshot
+`.npz` (save_snapshot / load_snapshot) para arrancar sin red.
+"""
+import ipaddress
+import os
+import re
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+META_IP = "169.254.169.254"
+
+# Misma sintaxis que acepta ipaddress.IPv4Address (sin ceros a la izquierda)
+_OCTET = r"(?:0|[1-9]\d{0,2})"
+_IPV4  = rf"{_OCTET}\.{_OCTET}\.{_OCTET}\.{_OCTET}"
+_IPV4_RE  = re.compile(_IPV4)
+_BATCH_RE = re.compile(rf"{_IPV4}(?:,{_IPV4})*")
+_WEIGHTS  = np.array([1 << 24, 1 << 16, 1 << 8, 1], dtype=np.int64)
+
+
+def ip_to_int(txt: str) -> int:
+    """Dirección IPv4 → entero; -1 si no es una IPv4 válida (IPv6 incluidas)."""
+    try:
+        return int(ipaddress.IPv4Address(txt))
+    except ValueError:
+        return -1
+
+
+def ips_to_int(ips: Sequence[str]) -> np.ndarray:
+    """Convierte un lote de direcciones a int64 (-1 para las no IPv4)."""
+    n = len(ips)
+    out = np.full(n, -1, dtype=np.int64)
+    if not n:
+        return out
+    joined = ",".join(ips)
+    if _BATCH_RE.fullmatch(joined):
+        valid, ok = slice(None), joined
+    else:
+        # Hay IPv6 o basura: solo se convierten las que son IPv4 sintácticamente
+        mask = np.fromiter((_IPV4_RE.fullmatch(x) is not None for x in ips), dtype=bool, count=n)
+        if not mask.any():
+            return out
+        valid, ok = mask, ",".join(x for x, m in zip(ips, mask) if m)
+    octets = np.array(ok.replace(",", ".").split("."), dtype=np.int64).reshape(-1, 4)
+    vals = octets @ _WEIGHTS
+    vals[(octets > 255).any(axis=1)] = -1
+    out[valid] = vals
+    return out
+
+
+def networks_to_ranges(nets: Iterable) -> np.ndarray:
+    """Redes (ip_network o CIDR) → array (k, 2) de [inicio, fin) IPv4; las IPv6 se ignoran."""
+    rows = []
+    for net in nets:
+        net = ipaddress.ip_network(net, strict=False)
+        if net.version == 4:
+            first = int(net.network_address)
+            rows.append((first, first + net.num_addresses))
+    return np.array(rows, dtype=np.int64).reshape(-1, 2)
+
+
+class RangeIndex:
+    """
+    Segmentos disjuntos [starts[i], starts[i+1]) con la categoría ganadora.
+
+    `reasons` va en orden de prioridad; el código len(reasons) significa
+    "sin categoría".
+    """
+
+    def __init__(self, reasons: Sequence[str], starts: np.ndarray, prio: np.ndarray):
+        self.reasons = list(reasons)
+        self.starts  = np.asarray(starts, dtype=np.int64)
+        self.prio    = np.asarray(prio, dtype=np.int16)
+        self.none    = len(self.reasons)
+        self._labels = np.array(self.reasons + [""], dtype=object)
+
+    @classmethod
+    def build(cls, categories: Iterable[Tuple[str, Iterable]]) -> "RangeIndex":
+        """`categories`: [(motivo, redes o CIDR), ...] de mayor a menor prioridad."""
+        return cls.from_ranges((reason, networks_to_ranges(nets)) for reason, nets in categories)
+
+    @classmethod
+    def from_ranges(cls, categories: Iterable[Tuple[str, np.ndarray]]) -> "RangeIndex":
+        """Igual que `build` pero con rangos ya convertidos por networks_to_ranges."""
+        reasons: List[str] = []
+        parts = []  # (inicio, fin exclusivo, prioridad)
+        for p, (reason, ranges) in enumerate(categories):
+            reasons.append(reason)
+            ranges = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+            parts.append(np.column_stack([ranges, np.full(len(ranges), p, dtype=np.int64)]))
+        none = len(reasons)
+        table = np.concatenate(parts) if parts else np.empty((0, 3), dtype=np.int64)
+
+        bounds = np.unique(np.concatenate([[0], table[:, 0], table[:, 1]]))
+        seg = np.full(len(bounds), none, dtype=np.int16)
+        lo = np.searchsorted(bounds, table[:, 0])
+        hi = np.searchsorted(bounds, table[:, 1])
+        # De menor a mayor prioridad: la de mayor prioridad sobrescribe al final
+        for i in np.argsort(-table[:, 2], kind="stable"):
+            seg[lo[i]:hi[i]] = table[i, 2]
+
+        # Fusionar segmentos contiguos con la misma categoría
+        keep = np.ones(len(seg), dtype=bool)
+        keep[1:] = seg[1:] != seg[:-1]
+        return cls(reasons, bounds[keep], seg[keep])
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def lookup(self, ips: np.ndarray) -> np.ndarray:
+        """Código de categoría de cada dirección entera (las -1 → sin categoría)."""
+        ips = np.asarray(ips, dtype=np.int64)
+        codes = self.prio[np.searchsorted(self.starts, ips, side="right") - 1]
+        return np.where(ips < 0, self.none, codes)
+
+    def reasons_for(self, sips: Sequence[str], dips: Sequence[str]) -> List[str]:
+        """Motivo de exclusión por flujo ("" si ninguno): gana la categoría de
+        mayor prioridad que contenga el origen o el destino."""
+        if not sips:
+            return []
+        codes = np.minimum(self.lookup(ips_to_int(sips)), self.lookup(ips_to_int(dips)))
+        return self._labels[codes].tolist()
+
+
+# ═════════════ Snapshot en disco ═════════════
+
+def save_snapshot(path: str, index: RangeIndex, ranges: Dict[str, np.ndarray],
+                  fetched: Dict[str, float]) -> None:
+    """Guarda índice compilado + rangos por lista + fecha de descarga (atómico)."""
+    arrays = {"reasons": np.array(index.reasons), "starts": index.starts, "prio": index.prio}
+    for key, arr in ranges.items():
+        arrays[f"ranges_{key}"] = arr
+        arrays[f"fetched_{key}"] = np.float64(fetched.get(key, 0.0))
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as fh:
+        np.savez(fh, **arrays)
+    os.replace(tmp, path)
+
+
+def load_snapshot(path: str) -> Tuple[RangeIndex, Dict[str, np.ndarray], Dict[str, float]]:
+    """Inverso de save_snapshot: (índice, rangos por lista, epoch de descarga por lista)."""
+    with np.load(path) as z:
+        index   = RangeIndex([str(r) for r in z["reasons"]], z["starts"], z["prio"])
+        ranges  = {k[len("ranges_"):]: z[k] for k in z.files if k.startswith("ranges_")}
+        fetched = {k[len("fetched_"):]: float(z[k]) for k in z.files if k.startswith("fetched_")}
+    return index, ranges, fetched
@@ -1,95 +1,280 @@
 #!/usr/bin/env python
 
 
-import cupy as cp, rmm, joblib, json, os, sys, signal, time, redis, ipaddress, requests
-from threading import Thread
-from queue import Queue, Empty
-from datetime import datetime
+import json, os, sys, signal, socket, time, redis, requests
+from threading import Lock, Thread
+from queue import Queue
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing as mp
 import numpy as np
 
+from batch_parser import BatchParser, COLS, COL_IDX, CATEGORICAL_COLS, alert_fields, load_vocab
+from alert_sink import AlertSink
+from batch_scheduler import AdaptiveBatcher
+from model_bundle import load_bundle
+from ip_ranges import META_IP, RangeIndex, networks_to_ranges, load_snapshot, save_snapshot
+
+# "gpu": cuML/FIL (requiere cupy, rmm y cuml) · "cpu": bosque aplanado en NumPy
+BACKEND = os.getenv("ML_BACKEND", "gpu").lower()
+if BACKEND == "gpu":
+    import cupy as cp, rmm, joblib
+
 # ══════════════════════════════ CONFIG ═══════════════════════════════
 REDIS_HOST       = os.getenv("ML_REDIS_HOST", "34.175.47.103")
 REDIS_PORT       = int(os.getenv("ML_REDIS_PORT", 6379))
 REDIS_QUEUE_NAME = os.getenv("ML_REDIS_QUEUE", "merge_data_stream")
-
-CSV_COLUMNS = (
-    "stime,proto,saddr,sport,daddr,dport,state,ltime,spkts,dpkts,sbytes,dbytes,"
-    "sttl,dttl,sload,dload,sloss,dloss,sintpkt,dintpkt,sjit,djit,stcpb,dtcpb,"
-    "tcprtt,synack,ackdat,smeansz,dmeansz,dur,"
-    "ct_state_ttl,ct_flw_http_mthd,is_ftp_login,ct_ftp_cmd,"
-    "ct_srv_src,ct_srv_dst,ct_dst_ltm,ct_src_ltm,"
-    "ct_src_dport_ltm,ct_dst_sport_ltm,ct_dst_src_ltm" 
-)
-COLS    = CSV_COLUMNS.split(',')
-COL_IDX = {c: i for i, c in enumerate(COLS)}
-
-NUMERIC_COLS     = [
-    "sport","dport","dur","sbytes","dbytes","sttl","dttl","sloss","dloss",
-    "sload","dload","spkts","dpkts","stcpb","dtcpb","smeansz","dmeansz",
-    "sjit","djit","stime","ltime","sintpkt","dintpkt","tcprtt","synack","ackdat"
-]
-CATEGORICAL_COLS = ["proto", "state"]
+# Redis Streams (XREADGROUP + XACK tras escribir las alertas) en vez de BRPOP
+REDIS_STREAMS    = os.getenv("ML_REDIS_STREAMS", "0") == "1"
+STREAM_GROUP     = os.getenv("ML_GROUP", "ml")
+STREAM_CONSUMER  = os.getenv("ML_CONSUMER", socket.gethostname())   # estable: recupera su PEL
+CLAIM_IDLE       = float(os.getenv("ML_CLAIM_IDLE", 60))     # s sin XACK hasta reclamarlo
+CLAIM_EVERY      = float(os.getenv("ML_CLAIM_EVERY", 30))    # s entre pasadas de XAUTOCLAIM
+# Formato de la cola: "csv" o "record" (registros binarios, MERGE_FORMAT=record en el merge)
+ML_FORMAT        = os.getenv("ML_FORMAT", "csv").lower()
+RECORD_VOCAB_DIR = os.getenv("ML_RECORD_VOCAB", "string_indexer_maps")   # vocabulario del merge
+DATA_FIELD       = b"data" if ML_FORMAT == "record" else "data"
 
 BATCH_SIZE       = int(os.getenv("GPU_BATCH", 1024))
+# Lotes en paralelo: procesos con backend CPU, hilos+streams CUDA con GPU
+WORKERS          = max(1, int(os.getenv("ML_WORKERS", 1)))
+MAX_ROWS         = int(os.getenv("GPU_BATCH_MAX", 2048))
+GPU_MODEL_FILE   = os.getenv("ML_GPU_MODEL", "random_forest_gpu_model.pkl")
+CPU_MODEL_FILE   = os.getenv("ML_CPU_MODEL", "random_forest_flat.npz")
 QUEUE_MAXSIZE    = 16384
+LATENCY_SLO      = float(os.getenv("ML_LATENCY_SLO", 0.5))    # p99 objetivo (s) del planificador
+SCHED_STATS_FILE = os.getenv("ML_SCHED_STATS_FILE", "")        # JSON con lote/espera/histogramas
+STATS_EVERY      = float(os.getenv("ML_STATS_EVERY", 10))
 ATTACK_THRESHOLD = 0.70
 LOG_FILE_ATTACKS = "potentially_malicious_saddr.log"
+# Salida de alertas (ver alert_sink.py)
+ALERT_NORMAL       = os.getenv("ML_ALERT_NORMAL", "all")          # all | summary | none
+ALERT_WINDOW       = float(os.getenv("ML_ALERT_WINDOW", 0))        # s; 0 → sin agrupar
+ALERT_MAX_BYTES    = int(os.getenv("ML_ALERT_MAX_BYTES", 0))       # 0 → sin rotar por tamaño
+ALERT_ROTATE_HOURS = float(os.getenv("ML_ALERT_ROTATE_HOURS", 0))  # 0 → sin rotar por tiempo
+ALERT_REDIS_KEY    = os.getenv("ML_ALERT_REDIS_KEY", "")          # vacío → no se publican
 keep_running     = True
 
 # ═════════════ Redes excluidas ═════════════
+# Listas publicadas por los proveedores: clave → (url, lista, campo CIDR)
+RANGE_SOURCES = {
+    "gcloud" : ("https://www.gstatic.com/ipranges/cloud.json",    "prefixes", "ipv4Prefix"),
+    "aws"    : ("https://ip-ranges.amazonaws.com/ip-ranges.json", "prefixes", "ip_prefix"),
+    "ggen"   : ("https://www.gstatic.com/ipranges/goog.json",     "prefixes", "ipv4Prefix"),
+}
+# Directorio con <clave>.json (mismo formato que las URLs); vacío → HTTPS
+RANGES_SOURCE   = os.getenv("ML_RANGES_SOURCE", "")
+RANGES_SNAPSHOT = os.getenv("ML_RANGES_SNAPSHOT", "cloud_ranges_snapshot.npz")
+CACHE_HOURS     = float(os.getenv("ML_RANGES_REFRESH_HOURS", 24))
+RETRY_SECONDS   = 600    # espera tras una descarga fallida
+
+# Rangos [inicio, fin) como enteros (ver ip_ranges.networks_to_ranges)
 NETWORKS = {
-    "gcloud"    : [],
-    "aws"       : [],
-    "ggen"      : [],
-    "canonical" : [
-        ipaddress.ip_network("185.125.188.0/22"),
-        ipaddress.ip_network("91.189.88.0/21")
-    ],
-    "suse"      : [ipaddress.ip_network("195.135.223.0/24")]
+    "gcloud"    : networks_to_ranges([]),
+    "aws"       : networks_to_ranges([]),
+    "ggen"      : networks_to_ranges([]),
+    "canonical" : networks_to_ranges(["185.125.188.0/22", "91.189.88.0/21"]),
+    "suse"      : networks_to_ranges(["195.135.223.0/24"]),
 }
-CACHE_HOURS = 24
-_last_fetch = {}
+META_RANGE  = networks_to_ranges([META_IP])
+_last_fetch = {}   # clave → epoch de la última descarga correcta
+_last_try   = {}   # clave → epoch del último intento
+
+def fetch_ranges(key):
+    """Descarga la lista `key` (o la lee de RANGES_SOURCE) y la devuelve como rangos."""
+    url, list_key, cidr_key = RANGE_SOURCES[key]
+    if RANGES_SOURCE:
+        with open(os.path.join(RANGES_SOURCE, f"{key}.json")) as fh:
+            data = json.load(fh)
+    else:
+        data = requests.get(url, timeout=8).json()
+    return networks_to_ranges(x[cidr_key] for x in data[list_key] if cidr_key in x)
 
-def fetch_ranges(url, key, list_key, cidr_key):
-    now = datetime.utcnow()
-    if key in _last_fetch and (now - _last_fetch[key]).seconds < CACHE_HOURS * 3600:
-        return
+# Orden de prioridad: el primer motivo que contenga origen o destino gana
+EXCLUSION_ORDER = [("Meta", None), ("GCloud", "gcloud"), ("AWS", "aws"),
+                   ("Google", "ggen"), ("Canonical", "canonical"), ("SUSE", "suse")]
+
+def build_exclusion_index():
+    """Compila NETWORKS (+ la IP de metadatos) en un RangeIndex consultable por lotes."""
+    return RangeIndex.from_ranges(
+        (reason, META_RANGE if key is None else NETWORKS[key])
+        for reason, key in EXCLUSION_ORDER
+    )
+
+exclusion = build_exclusion_index()
+
+def load_ranges_snapshot():
+    """Arranque sin red: carga listas e índice ya compilado del snapshot en disco."""
+    global exclusion
     try:
-        data = requests.get(url, timeout=8).json()
-        NETWORKS[key] = [
-            ipaddress.ip_network(x[cidr_key], strict=False)
-            for x in data[list_key] if cidr_key in x
-        ]
-        _last_fetch[key] = now
-        print(f"[INFO] {key}: {len(NETWORKS[key])} rangos IPv4 cargados.")
+        index, ranges, fetched = load_snapshot(RANGES_SNAPSHOT)
+    except FileNotFoundError:
+        print(f"[WARN] Sin snapshot de rangos ({RANGES_SNAPSHOT}); se descargarán en segundo plano",
+              file=sys.stderr)
+        return
     except Exception as e:
-        print(f"[WARN] Fetch {key}: {e}", file=sys.stderr)
+        print(f"[WARN] Snapshot de rangos ilegible ({e}); se ignora", file=sys.stderr)
+        return
+
+    for key in RANGE_SOURCES:
+        if key in ranges:
+            NETWORKS[key]    = ranges[key]
+            _last_fetch[key] = fetched.get(key, 0.0)
+    # El índice guardado solo vale si las listas fijas y el orden no han cambiado
+    same_static = all(np.array_equal(ranges.get(k), v) for k, v in NETWORKS.items()
+                      if k not in RANGE_SOURCES)
+    if same_static and index.reasons == [r for r, _ in EXCLUSION_ORDER]:
+        exclusion = index
+    else:
+        exclusion = build_exclusion_index()
+
+    oldest = min((_last_fetch.get(k, 0.0) for k in RANGE_SOURCES), default=0.0)
+    print(f"[INFO] Snapshot de rangos: {len(exclusion)} segmentos, "
+          f"antigüedad {(time.time() - oldest) / 3600:.1f} h")
+
+def refresh_ranges():
+    """Vuelve a descargar las listas caducadas. Devuelve (alguna descargada, alguna cambió)."""
+    fetched = changed = False
+    now = time.time()
+    for key in RANGE_SOURCES:
+        if now - _last_fetch.get(key, 0.0) < CACHE_HOURS * 3600:
+            continue
+        if now - _last_try.get(key, 0.0) < RETRY_SECONDS:
+            continue
+        _last_try[key] = now
+        try:
+            ranges = fetch_ranges(key)
+        except Exception as e:
+            print(f"[WARN] Fetch {key}: {e}", file=sys.stderr)
+            continue
+        _last_fetch[key] = now
+        fetched = True
+        if not np.array_equal(ranges, NETWORKS[key]):
+            NETWORKS[key] = ranges
+            changed = True
+        print(f"[INFO] {key}: {len(ranges)} rangos IPv4 cargados.")
+    return fetched, changed
+
+def ranges_refresher():
+    """Hilo: refresca las listas y sustituye `exclusion` sin parar la inferencia."""
+    global exclusion
+    while keep_running:
+        fetched, changed = refresh_ranges()
+        if changed:
+            # Asignar la referencia es atómico: cada lote usa el índice viejo o el nuevo
+            exclusion = build_exclusion_index()
+            print(f"[INFO] Índice de exclusión: {len(exclusion)} segmentos")
+        if fetched:
+            try:
+                save_snapshot(RANGES_SNAPSHOT, exclusion, NETWORKS, _last_fetch)
+            except OSError as e:
+                print(f"[WARN] No se pudo guardar {RANGES_SNAPSHOT}: {e}", file=sys.stderr)
+        time.sleep(5)
+
+# ═════════════ Artefactos del modelo (recargables en caliente) ═════════════
+# Directorio con manifest.json (lo escribe train_rf.py); sin manifiesto se
+# usan los nombres fijos de siempre y la versión sale de sus fechas.
+ARTIFACTS_DIR    = os.getenv("ML_ARTIFACTS_DIR", ".")
+MANIFEST_FILE    = "manifest.json"
+RELOAD_POLL      = float(os.getenv("ML_RELOAD_POLL", 10))        # s; 0 → sin recarga
+CANARY_MIN_AGREE = float(os.getenv("ML_CANARY_MIN_AGREE", 0.0))  # acuerdo mínimo con el modelo activo
+
+ArtifactSet = namedtuple("ArtifactSet", "version bundle gpu_model cpu_model feature_order maps_dir")
+# predict: lines → P(ataque) por línea · threshold: P a partir de la cual es ataque
+Model       = namedtuple("Model", "version predict threshold")
+
+def read_artifact_set(base=ARTIFACTS_DIR):
+    path = os.path.join(base, MANIFEST_FILE)
+    if os.path.isfile(path):
+        with open(path) as fh:
+            man = json.load(fh)
+        bundle = man.get("bundle")
+        return ArtifactSet(
+            str(man["version"]),
+            os.path.join(base, bundle) if bundle else None,
+            # Sin "gpu_model" (modelo entrenado con CV_BACKEND=cpu) no hay modelo cuML
+            os.path.join(base, man["gpu_model"]) if "gpu_model" in man else None,
+            os.path.join(base, man.get("cpu_model", "random_forest_flat.npz")),
+            os.path.join(base, man.get("feature_order", "model_feature_order.json")),
+            os.path.join(base, man.get("maps_dir", "string_indexer_maps")),
+        )
+    files = [os.path.join(base, f) for f in (GPU_MODEL_FILE if BACKEND == "gpu" else CPU_MODEL_FILE,
+                                             "model_feature_order.json")]
+    stamp = max(os.path.getmtime(f) for f in files)
+    return ArtifactSet(time.strftime("local-%Y%m%d%H%M%S", time.localtime(stamp)), None,
+                       os.path.join(base, GPU_MODEL_FILE), os.path.join(base, CPU_MODEL_FILE),
+                       files[1], os.path.join(base, "string_indexer_maps"))
+
+artifact_set = None      # ArtifactSet en uso
+active       = None      # Model en uso; se sustituye entero (asignación atómica) entre lotes
+
+def load_artifacts(aset=None):
+    """Carga un juego de artefactos y devuelve su Model (sin activarlo)."""
+    aset = aset or read_artifact_set()
+    if aset.bundle:
+        # Paquete único (model_bundle.py): cabecera JSON + bosque por mmap
+        bundle = load_bundle(aset.bundle)
+        feat_order, str_maps, sources = bundle.feature_order, bundle.maps, bundle.sources
+        threshold, attack_class = bundle.threshold, bundle.attack_class
+    else:
+        bundle = None
+        feat_order = json.load(open(aset.feature_order))
+        str_maps   = {
+            cat: json.load(open(os.path.join(aset.maps_dir, f"string_indexer_{cat}_map.json")))
+            for cat in CATEGORICAL_COLS
+        }
+        sources, threshold, attack_class = None, 0.5, 1
+    vocab  = load_vocab(RECORD_VOCAB_DIR) if ML_FORMAT == "record" else None
+    parser = BatchParser(feat_order, str_maps, sources, vocab)
+    if BACKEND == "cpu":
+        from forest_cpu import FlatForest
+        forest = bundle.forest if bundle else FlatForest.load(aset.cpu_model)
+        print(f"[INFO] Backend CPU: {forest.n_trees} árboles desde {aset.bundle or aset.cpu_model}")
+        predict = load_cpu_backend(forest, parser, attack_class)
+    else:
+        if aset.gpu_model is None:
+            raise ValueError(f"el juego {aset.version} no incluye modelo cuML (gpu_model); usar ML_BACKEND=cpu")
+        predict = load_gpu_backend(aset.gpu_model, parser, attack_class)
+    return Model(aset.version, predict, threshold)
+
+
+# ─────────────── Backend CPU: bosque aplanado ─────────────────
+def load_cpu_backend(forest, parser, attack_class):
+    host_buf = np.empty((MAX_ROWS, parser.n_feats), dtype=np.float32)
+    # El canario de una recarga (hilo artifacts_watcher) predice con el
+    # modelo activo mientras el bucle principal puede estar usando host_buf
+    buf_lock = Lock()
+
+    def predict(lines):
+        with buf_lock:
+            return forest.predict_proba(parser.parse(lines, out=host_buf))[:, attack_class]
+    return predict
 
-def ip_in_net(key, ipstr):
-    try:
-        ip = ipaddress.ip_address(ipstr)
-        return any(ip in net for net in NETWORKS[key])
-    except ValueError:
-        return False
 
-# ═════════════ Variables que se llenarán en load_artifacts ═════════════
-rf_cuml    = None
-feat_order = []
-feat2idx   = {}
-str_maps   = {}
-gpu_buf    = None        # <-- “reservaremos” gpu_buf en load_artifacts()
+# ─────────────── Backend GPU / RMM ─────────────────
+_rmm_ready = False
 
-def load_artifacts():
-    global rf_cuml, feat_order, feat2idx, str_maps, gpu_buf, gpu_predict, fil_model
+def init_gpu():
+    global _rmm_ready
+    if _rmm_ready:
+        return
+    # Ajustamos el pool de RMM para no quedarnos sin VRAM
+    rmm.reinitialize(
+        pool_allocator=True,
+        initial_pool_size = 1 * 1024**3,   # 1 GiB de arranque
+        maximum_pool_size = None           # sin límite: que use toda la tarjeta
+    )
+
+    from rmm.allocators.cupy import rmm_cupy_allocator
+    cp.cuda.set_allocator(rmm_cupy_allocator)
+    _rmm_ready = True
 
-    rf_cuml    = joblib.load("random_forest_gpu_model.pkl")
-    feat_order = json.load(open("model_feature_order.json"))
-    feat2idx   = {f:i for i, f in enumerate(feat_order)}
 
-    for cat in CATEGORICAL_COLS:
-        str_maps[cat] = json.load(
-            open(f"string_indexer_maps/string_indexer_{cat}_map.json"))
+def load_gpu_backend(path, parser, attack_class):
+    init_gpu()
+    rf_cuml = joblib.load(path)
 
+    # Con el modelo cargado intentamos convertir a FIL
     try:
         fil_model = rf_cuml.convert_to_fil(
             output_class = False,
@@ -102,176 +287,396 @@ def load_artifacts():
         print(f"[WARN] FIL NAIVE falló ({e}); usaré RF nativo")
         gpu_predict = rf_cuml.predict_proba
 
-    MAX_ROWS = int(os.getenv("GPU_BATCH_MAX", 2048)) 
-    n_cols   = len(feat_order)
-    gpu_buf  = cp.empty((MAX_ROWS, n_cols), dtype=cp.float32)
+    # Un juego de búferes + stream CUDA por hilo de inferencia (ML_WORKERS)
+    slots = Queue()
+    for _ in range(WORKERS):
+        slots.put(gpu_slot(parser.n_feats))
 
+    def predict(lines):
+        slot = slots.get()
+        try:
+            gbuf, hbuf, stream = slot
+            with stream:
+                # 1) Construir batch GPU (evitamos nuevos allocs gracias a gbuf)
+                gpu_mat = build_gpu_batch(parser, lines, gbuf, hbuf)
 
-def str2f(txt):
-    try:
-        return float(txt)
-    except:
-        return 0.0
+                # 2) Predict_proba en GPU (FIL si está disponible, o cuML nativo)
+                proba_gpu = gpu_predict(gpu_mat)[:, attack_class]
+
+                # Liberar cualquier bloque no usado en los pools (opcionales, pero ayudan):
+                cp.get_default_memory_pool().free_all_blocks()
+                cp.get_default_pinned_memory_pool().free_all_blocks()
 
-def build_gpu_batch(lines):
+                # 3) Pasar solo las probabilidades al host
+                return cp.asnumpy(proba_gpu)
+        finally:
+            slots.put(slot)
+    return predict
+
+
+def gpu_slot(n_cols):
+    """(búfer en VRAM, staging pinned en host, stream) de MAX_ROWS filas."""
+    gbuf   = cp.empty((MAX_ROWS, n_cols), dtype=cp.float32)
+    pinned = cp.cuda.alloc_pinned_memory(MAX_ROWS * n_cols * np.dtype(np.float32).itemsize)
+    hbuf   = np.frombuffer(pinned, dtype=np.float32, count=MAX_ROWS * n_cols).reshape(MAX_ROWS, n_cols)
+    return gbuf, hbuf, cp.cuda.Stream(non_blocking=True)
+
+
+def build_gpu_batch(parser, lines, gbuf, hbuf):
     """
-    Rellena gpu_buf[0:n, :] con los datos de `lines` y devuelve la vista
-    de solo las primeras n filas (evitando copia).
+    Parsea `lines` en hbuf (vectorizado, ver batch_parser) y copia las n
+    filas a gbuf con una única transferencia. Devuelve la vista de gbuf.
     """
     n = len(lines)
-    # Limpiar solo la parte que vamos a usar
-    gpu_buf[:n].fill(0.0)
-
-    for r, line in enumerate(lines):
-        f = line.split(',')
-
-        # Escribir columnas numéricas
-        for col in NUMERIC_COLS:
-            name = "dsport" if (col == "dport" and "dsport" in feat2idx) else col
-            idx = feat2idx.get(name, -1)
-            if idx >= 0:
-                gpu_buf[r, idx] = str2f(f[COL_IDX[col]])
-
-        # Escribir columnas categóricas
-        for cat in CATEGORICAL_COLS:
-            idx = feat2idx[f"{cat}_index"]
-            gpu_buf[r, idx] = str_maps[cat].get(f[COL_IDX[cat]], len(str_maps[cat]))
-
-    return gpu_buf[:n]  # Vista de tamaño (n, n_cols)
-
-
-# ─────────────── Parte de inferencia GPU / RMM ─────────────────
-# Ajustamos el pool de RMM para no quedarnos sin VRAM
-
-free , total = cp.cuda.Device(0).mem_info
-rmm.reinitialize(
-    pool_allocator=True,
-    initial_pool_size = 1 * 1024**3,   # 1 GiB de arranque
-    maximum_pool_size = None           # sin límite: que use toda la tarjeta
-)
-
-from rmm.allocators.cupy import rmm_cupy_allocator
-cp.cuda.set_allocator(rmm_cupy_allocator)
-
-# Después de cargar el modelo en load_artifacts(), ya tendremos
-# rf_cuml y feat_order; ahora intentamos convertir a FIL
-from cuml.ensemble import RandomForestClassifier   # solo por tipado
-
-# Defino gpu_predict más abajo, después de llamar a load_artifacts()
-
-
-# ───────────── logging de ataques, impresión bonita ─────────────────
-def write_attack(sip, sport, dip, dport):
-    with open(LOG_FILE_ATTACKS, "a") as fh:
-        fh.write(f"{sip}:{sport} -> {dip}:{dport}\n")
-
-def pretty(fields, prob, is_attack, latency, reason=""):
-    sip, dip = fields[COL_IDX['saddr']], fields[COL_IDX['daddr']]
-    sp , dp  = fields[COL_IDX['sport']], fields[COL_IDX['dport']]
-    arrow    = f"{sip}:{sp} -> {dip}:{dp}"
-    if is_attack and not reason:
-        tag  = "🚨" if prob >= ATTACK_THRESHOLD else "⚠️"
-        dest = sys.stderr if prob >= ATTACK_THRESHOLD else sys.stdout
-        print(f"{tag} Ataque conf={prob:.3f} {arrow} lat={latency:.3f}s", file=dest)
-    elif is_attack:
-        print(f"⏩ IGNORADO({reason}) {arrow} lat={latency:.3f}s", file=sys.stdout)
-    else:
-        print(f"✅ Normal conf={prob:.3f} lat={latency:.3f}s {arrow}", file=sys.stdout)
+    host = parser.parse(lines, out=hbuf)
+    gbuf[:n].set(host)
+    return gbuf[:n]  # Vista de tamaño (n, n_cols)
+
+
+# ───────────── Salida de alertas (hilo propio) ─────────────────
+sink = None
+
+def start_alert_sink():
+    global sink
+    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT) if ALERT_REDIS_KEY else None
+    sink = AlertSink(
+        LOG_FILE_ATTACKS, ATTACK_THRESHOLD,
+        normal         = ALERT_NORMAL,
+        window         = ALERT_WINDOW,
+        max_bytes      = ALERT_MAX_BYTES,
+        max_age        = ALERT_ROTATE_HOURS * 3600,
+        redis_client   = r,
+        redis_key      = ALERT_REDIS_KEY,
+    )
 
 
 # ───────────── Reader Redis (hilo) ─────────────────
 def redis_reader(q: Queue):
-    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+    # Los registros binarios se entregan tal cual (bytes)
+    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=ML_FORMAT == "csv")
     p = r.pipeline()
     while keep_running:
         p.brpop(REDIS_QUEUE_NAME, timeout=1)
         for itm in p.execute(False):
             if itm:
-                q.put(itm[1])
+                q.put((time.monotonic(), itm[1]))   # llegada, para medir la latencia local
+    q.put(None)
+
+
+class StreamAcks:
+    """
+    IDs leídos del stream en el orden en que entran a la cola local. Los
+    lotes se terminan en ese mismo orden (run_ordered), así que take(n)
+    devuelve los del lote que acaba, como función que hace el XACK: la
+    llama el AlertSink cuando las alertas del lote ya están escritas.
+    """
+
+    def __init__(self, r):
+        self.r        = r
+        self.ids      = deque()
+        self.inflight = set()      # sin XACK: XAUTOCLAIM no los vuelve a encolar
+        self.lock     = Lock()
+
+    def add(self, msg_id):
+        with self.lock:
+            self.ids.append(msg_id)
+            self.inflight.add(msg_id)
+
+    def take(self, n):
+        with self.lock:
+            ids = [self.ids.popleft() for _ in range(n)]
+
+        def done():
+            self.r.xack(REDIS_QUEUE_NAME, STREAM_GROUP, *ids)
+            with self.lock:
+                self.inflight.difference_update(ids)
+        return done
+
+
+stream_acks = None
+
+def stream_reader(q: Queue):
+    """
+    Lector con grupo de consumidores: primero la PEL propia (lo leído y sin
+    XACK antes de una caída), luego lo nuevo; cada CLAIM_EVERY s reclama con
+    XAUTOCLAIM lo que otro consumidor del grupo dejó sin confirmar.
+    """
+    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=ML_FORMAT == "csv")
+    try:
+        r.xgroup_create(REDIS_QUEUE_NAME, STREAM_GROUP, id="0", mkstream=True)
+    except redis.exceptions.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+    def enqueue(msgs):
+        gone = []
+        for msg_id, fields in msgs:
+            if msg_id is None or msg_id in stream_acks.inflight:
+                continue
+            if not fields or DATA_FIELD not in fields:
+                gone.append(msg_id)         # recortada por MAXLEN
+                continue
+            stream_acks.add(msg_id)
+            q.put((time.monotonic(), fields[DATA_FIELD]))
+        if gone:
+            r.xack(REDIS_QUEUE_NAME, STREAM_GROUP, *gone)
+
+    last = "0"
+    while keep_running:
+        res = r.xreadgroup(STREAM_GROUP, STREAM_CONSUMER, {REDIS_QUEUE_NAME: last}, count=MAX_ROWS)
+        msgs = res[0][1] if res else []
+        if not msgs:
+            break
+        enqueue(msgs)
+        last = msgs[-1][0]
+    if last != "0":
+        print(f"[INFO] Recuperados los mensajes sin confirmar de {STREAM_CONSUMER} hasta {last}")
+
+    cursor, next_claim = "0-0", time.monotonic() + CLAIM_EVERY
+    while keep_running:
+        if CLAIM_EVERY > 0 and time.monotonic() >= next_claim:
+            next_claim = time.monotonic() + CLAIM_EVERY
+            res = r.xautoclaim(REDIS_QUEUE_NAME, STREAM_GROUP, STREAM_CONSUMER,
+                               int(CLAIM_IDLE * 1000), start_id=cursor, count=MAX_ROWS)
+            cursor = res[0]
+            enqueue(res[1])
+        res = r.xreadgroup(STREAM_GROUP, STREAM_CONSUMER, {REDIS_QUEUE_NAME: ">"},
+                           count=MAX_ROWS, block=1000)
+        if res:
+            enqueue(res[0][1])
     q.put(None)
 
 
+# ───────────── Recarga en caliente de artefactos ─────────────────
+last_lines = []          # último lote real, usado como canario
+
+def canary_lines():
+    if last_lines:
+        return list(last_lines)
+    # Sin tráfico aún: una línea neutra (todo ceros, tcp/CON)
+    f = ["0"] * len(COLS)
+    f[COL_IDX["proto"]], f[COL_IDX["state"]] = "tcp", "CON"
+    return [",".join(f)]
+
+def validate_canary(model):
+    """Predice el canario con el modelo nuevo; lanza ValueError si no es válido."""
+    lines = canary_lines()
+    proba = np.asarray(model.predict(lines))
+    if proba.shape != (len(lines),) or not np.all(np.isfinite(proba)) \
+            or proba.min() < 0 or proba.max() > 1:
+        raise ValueError(f"salida inválida en el canario (forma {proba.shape})")
+    current = active
+    if current is None:
+        if CANARY_MIN_AGREE > 0:
+            raise ValueError("sin modelo de referencia para ML_CANARY_MIN_AGREE")
+        return None
+    agree = float(np.mean((proba >= model.threshold) == (current.predict(lines) >= current.threshold)))
+    if agree < CANARY_MIN_AGREE:
+        raise ValueError(f"acuerdo con {current.version} = {agree:.1%} < {CANARY_MIN_AGREE:.1%}")
+    return agree
+
+def artifacts_watcher(pool=None):
+    """
+    Hilo: detecta un juego de artefactos nuevo, lo carga, lo valida y lo
+    activa. Con workers de proceso (`pool`) estos lo cargan antes del cambio.
+    """
+    global artifact_set, active
+    seen, rejected = None, set()
+    while keep_running:
+        time.sleep(RELOAD_POLL)
+        try:
+            aset = read_artifact_set()
+        except Exception as e:
+            print(f"[WARN] Artefactos ilegibles: {e}", file=sys.stderr)
+            continue
+        if aset.version in (artifact_set.version, *rejected):
+            continue
+        if aset != seen:
+            seen = aset          # esperar a que no cambie entre dos sondeos (copia a medias)
+            continue
+        print(f"[INFO] Nuevo modelo {aset.version}: cargando en segundo plano…")
+        try:
+            model = load_artifacts(aset)
+            agree = validate_canary(model)
+            if BACKEND == "cpu" and pool is not None:
+                warm_workers(pool, aset)
+        except Exception as e:
+            print(f"[WARN] Modelo {aset.version} descartado: {e}", file=sys.stderr)
+            rejected.add(aset.version)
+            continue
+        # El cambio es una asignación: cada lote usa entero el modelo viejo o el nuevo.
+        # Los workers de proceso cambian al ver la versión nueva en su siguiente lote;
+        # en el proceso principal `active` queda como referencia del canario.
+        active = model
+        artifact_set = aset
+        extra = "" if agree is None else f" (acuerdo canario {agree:.1%})"
+        print(f"[INFO] Modelo activo: {aset.version}{extra}")
+
+
 # ───────────── Procesado en lotes ─────────────────
+def infer_batch(lines, aset=None):
+    """1-3) Parseo + predict_proba; devuelve (P(ataque), ¿ataque?, s de inferencia, versión)."""
+    global active
+    if aset is not None and (active is None or active.version != aset.version):
+        # Worker de proceso: el modelo ya está cargado (warm_workers) salvo
+        # que el proceso sea nuevo; entonces se carga aquí
+        active = _warm_models.pop(aset.version, None) or load_artifacts(aset)
+        _warm_models.clear()
+    model = active
+    t0    = time.perf_counter()
+    proba = model.predict(lines)
+    return proba, proba >= model.threshold, time.perf_counter() - t0, model.version
+
+
+def finish_batch(lines, proba_cpu, is_attack, version):
+    """Excluye rangos y encola las alertas del lote; devuelve las latencias desde stime."""
+    global last_lines
+    last_lines = lines[:64]
+    now = time.time()
+
+    # 4) Motivo de exclusión de todo el lote con una búsqueda binaria vectorizada
+    sips, sports, dips, dports, stimes = alert_fields(lines)
+    reasons = exclusion.reasons_for(sips, dips)
+
+    # 5) Una tupla por flujo; el formateo y la escritura los hace el AlertSink
+    alerts    = []
+    latencies = np.empty(len(lines))
+    for sip, sport, dip, dport, stime, reason, p, atk in zip(sips, sports, dips, dports, stimes,
+                                                             reasons, proba_cpu, is_attack):
+        latency = now - stime if stime is not None else 0.0
+
+        latencies[len(alerts)] = latency
+        kind = ("ignored" if reason else "attack") if atk else "normal"
+        alerts.append((kind, sip, sport, dip, dport, float(p), latency, reason, version))
+    sink.emit(alerts, stream_acks.take(len(lines)) if stream_acks else None)
+    return latencies
+
+
 def process_batch(lines):
-    # 1) Construir batch GPU (evitamos nuevos allocs gracias a gpu_buf)
-    gpu_mat = build_gpu_batch(lines)
+    """Lote completo en este proceso; devuelve (s de inferencia, latencias desde stime)."""
+    proba, is_attack, infer_s, version = infer_batch(lines)
+    return infer_s, finish_batch(lines, proba, is_attack, version)
 
-    # 2) Predict_proba en GPU (FIL si está disponible, o cuML nativo)
-    proba_gpu = gpu_predict(gpu_mat)[:, 1]
 
-    # Liberar cualquier bloque no usado en los pools (opcionales, pero ayudan):
-    cp.get_default_memory_pool().free_all_blocks()
-    cp.get_default_pinned_memory_pool().free_all_blocks()
+# ───────────── Inferencia en paralelo (ML_WORKERS > 1) ─────────────────
+def _init_worker(aset):
+    # Proceso nuevo (spawn): carga su propia copia del modelo y los mapas
+    global active
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    active = load_artifacts(aset)
 
-    # 3) Pasar solo las probabilidades al host
-    proba_cpu = cp.asnumpy(proba_gpu)
-    now       = time.time()
 
-    # 4) Iterar y detectar/excluir rangos (igual que antes)
-    for raw, p, atk in zip(lines, proba_cpu, proba_gpu >= 0.5):
-        f    = raw.split(',')
-        sip, dip = f[COL_IDX['saddr']], f[COL_IDX['daddr']]
-        sp , dp  = f[COL_IDX['sport']], f[COL_IDX['dport']]
+_warm_models = {}        # worker de proceso: versión → Model precargado
 
-        try:
-            latency = now - float(f[COL_IDX['stime']])
-        except ValueError:
-            latency = 0.0
-
-        
-        reason = ""
-        
-        if sip == "169.254.169.254" or dip == "169.254.169.254":
-            reason = "Meta"
-        elif ip_in_net("gcloud", sip) or ip_in_net("gcloud", dip):
-            reason = "GCloud"
-        elif ip_in_net("aws", sip) or ip_in_net("aws", dip):
-            reason = "AWS"
-        elif ip_in_net("ggen", sip) or ip_in_net("ggen", dip):
-            reason = "Google"
-        elif ip_in_net("canonical", sip) or ip_in_net("canonical", dip):
-            reason = "Canonical"
-        elif ip_in_net("suse", sip) or ip_in_net("suse", dip):
-            reason = "SUSE"
-
-        pretty(f, float(p), bool(atk), latency, reason)
-        if atk and not reason:
-            write_attack(sip, sp, dip, dp)
+def _warm_worker(aset, barrier):
+    if aset.version not in _warm_models and (active is None or active.version != aset.version):
+        _warm_models[aset.version] = load_artifacts(aset)
+    # Retiene el proceso hasta que todos tengan su tarea: una por worker
+    barrier.wait()
 
 
-def main():
-    # 1) Cargar modelo y mapas → también reserva gpu_buf
-    load_artifacts()
+def warm_workers(pool, aset, timeout=120.0):
+    """
+    Carga `aset` en cada worker de proceso antes de activarlo, para que el
+    cambio no cargue el modelo dentro de un lote. El pool no deja elegir
+    worker: WORKERS tareas que esperan en una barrera caen una en cada proceso.
+    """
+    with mp.get_context("spawn").Manager() as manager:
+        barrier = manager.Barrier(WORKERS, timeout=timeout)
+        for fut in [pool.submit(_warm_worker, aset, barrier) for _ in range(WORKERS)]:
+            fut.result()
+
+
+def make_pool():
+    """Procesos con backend CPU (evitan el GIL); hilos con GPU (cada uno con su stream)."""
+    if BACKEND == "cpu":
+        return ProcessPoolExecutor(WORKERS, mp_context=mp.get_context("spawn"),
+                                   initializer=_init_worker, initargs=(artifact_set,))
+    return ThreadPoolExecutor(WORKERS, thread_name_prefix="gpu-infer")
+
+
+def run_ordered(pool, batches, finish):
+    """
+    Reparte `batches` ((llegadas, líneas), o None si no hay lote) entre los
+    workers y llama a finish(llegadas, líneas, *infer_batch(...)) en el MISMO
+    orden de llegada: las alertas de cada IP origen salen ordenadas aunque
+    los workers terminen desordenados. Como mucho 2×WORKERS lotes en vuelo.
+    """
+    inflight = deque()
+    for batch in batches:
+        if batch is not None:
+            arrivals, lines = batch
+            # Los procesos reciben el juego de artefactos vigente para recargar si cambió
+            aset = artifact_set if BACKEND == "cpu" else None
+            inflight.append((arrivals, lines, pool.submit(infer_batch, lines, aset)))
+        while inflight and (inflight[0][2].done() or len(inflight) >= 2 * WORKERS):
+            arrivals, lines, fut = inflight.popleft()
+            finish(arrivals, lines, *fut.result())
+    while inflight:
+        arrivals, lines, fut = inflight.popleft()
+        finish(arrivals, lines, *fut.result())
 
-    # 2) Cargar rangos de IPs “cloud”, “aws”, “ggen”… etc.
-    fetch_ranges("https://www.gstatic.com/ipranges/cloud.json",  "gcloud",   "prefixes", "ipv4Prefix")
-    fetch_ranges("https://ip-ranges.amazonaws.com/ip-ranges.json", "aws",  "prefixes", "ip_prefix")
-    fetch_ranges("https://www.gstatic.com/ipranges/goog.json",  "ggen",    "prefixes", "ipv4Prefix")
 
-    # 3) Poner en marcha el hilo lector de Redis
+def main():
+    global artifact_set, active, stream_acks
+    # 1) Cargar modelo y mapas → también reserva los búferes del backend
+    #    (con varios procesos CPU cada worker carga los suyos, y aquí solo
+    #    hace falta como referencia del canario si se exige un acuerdo mínimo)
+    artifact_set = read_artifact_set()
+    if BACKEND == "gpu" or WORKERS == 1 or (RELOAD_POLL > 0 and CANARY_MIN_AGREE > 0):
+        active = load_artifacts(artifact_set)
+    print(f"[INFO] Modelo activo: {artifact_set.version}")
+    pool = make_pool() if WORKERS > 1 else None
+    if RELOAD_POLL > 0:
+        Thread(target=artifacts_watcher, args=(pool,), daemon=True).start()
+
+    # 2) Rangos de IPs “cloud”, “aws”, “ggen”… desde el snapshot local;
+    #    la descarga/actualización va en su propio hilo
+    load_ranges_snapshot()
+    Thread(target=ranges_refresher, daemon=True).start()
+
+    # 3) Hilo de salida de alertas y hilo lector de Redis
+    start_alert_sink()
     q = Queue(maxsize=QUEUE_MAXSIZE)
-    Thread(target=redis_reader, args=(q,), daemon=True).start()
+    if REDIS_STREAMS:
+        stream_acks = StreamAcks(redis.Redis(host=REDIS_HOST, port=REDIS_PORT))
+        print(f"[INFO] Leyendo {REDIS_QUEUE_NAME} con XREADGROUP (grupo {STREAM_GROUP}, "
+              f"consumidor {STREAM_CONSUMER})")
+    Thread(target=stream_reader if REDIS_STREAMS else redis_reader, args=(q,), daemon=True).start()
+
+    # 4) Lotes de tamaño/espera adaptativos (GPU_BATCH es solo el tamaño inicial)
+    batcher = AdaptiveBatcher(LATENCY_SLO, MAX_ROWS, initial_batch=BATCH_SIZE,
+                              stats_every=STATS_EVERY, stats_file=SCHED_STATS_FILE)
+    if pool is None:
+        while keep_running and not batcher.closed:
+            items = batcher.collect(q)
+            if items:
+                arrivals, lines = zip(*items)
+                infer_s, latencies = process_batch(list(lines))
+                batcher.record(arrivals, infer_s, latencies)
+    else:
+        print(f"[INFO] {WORKERS} workers de inferencia ({BACKEND.upper()})")
 
-    buf = []
-    while keep_running:
-        try:
-            line = q.get(timeout=1)
-            if line is None:
-                break
-            buf.append(line)
-            if len(buf) >= BATCH_SIZE:
-                process_batch(buf)
-                buf.clear()
-        except Empty:
-            if buf:
-                process_batch(buf)
-                buf.clear()
+        def batches():
+            while keep_running and not batcher.closed:
+                # Con lotes en vuelo no se bloquea: hay que ir entregando resultados
+                items = batcher.collect(q, timeout=0.01)
+                yield tuple(map(list, zip(*items))) if items else None
+
+        def finish(arrivals, lines, proba, is_attack, infer_s, version):
+            batcher.record(arrivals, infer_s, finish_batch(lines, proba, is_attack, version))
+
+        run_ordered(pool, batches(), finish)
+        pool.shutdown()
+
+    # Vaciar las alertas pendientes antes de salir
+    sink.close()
 
 
 if __name__ == "__main__":
     for sig in (signal.SIGINT, signal.SIGTERM):
         signal.signal(sig, lambda *_: globals().__setitem__("keep_running", False))
 
-    print("[INFO] IDS GPU batch listo")
+    print(f"[INFO] IDS batch listo (backend {BACKEND.upper()}, entrada {ML_FORMAT.upper()})")
     main()
     print("[INFO] Fin.")
@@ -0,0 +1,138 @@
+"""
+Paquete único y autodescriptivo del modelo para ml_processor.
+
+Un solo fichero con:
+    MAGIC (8 B) · longitud de la cabecera (uint64 LE) · cabecera JSON
+    · arrays del bosque aplanado (forest_cpu.FlatForest), alineados a 64 B
+
+La cabecera lleva la versión, el orden de características, de qué columna
+CSV sale cada una (sin adivinar dport/dsport), los mapas de StringIndexer,
+el umbral, la clase "ataque" y los metadatos del entrenamiento. Los arrays
+se abren con np.memmap: cargar es leer la cabecera, y varios procesos
+worker comparten las mismas páginas de la caché del sistema.
+
+Uso desde train_rf.py:
+    write_bundle("model_bundle.idsb", export_forest(model, ...), feat_order, maps, version=...)
+"""
+import json
+import os
+import time
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from batch_parser import default_sources
+from forest_cpu import FlatForest
+
+MAGIC       = b"IDSBNDL1"
+FORMAT      = 1
+ALIGN       = 64
+ARRAY_NAMES = ("feature", "threshold", "left", "right", "value", "roots")
+
+
+class ModelBundle:
+    def __init__(self, header: dict, forest: FlatForest):
+        self.header        = header
+        self.forest        = forest
+        self.version       = header["version"]
+        self.feature_order = header["feature_order"]
+        self.sources       = header["sources"]
+        self.maps          = header["maps"]
+        self.threshold     = float(header["threshold"])
+        self.attack_class  = int(header["attack_class"])
+        self.metadata      = header.get("metadata", {})
+
+    def predict_attack(self, X: np.ndarray) -> np.ndarray:
+        """P(ataque) por fila."""
+        return self.forest.predict_proba(X)[:, self.attack_class]
+
+
+def _pad(n: int) -> int:
+    return (-n) % ALIGN
+
+
+def write_bundle(path: str, forest: FlatForest, feature_order: Sequence[str],
+                 maps: Dict[str, Dict[str, float]], *, version: str,
+                 threshold: float = 0.5, attack_class: int = 1,
+                 sources: Optional[Dict[str, str]] = None,
+                 metadata: Optional[dict] = None) -> None:
+    """Escribe el paquete de forma atómica (fichero temporal + os.replace)."""
+    arrays = {
+        "feature"  : np.ascontiguousarray(forest.feature, dtype="<i4"),
+        "threshold": np.ascontiguousarray(forest.threshold, dtype="<f8"),
+        "left"     : np.ascontiguousarray(forest.left, dtype="<i4"),
+        "right"    : np.ascontiguousarray(forest.right, dtype="<i4"),
+        "value"    : np.ascontiguousarray(forest.value, dtype="<f4"),
+        "roots"    : np.ascontiguousarray(forest.roots, dtype="<i4"),
+    }
+    header = {
+        "format"       : FORMAT,
+        "version"      : version,
+        "created"      : time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "feature_order": list(feature_order),
+        "sources"      : sources if sources is not None else default_sources(feature_order),
+        "maps"         : maps,
+        "threshold"    : threshold,
+        "attack_class" : attack_class,
+        "max_depth"    : forest.max_depth,
+        "metadata"     : metadata or {},
+        "arrays"       : {},
+    }
+
+    # Los offsets dependen del tamaño de la cabecera, que depende de los
+    # offsets: se reserva espacio fijo al final de la cabecera
+    def encode(offset0: int) -> bytes:
+        off = offset0
+        for name, arr in arrays.items():
+            header["arrays"][name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": off}
+            off += arr.nbytes + _pad(arr.nbytes)
+        return json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+    raw = encode(0)
+    start = 16 + len(raw) + 256
+    start += _pad(start)
+    raw = encode(start)
+    raw += b" " * (start - 16 - len(raw))
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(MAGIC)
+        fh.write(np.uint64(len(raw)).tobytes())
+        fh.write(raw)
+        for arr in arrays.values():
+            fh.write(arr.tobytes())
+            fh.write(b"\0" * _pad(arr.nbytes))
+    os.replace(tmp, path)
+
+
+def read_header(path: str) -> dict:
+    with open(path, "rb") as fh:
+        if fh.read(8) != MAGIC:
+            raise ValueError(f"{path}: no es un paquete de modelo")
+        n = int(np.frombuffer(fh.read(8), dtype="<u8")[0])
+        header = json.loads(fh.read(n))
+    if header.get("format") != FORMAT:
+        raise ValueError(f"{path}: formato {header.get('format')} no soportado")
+    return header
+
+
+def load_bundle(path: str) -> ModelBundle:
+    """Abre el paquete con mmap (solo lectura); los arrays no se copian."""
+    header = read_header(path)
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    arrs = {
+        name: np.ndarray(tuple(a["shape"]), dtype=np.dtype(a["dtype"]), buffer=mm, offset=a["offset"])
+        for name, a in header["arrays"].items()
+    }
+    forest = FlatForest(*(arrs[n] for n in ARRAY_NAMES), header["max_depth"])
+    return ModelBundle(header, forest)
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 2:
+        sys.exit("Uso: python model_bundle.py <paquete.idsb>")
+    h = read_header(sys.argv[1])
+    h.pop("arrays")
+    h.pop("maps")
+    print(json.dumps(h, ensure_ascii=False, indent=2))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+bench_ct_window.py  —  Paridad y rendimiento de ConnWindow frente a los ct_* originales.
+-----------------------------------------------------------------------
+Reproduce los Argus de `perdidos/*/argus.log` (con servicio asignado como
+haría la fusión con Zeek) calculando los siete ct_* con la implementación
+original (siete pasadas sobre el histórico) y con ConnWindow. Falla si
+algún valor difiere y muestra registros/s de ambas.
+
+Uso:
+    python bench_ct_window.py [--logs ../merged_logs] [--window 100] [--rounds 5]
+"""
+from __future__ import annotations
+
+import argparse, copy, glob, json, os, time
+from collections import deque
+from typing import Deque, List
+
+from merge_argus_zeek import CT_WINDOW, ConnWindow, cast_port, to_float
+
+SERVICES = ("-", "http", "ftp", "dns", "ssl", "ssh")
+
+
+def legacy_connection_features(rec: dict, history: Deque[dict]) -> dict:
+    """Implementación previa de los ct_* (referencia de paridad)."""
+    if "ltime" in rec:
+        try:
+            rec["ltime"] = int(rec["ltime"])
+        except Exception:
+            pass
+
+    saddr, daddr = rec.get("saddr"), rec.get("daddr")
+    sport, dport = cast_port(rec.get("sport")), cast_port(rec.get("dport"))
+    service = rec.get("service", "-")
+
+    def same(field_vals):
+        cnt = 0
+        for h in history:
+            if "ltime" in h:
+                try:
+                    h["ltime"] = int(h["ltime"])
+                except Exception:
+                    pass
+            if all(h.get(f) == v for f, v in field_vals):
+                cnt += 1
+        return cnt
+
+    return {
+        "ct_srv_src": same([("service", service), ("saddr", saddr), ("ltime", rec.get("ltime"))]),
+        "ct_srv_dst": same([("service", service), ("daddr", daddr), ("ltime", rec.get("ltime"))]),
+        "ct_dst_ltm": same([("daddr", daddr), ("ltime", rec.get("ltime"))]),
+        "ct_src_ltm": same([("saddr", saddr), ("ltime", rec.get("ltime"))]),
+        "ct_src_dport_ltm": same([("saddr", saddr), ("dport", dport), ("ltime", rec.get("ltime"))]),
+        "ct_dst_sport_ltm": same([("daddr", daddr), ("sport", sport), ("ltime", rec.get("ltime"))]),
+        "ct_dst_src_ltm": same([("saddr", saddr), ("daddr", daddr), ("ltime", rec.get("ltime"))]),
+    }
+
+
+def load_records(logs_dir: str) -> List[dict]:
+    records: List[dict] = []
+    for path in sorted(glob.glob(os.path.join(logs_dir, "perdidos", "*", "argus.log"))):
+        with open(path, encoding="utf-8") as fh:
+            for i, line in enumerate(fh):
+                if not line.strip():
+                    continue
+                rec = json.loads(line)
+                for t in ("stime", "ltime"):
+                    if t in rec:
+                        rec[t] = int(round(to_float(rec[t])))
+                # Los protocolos sin Zeek se publican sin "service"
+                if str(rec.get("proto", "")).lower() in ("tcp", "udp", "icmp"):
+                    rec["service"] = SERVICES[i % len(SERVICES)]
+                records.append(rec)
+    return records
+
+
+def main() -> None:
+    here = os.path.dirname(os.path.abspath(__file__))
+    ap = argparse.ArgumentParser(description="Paridad/benchmark de los ct_*")
+    ap.add_argument("--logs", default=os.path.join(here, "..", "merged_logs"))
+    ap.add_argument("--window", type=int, default=CT_WINDOW)
+    ap.add_argument("--rounds", type=int, default=5, help="Repeticiones de los datos de ejemplo")
+    args = ap.parse_args()
+
+    sample = load_records(args.logs)
+    if not sample:
+        raise SystemExit(f"❌ Sin datos de ejemplo en {args.logs}")
+    stream = [copy.deepcopy(rec) for _ in range(args.rounds) for rec in sample]
+
+    history: Deque[dict] = deque(maxlen=args.window)
+    old_out = []
+    replay = copy.deepcopy(stream)
+    t0 = time.perf_counter()
+    for rec in replay:
+        old_out.append(legacy_connection_features(rec, history))
+        history.append(rec)
+    t_old = time.perf_counter() - t0
+
+    window = ConnWindow(args.window)
+    new_out = []
+    replay = copy.deepcopy(stream)
+    t0 = time.perf_counter()
+    for rec in replay:
+        new_out.append(window.features(rec))
+        window.append(rec)
+    t_new = time.perf_counter() - t0
+
+    diffs = sum(a != b for a, b in zip(old_out, new_out))
+    nonzero = sum(any(v for v in ct.values()) for ct in new_out)
+    print(f"Registros: {len(stream)} (ventana {args.window}, {nonzero} con algún ct_* > 0)")
+    print(f"Original   : {len(stream) / t_old:>10.0f} reg/s")
+    print(f"ConnWindow : {len(stream) / t_new:>10.0f} reg/s")
+    if diffs:
+        raise SystemExit(f"❌ {diffs} registros con ct_* distintos")
+    print("✅ Salida idéntica")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+bench_flow_state.py  —  Prueba de resistencia (soak) del estado por flujo.
+-----------------------------------------------------------------------
+Reproduce flujos sintéticos con 5-tuplas siempre nuevas por los mismos
+caminos que `merge_argus_zeek.py` (acumulación HTTP_ACC, ct_flw_http_mthd y
+ct_ftp_cmd), con una parte de los flujos cuyo registro de Argus nunca
+llega, y mide la RSS del proceso a lo largo de la ejecución:
+
+    legacy     dict + Counter globales, como antes (crecen sin límite)
+    flowstate  FlowState con caducidad por tiempo de evento y tope LRU
+
+Cada implementación corre en su propio proceso. Falla (código 1) si con
+FlowState la RSS sigue creciendo en la segunda mitad de la prueba.
+
+Uso:
+    python bench_flow_state.py [--flows 1000000] [--rate 2000] [--orphan 0.2]
+                               [--ttl 60] [--max 200000] [--max-growth-mb 16]
+"""
+from __future__ import annotations
+
+import argparse, json, os, random, subprocess, sys, time
+from collections import Counter
+from typing import Dict, List
+
+from merge_argus_zeek import (FLOW_STATE_MAX, FLOW_STATES, HTTP_ACC,
+                              MAP_COUNT_FTP, MAP_COUNT_HTTP, accumulate_http)
+
+PAGE = os.sysconf("SC_PAGE_SIZE")
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as fh:
+        return int(fh.read().split()[1]) * PAGE / 2**20
+
+
+def zeek_http(key: tuple, ts: float, depth: int) -> dict:
+    return {"ts": ts, "uid": f"C{random.getrandbits(64):x}", "id.orig_h": key[1],
+            "id.orig_p": key[2], "id.resp_h": key[3], "id.resp_p": key[4],
+            "trans_depth": depth, "method": "GET", "host": "example.org",
+            "uri": f"/item/{random.getrandbits(20)}", "user_agent": "Mozilla/5.0",
+            "status_code": 200, "response_body_len": random.randint(0, 50_000),
+            "zeek_log": "http"}
+
+
+def soak(impl: str, flows: int, rate: float, orphan: float, samples: int) -> List[list]:
+    random.seed(0)
+    legacy_acc: Dict[tuple, dict] = {}
+    legacy_http: Counter = Counter()
+    legacy_ftp: Counter = Counter()
+    t = 1_750_000_000.0
+    curve = []
+    every = max(1, flows // samples)
+    for f in range(flows):
+        t += 1.0 / rate
+        # 5-tupla nueva en cada flujo: cardinalidad = nº de flujos
+        key = ("tcp", f"10.{f >> 16 & 255}.{f >> 8 & 255}.{f & 255}", 1024 + f % 60000,
+               "192.168.1.10", 80 if f % 4 else 21)
+        if key[4] == 80:
+            for depth in range(1, random.randint(1, 3) + 1):
+                z = zeek_http(key, t, depth)
+                if impl == "legacy":
+                    acc = legacy_acc.setdefault(key, {"sum_len": 0, "max_depth": 0, "last_z": None})
+                    acc["sum_len"] += z["response_body_len"]
+                    acc["max_depth"] = max(acc["max_depth"], depth)
+                    acc["last_z"] = z.copy()
+                else:
+                    accumulate_http(key, z, t)
+            if random.random() >= orphan:
+                # Llega el registro de Argus: fusión final y contador del flujo
+                if impl == "legacy":
+                    legacy_acc.pop(key, None)
+                    legacy_http[key] += 1
+                else:
+                    HTTP_ACC.pop(key)
+                    MAP_COUNT_HTTP.incr(key, t)
+        else:
+            for _ in range(random.randint(1, 4)):
+                if impl == "legacy":
+                    legacy_ftp[key] += 1
+                else:
+                    MAP_COUNT_FTP.incr(key, t)
+        if impl != "legacy" and f % 256 == 0:
+            for state in FLOW_STATES:
+                state.expire(t)
+        if f % every == 0 or f == flows - 1:
+            live = (len(legacy_acc) + len(legacy_http) + len(legacy_ftp) if impl == "legacy"
+                    else sum(len(s) for s in FLOW_STATES))
+            curve.append([f + 1, round(rss_mb(), 1), live])
+    return curve
+
+
+def run_child(impl: str, args) -> dict:
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", impl,
+           "--flows", str(args.flows), "--rate", str(args.rate), "--orphan", str(args.orphan),
+           "--samples", str(args.samples), "--ttl", str(args.ttl), "--max", str(args.max)]
+    t0 = time.perf_counter()
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    res = json.loads(out.strip().splitlines()[-1])
+    res["seconds"] = time.perf_counter() - t0
+    return res
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Soak del estado por flujo del merge")
+    ap.add_argument("--flows", type=int, default=1_000_000)
+    ap.add_argument("--rate", type=float, default=2000.0, help="Flujos nuevos por segundo de tiempo de evento")
+    ap.add_argument("--orphan", type=float, default=0.2, help="Fracción de flujos HTTP sin registro de Argus")
+    ap.add_argument("--samples", type=int, default=10)
+    # TTL corto para alcanzar el régimen estacionario en pocos minutos de
+    # tiempo de evento (con el de producción hacen falta rate × ttl flujos)
+    ap.add_argument("--ttl", type=float, default=60.0)
+    ap.add_argument("--max", type=int, default=FLOW_STATE_MAX)
+    ap.add_argument("--max-growth-mb", type=float, default=16.0,
+                    help="Crecimiento máximo de RSS en la segunda mitad con FlowState")
+    ap.add_argument("--child", choices=("legacy", "flowstate"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        for state in FLOW_STATES:
+            state.ttl, state.maxlen = args.ttl, args.max
+        curve = soak(args.child, args.flows, args.rate, args.orphan, args.samples)
+        stats = {s.name: [len(s), s.expired, s.evicted] for s in FLOW_STATES}
+        print(json.dumps({"curve": curve, "stats": stats}))
+        return
+
+    print(f"Flujos: {args.flows} (5-tuplas distintas) · {args.rate:g}/s · huérfanos HTTP {args.orphan:.0%}"
+          f" · TTL {args.ttl:g} s · tope {args.max}")
+    results = {impl: run_child(impl, args) for impl in ("legacy", "flowstate")}
+    print(f"{'flujos':>9}  {'legacy RSS':>10}  {'entradas':>9}  {'FlowState RSS':>13}  {'entradas':>9}")
+    for (n, rss_a, live_a), (_, rss_b, live_b) in zip(results["legacy"]["curve"],
+                                                       results["flowstate"]["curve"]):
+        print(f"{n:>9}  {rss_a:>8.1f}MB  {live_a:>9}  {rss_b:>11.1f}MB  {live_b:>9}")
+    for impl, res in results.items():
+        print(f"{impl}: {res['seconds']:.1f} s")
+    for name, (live, expired, evicted) in results["flowstate"]["stats"].items():
+        print(f"  {name}: vivas {live}, caducadas {expired}, expulsadas {evicted}")
+
+    curve = results["flowstate"]["curve"]
+    half = curve[len(curve) // 2][1]
+    growth = max(rss for _, rss, _ in curve[len(curve) // 2:]) - half
+    if growth > args.max_growth_mb:
+        print(f"❌ La RSS con FlowState crece {growth:.1f} MB en la segunda mitad "
+              f"(máx {args.max_growth_mb:g} MB)")
+        sys.exit(1)
+    print(f"✅ RSS acotada con FlowState: +{growth:.1f} MB en la segunda mitad")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+bench_match_cache.py  —  Compara la caché lineal antigua con MatchCache.
+-----------------------------------------------------------------------
+Reproduce los datos de ejemplo de `merged_logs` (Zeek JSON Lines y los
+Argus que quedaron en `perdidos/*/argus.log`) contra las cachés de
+sin-match de `merge_argus_zeek.py`, precargadas con registros que nunca
+casan hasta el tamaño indicado, y muestra registros/s antes y después.
+
+Con --long-lived simula conexiones persistentes que reutilizan la 5-tupla
+(registros de estado de Argus cada 5 s, conn.log de Zeek al cerrar) y
+compara la correlación solo por clave con la de ventana temporal + TTL:
+parejas correctas/erróneas, caducados y pico de pendientes.
+
+Uso:
+    python bench_match_cache.py [--logs ../merged_logs] [--sizes 10000 100000]
+                                [--records 5000]
+    python bench_match_cache.py --long-lived [--flows 20000] [--queue-size 100000]
+                                [--ttl 60 300 600]
+"""
+from __future__ import annotations
+
+import argparse, glob, json, os, random, time
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+from merge_argus_zeek import MATCH_TTL, MatchCache, build_key, event_time, to_float
+
+
+class LinearCache:
+    """Implementación previa: deque circular con búsqueda lineal."""
+
+    def __init__(self, maxlen: int):
+        self._dq: Deque[Tuple[tuple, dict]] = deque(maxlen=maxlen)
+
+    def __len__(self) -> int:
+        return len(self._dq)
+
+    def append(self, key: tuple, rec: dict, t0: float = 0.0, t1: Optional[float] = None,
+               app: bool = False) -> None:
+        self._dq.append((key, rec))
+
+    def match(self, key: tuple, t0: float = 0.0, t1: Optional[float] = None, app: bool = False,
+              keep: bool = False) -> Optional[dict]:
+        for idx, (ok, rec) in enumerate(self._dq):
+            if key == ok:
+                if not keep:
+                    self._dq.rotate(-idx)
+                    self._dq.popleft()
+                return rec
+        return None
+
+
+def load_sample(logs_dir: str) -> List[Tuple[str, dict]]:
+    """Devuelve los registros de ejemplo intercalados como ('argus'|'zeek', rec)."""
+    argus: List[dict] = []
+    for path in sorted(glob.glob(os.path.join(logs_dir, "perdidos", "*", "argus.log"))):
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                if line.strip():
+                    rec = json.loads(line)
+                    for t in ("stime", "ltime"):
+                        if t in rec:
+                            rec[t] = int(round(to_float(rec[t])))
+                    argus.append(rec)
+    zeek: List[dict] = []
+    for path in sorted(glob.glob(os.path.join(logs_dir, "zeek", "*.jsonl"))):
+        with open(path, encoding="utf-8") as fh:
+            zeek.extend(json.loads(line) for line in fh if line.strip())
+
+    stream: List[Tuple[str, dict]] = []
+    for i in range(max(len(argus), len(zeek))):
+        if i < len(argus):
+            stream.append(("argus", argus[i]))
+        if i < len(zeek):
+            stream.append(("zeek", zeek[i]))
+    return stream
+
+
+def replay(cache_cls, size: int, stream: List[Tuple[str, dict]], records: int) -> float:
+    argus_cache = cache_cls(size)
+    zeek_cache = cache_cls(size)
+    # Relleno que nunca casa para simular una cola de sin-match llena
+    for i in range(size):
+        filler = ("bench", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", i, "0.0.0.0", 0)
+        argus_cache.append(filler, {}, 0.0)
+        zeek_cache.append(filler, {}, 0.0)
+
+    events = []
+    for src, rec in stream:
+        if src == "argus":
+            t = event_time(rec.get("stime"), 0.0)
+            events.append((src, rec, build_key(argus=rec), t, event_time(rec.get("ltime"), t), False))
+        else:
+            t = event_time(rec.get("ts"), 0.0)
+            events.append((src, rec, build_key(zeek=rec), t, t, rec.get("zeek_log") in ("http", "ftp")))
+    done = 0
+    t_start = time.perf_counter()
+    while done < records:
+        for src, rec, key, t0, t1, app in events:
+            if src == "argus":
+                if zeek_cache.match(key, t0, t1) is None:
+                    argus_cache.append(key, rec, t0, t1)
+            else:
+                keep = rec.get("zeek_log") == "ftp"
+                if argus_cache.match(key, t0, t1, app, keep=keep) is None:
+                    zeek_cache.append(key, rec, t0, t1, app)
+            done += 1
+            if done >= records:
+                break
+    return done / (time.perf_counter() - t_start)
+
+
+# ─── Conexiones persistentes ──────────────────────────────────────────
+def long_lived_events(flows: int, ports: int, seed: int = 0) -> List[tuple]:
+    """
+    Eventos (emisión, fuente, flujo, clave, t0, t1) de `flows` conexiones que
+    reutilizan `ports` puertos origen: Argus emite un registro cada 5 s (al
+    cerrar su intervalo) y Zeek el conn.log al terminar, con ts = inicio.
+    """
+    rng = random.Random(seed)
+    events = []
+    t = 1_750_000_000.0
+    for f in range(flows):
+        t += rng.expovariate(20.0)                  # ~20 conexiones nuevas/s
+        start = round(t, 6)
+        dur = rng.choice((0.2, 3.0, 12.0, 47.0, 180.0))
+        key = ("tcp", "79.116.214.15", 40000 + f % ports, "10.204.0.6", 6379)
+        s = start
+        while True:
+            l = min(s + 5.0, start + dur)
+            events.append((l, "argus", f, key, s, l))
+            if l >= start + dur:
+                break
+            s = l
+        events.append((start + dur + 0.5, "zeek", f, key, start, start))
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+def replay_long_lived(make_cache, events: List[tuple], expire: bool) -> dict:
+    argus_cache, zeek_cache = make_cache(), make_cache()
+    wm = {"argus": float("-inf"), "zeek": float("-inf")}
+    ok = wrong = 0
+    peak = 0
+    for i, (_, src, flow, key, t0, t1) in enumerate(events):
+        rec = {"flow": flow, "stime": t0}
+        wm[src] = max(wm[src], t0)
+        if src == "argus":
+            z = zeek_cache.match(key, t0, t1)
+            if z is None:
+                argus_cache.append(key, rec, t0, t1)
+            else:
+                ok += z["flow"] == flow and z["stime"] == t0
+                wrong += z["flow"] != flow or z["stime"] != t0
+        else:
+            a = argus_cache.match(key, t0, t1)
+            if a is None:
+                zeek_cache.append(key, rec, t0, t1)
+            else:
+                ok += a["flow"] == flow and a["stime"] == t0
+                wrong += a["flow"] != flow or a["stime"] != t0
+        if expire and i % 256 == 0:
+            argus_cache.expire(wm["zeek"])
+            zeek_cache.expire(wm["argus"])
+        peak = max(peak, len(argus_cache) + len(zeek_cache))
+    return {"ok": ok, "wrong": wrong, "peak": peak,
+            "expired": getattr(argus_cache, "expired", 0) + getattr(zeek_cache, "expired", 0),
+            "overflow": getattr(argus_cache, "overflow", 0) + getattr(zeek_cache, "overflow", 0)}
+
+
+def bench_long_lived(flows: int, ports: int, size: int, ttls: List[float]) -> None:
+    events = long_lived_events(flows, ports)
+    conns = sum(1 for e in events if e[1] == "zeek")
+    print(f"Conexiones: {conns} sobre {ports} puertos origen · registros Argus: {len(events) - conns}")
+    print(f"{'caché':>20}  {'correctas':>9}  {'erróneas':>8}  {'caducados':>9}  {'por tope':>8}"
+          f"  {'pico pendientes':>15}  {'s':>5}")
+    runs = [("solo clave (FIFO)", lambda: LinearCache(size), False)]
+    runs += [(f"tiempo, TTL {ttl:g} s", lambda ttl=ttl: MatchCache(size, ttl=ttl), True) for ttl in ttls]
+    for name, make_cache, expire in runs:
+        t0 = time.perf_counter()
+        res = replay_long_lived(make_cache, events, expire)
+        print(f"{name:>20}  {res['ok']:>9}  {res['wrong']:>8}  {res['expired']:>9}  {res['overflow']:>8}"
+              f"  {res['peak']:>15}  {time.perf_counter() - t0:>5.1f}")
+
+
+def main() -> None:
+    here = os.path.dirname(os.path.abspath(__file__))
+    ap = argparse.ArgumentParser(description="Benchmark de las cachés de sin-match")
+    ap.add_argument("--logs", default=os.path.join(here, "..", "merged_logs"))
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    ap.add_argument("--records", type=int, default=5000,
+                    help="Registros reproducidos por prueba")
+    ap.add_argument("--long-lived", action="store_true",
+                    help="Simula conexiones persistentes en vez de usar merged_logs")
+    ap.add_argument("--flows", type=int, default=20000)
+    ap.add_argument("--ports", type=int, default=50, help="Puertos origen reutilizados")
+    ap.add_argument("--queue-size", type=int, default=100_000)
+    ap.add_argument("--ttl", type=float, nargs="+", default=[60.0, 300.0, MATCH_TTL])
+    args = ap.parse_args()
+
+    if args.long_lived:
+        bench_long_lived(args.flows, args.ports, args.queue_size, args.ttl)
+        return
+
+    stream = load_sample(args.logs)
+    if not stream:
+        raise SystemExit(f"❌ Sin datos de ejemplo en {args.logs}")
+    print(f"Registros de ejemplo: {len(stream)}")
+
+    print(f"{'tamaño':>8}  {'antes (reg/s)':>14}  {'después (reg/s)':>16}  {'x':>7}")
+    for size in args.sizes:
+        before = replay(LinearCache, size, stream, args.records)
+        after = replay(MatchCache, size, stream, args.records)
+        print(f"{size:>8}  {before:>14.0f}  {after:>16.0f}  {after / before:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
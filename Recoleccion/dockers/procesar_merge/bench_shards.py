@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+bench_shards.py  —  Merge con shards: reparto, ct_* y escalado con N.
+-----------------------------------------------------------------------
+Genera flujos sintéticos (Argus + conn.log de Zeek con el mismo stime/ts) y:
+
+  1. Comprueba que ra_to_redis.py, zeek_to_redis.py y merge_argus_zeek.py
+     asignan cada flujo al mismo shard, y el reparto entre shards.
+  2. Mide, sin Redis, cuánto se desvían los ct_* del merge sin shards si
+     cada shard usara su propia ventana (aproximación descartada) y con la
+     etapa única --ct_stage, que recibe los lotes de los workers
+     intercalados, sin y con su búfer de reordenación (--ct_reorder).
+  3. Con --redis, lanza N workers reales (+ la etapa ct_* si N > 1) sobre
+     las colas precargadas y mide registros/s hasta vaciarlas; compara los
+     ct_* publicados con los de N = 1.
+
+Uso:
+    python bench_shards.py [--flows 50000] [--shards 1 2 4]
+    python bench_shards.py --redis 127.0.0.1:6379 [--flows 50000] [--shards 1 2 4] [--use_stream]
+"""
+from __future__ import annotations
+
+import argparse, importlib.util, json, os, random, shutil, subprocess, sys, tempfile, time
+from typing import Dict, List, Tuple
+
+from merge_argus_zeek import (CT_REORDER, CT_WINDOW, ML_COLS, ZEOK_EXTRA, ConnWindow,
+                              ReorderBuffer, build_key, shard_of)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RA_FIELDS = ("stime,proto,saddr,sport,daddr,dport,state,ltime,spkts,dpkts,sbytes,dbytes,sttl,dttl,"
+             "sload,dload,sloss,dloss,sintpkt,dintpkt,sjit,djit,stcpb,dtcpb,tcprtt,synack,ackdat,"
+             "smeansz,dmeansz,dur").split(",")
+SERVICES = ("-", "http", "dns", "ssl", "ssh")
+
+
+def load_producer(subdir: str, name: str):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(HERE, "..", subdir, f"{name}.py"))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def synthetic_flows(n: int, rate: float = 2000.0, seed: int = 0) -> List[Tuple[dict, dict]]:
+    """(argus, zeek conn) por flujo: pocas IPs para que los ct_* no sean triviales."""
+    rng = random.Random(seed)
+    t = 1_750_000_000.0
+    flows = []
+    for i in range(n):
+        t += rng.expovariate(rate)
+        stime = round(t, 6)
+        dur = rng.choice((0.001, 0.05, 0.4, 2.0))
+        proto = rng.choice(("tcp", "tcp", "tcp", "udp"))
+        saddr, daddr = f"10.0.{rng.randrange(4)}.{rng.randrange(1, 40)}", f"192.168.1.{rng.randrange(1, 12)}"
+        sport, dport = 1024 + rng.randrange(60000), rng.choice((80, 443, 53, 22, 6379))
+        argus = {f: "" for f in RA_FIELDS}
+        argus.update(stime=f"{stime:.6f}", ltime=f"{stime + dur:.6f}", proto=proto, saddr=saddr,
+                     sport=str(sport), daddr=daddr, dport=str(dport), state="CON",
+                     spkts=str(rng.randrange(1, 20)), dpkts=str(rng.randrange(1, 20)),
+                     sbytes=str(rng.randrange(60, 9000)), dbytes=str(rng.randrange(60, 9000)),
+                     dur=f"{dur:.6f}")
+        zeek = {"ts": stime, "uid": f"C{i:x}", "id.orig_h": saddr, "id.orig_p": sport,
+                "id.resp_h": daddr, "id.resp_p": dport, "proto": proto,
+                "service": rng.choice(SERVICES), "duration": dur, "conn_state": "SF", "zeek_log": "conn"}
+        flows.append((argus, zeek))
+    return flows
+
+
+def merged_view(argus: dict, zeek: dict) -> dict:
+    """Lo que ConnWindow ve del registro fusionado (campos de los ct_*)."""
+    return {"saddr": argus["saddr"], "daddr": argus["daddr"], "sport": argus["sport"],
+            "dport": argus["dport"], "service": zeek.get("service", "-"),
+            "stime": float(argus["stime"]), "ltime": int(round(float(argus["ltime"])))}
+
+
+# ─── 1. Reparto ──────────────────────────────────────────────────────
+def check_routing(flows, shards: int) -> List[int]:
+    ra = load_producer("procesar_ra", "ra_to_redis")
+    zk = load_producer("procesar_zeek", "zeek_to_redis")
+    counts = [0] * shards
+    for argus, zeek in flows:
+        s = shard_of(build_key(argus=argus), shards)
+        if not (ra.flow_shard(argus, shards) == s == zk.flow_shard(zeek, "conn", shards)
+                == shard_of(build_key(zeek=zeek), shards)):
+            raise SystemExit(f"❌ Shard distinto entre productores y merge: {argus} / {zeek}")
+        counts[s] += 1
+    return counts
+
+
+# ─── 2. Aproximación de los ct_* ──────────────────────────────────────
+def ct_values(records, window: int) -> List[tuple]:
+    win = ConnWindow(window)
+    out = []
+    for rec in records:
+        rec = dict(rec)
+        ct = win.features(rec)
+        out.append(tuple(ct[k] for k in ZEOK_EXTRA))
+        win.append(rec)
+    return out
+
+
+def ct_error(ref: List[tuple], got: List[tuple]) -> Tuple[float, float]:
+    """(% de registros con algún ct_* distinto, error absoluto medio por ct_*)."""
+    diff = sum(a != b for a, b in zip(ref, got))
+    mae = sum(abs(x - y) for a, b in zip(ref, got) for x, y in zip(a, b)) / (len(ref) * len(ZEOK_EXTRA))
+    return 100.0 * diff / len(ref), mae
+
+
+def ct_approximation(flows, shards: int, window: int, batch: int,
+                     slack: float) -> Dict[str, Tuple[float, float]]:
+    records = [merged_view(a, z) for a, z in flows]
+    ref = ct_values(records, window)
+    per_shard: List[List[int]] = [[] for _ in range(shards)]
+    for i, (argus, _) in enumerate(flows):
+        per_shard[shard_of(build_key(argus=argus), shards)].append(i)
+
+    def scatter(order: List[int]) -> List[tuple]:
+        got = [None] * len(records)
+        for i, ct in zip(order, ct_values([records[i] for i in order], window)):
+            got[i] = ct
+        return got
+
+    # a) ventana propia en cada shard
+    local = [None] * len(records)
+    for idx in per_shard:
+        for i, ct in zip(idx, ct_values([records[i] for i in idx], window)):
+            local[i] = ct
+    # b) etapa única: recibe lotes de `batch` registros de cada shard por turnos
+    arrival, pos = [], [0] * shards
+    while len(arrival) < len(records):
+        for s, idx in enumerate(per_shard):
+            arrival.extend(idx[pos[s]:pos[s] + batch])
+            pos[s] += batch
+    # c) la misma llegada pasando por el búfer de reordenación de la etapa
+    buf, reordered = ReorderBuffer(slack), []
+    for i in arrival:
+        reordered.extend(buf.push(records[i]["stime"], i))
+    reordered.extend(buf.drain())
+    return {"ventana por shard": ct_error(ref, local),
+            "etapa ct_* sin reorden": ct_error(ref, scatter(arrival)),
+            f"etapa ct_* ({slack:g} s)": ct_error(ref, scatter(reordered))}
+
+
+# ─── 3. Rendimiento con Redis ─────────────────────────────────────────
+def run_pipeline(r, host: str, port: int, flows, shards: int, batch: int, reorder: float,
+                 timeout: float, use_stream: bool = False):
+    """Precarga las colas, lanza los procesos y espera a que salgan todos los fusionados."""
+    r.flushdb()
+    out_dir = tempfile.mkdtemp(prefix="bench_shards_")
+    base = [sys.executable, os.path.join(HERE, "merge_argus_zeek.py"), "--redis_host", host,
+            "--redis_port", str(port), "--output_dir", out_dir, "--batch_size", str(batch),
+            "--max_wait", "0.05", "--log_every", "3600", "--spill_snapshot_every", "0",
+            "--argus_queue", "bench_argus", "--zeek_queue", "bench_zeek",
+            "--merge_queue", "bench_merge", "--ct_queue", "bench_ct", "--shards", str(shards),
+            "--ct_reorder", str(reorder)] + (["--use_stream"] if use_stream else [])
+    cmds = [base + ["--shard", str(i)] for i in range(shards)]
+    if shards > 1:
+        cmds.append(base + ["--ct_stage"])
+    logs = [open(os.path.join(out_dir, f"proc{i}.log"), "w") for i in range(len(cmds))]
+    procs = [subprocess.Popen(c, stdout=log, stderr=subprocess.STDOUT) for c, log in zip(cmds, logs)]
+    try:
+        time.sleep(1.5)                     # arranque de los intérpretes
+        t0 = time.perf_counter()
+        pipe = r.pipeline(transaction=False)
+        push = (lambda key, data: pipe.xadd(key, {"data": data})) if use_stream else pipe.rpush
+        length = r.xlen if use_stream else r.llen
+        for i in range(0, len(flows), 1000):
+            chunk = flows[i:i + 1000]
+            for argus, zeek in chunk:
+                s = shard_of(build_key(argus=argus), shards)
+                push(f"bench_argus:{s}" if shards > 1 else "bench_argus", json.dumps(argus))
+                push(f"bench_zeek:{s}" if shards > 1 else "bench_zeek", json.dumps(zeek))
+            pipe.execute()
+        t_load = time.perf_counter() - t0
+        while length("bench_merge") < len(flows):
+            if time.perf_counter() - t0 > timeout:
+                raise SystemExit(f"❌ N={shards}: solo {length('bench_merge')}/{len(flows)} fusionados "
+                                 f"en {timeout:g} s")
+            dead = [i for i, p in enumerate(procs) if p.poll() is not None]
+            if dead:
+                with open(logs[dead[0]].name) as fh:
+                    tail = "".join(fh.readlines()[-10:])
+                raise SystemExit(f"❌ N={shards}: el proceso {' '.join(cmds[dead[0]][-3:])} terminó "
+                                 f"antes de tiempo:\n{tail}")
+            time.sleep(0.02)
+        elapsed = time.perf_counter() - t0
+    finally:
+        for p in procs:
+            p.terminate()
+        for p, log in zip(procs, logs):
+            p.wait()
+            log.close()
+        shutil.rmtree(out_dir, ignore_errors=True)
+    if use_stream:
+        lines = [fields[b"data"].decode() for _, fields in r.xrange("bench_merge")]
+    else:
+        lines = [l.decode() for l in r.lrange("bench_merge", 0, -1)]
+    return elapsed, t_load, lines
+
+
+def ct_by_flow(lines: List[str]) -> Dict[tuple, tuple]:
+    idx = {c: i for i, c in enumerate(ML_COLS)}
+    out = {}
+    for line in lines:
+        v = line.split(",")
+        out[(v[idx["saddr"]], v[idx["sport"]], v[idx["daddr"]], v[idx["dport"]], v[idx["stime"]])] = \
+            tuple(v[idx[k]] for k in ZEOK_EXTRA if k in idx)
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Benchmark del merge con shards")
+    ap.add_argument("--flows", type=int, default=50_000)
+    ap.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--batch", type=int, default=256, help="--batch_size de los workers")
+    ap.add_argument("--window", type=int, default=CT_WINDOW)
+    ap.add_argument("--reorder", type=float, default=CT_REORDER, help="--ct_reorder de la etapa ct_*")
+    ap.add_argument("--redis", help="host:puerto de un Redis ≥ 7 de pruebas (se vacía con FLUSHDB)")
+    ap.add_argument("--use_stream", action="store_true", help="Redis Streams (XREADGROUP/XACK) en vez de listas")
+    ap.add_argument("--timeout", type=float, default=600.0)
+    args = ap.parse_args()
+
+    flows = synthetic_flows(args.flows)
+    print(f"Flujos sintéticos: {len(flows)} · CPUs: {os.cpu_count()}")
+
+    print("\n1) Reparto (productores = merge)")
+    for n in args.shards:
+        counts = check_routing(flows, n)
+        print(f"   N={n}: {counts} · shard más cargado {max(counts) / (len(flows) / n):.3f}× la media")
+
+    print(f"\n2) ct_* frente al merge sin shards (ventana {args.window}, lotes de {args.batch})")
+    print(f"   {'N':>3}  {'modo':<22}  {'registros con ct_* distinto':>27}  {'error medio':>11}")
+    for n in [n for n in args.shards if n > 1]:
+        for mode, (pct, mae) in ct_approximation(flows, n, args.window, args.batch, args.reorder).items():
+            print(f"   {n:>3}  {mode:<22}  {pct:>26.2f}%  {mae:>11.3f}")
+
+    if not args.redis:
+        print("\n(3) Sin --redis: se omite el rendimiento de extremo a extremo")
+        return
+    import redis
+    host, port = args.redis.rsplit(":", 1)
+    r = redis.Redis(host=host, port=int(port))
+    print(f"\n3) Extremo a extremo con Redis {args.redis} ({'streams' if args.use_stream else 'listas'})")
+    print(f"   {'N':>3}  {'procesos':>8}  {'s':>7}  {'reg/s':>9}  {'x':>5}  {'ct_* ≠ N=1':>10}")
+    base_rate, base_ct = None, None
+    for n in args.shards:
+        elapsed, _, lines = run_pipeline(r, host, int(port), flows, n, args.batch, args.reorder,
+                                         args.timeout, args.use_stream)
+        rate = 2 * len(flows) / elapsed
+        ct = ct_by_flow(lines)
+        if base_rate is None:
+            base_rate, base_ct = rate, ct
+        diff = 100.0 * sum(ct[k] != base_ct.get(k) for k in ct) / max(1, len(ct))
+        procs = n + (1 if n > 1 else 0)
+        print(f"   {n:>3}  {procs:>8}  {elapsed:>7.2f}  {rate:>9.0f}  {rate / base_rate:>5.2f}  {diff:>9.2f}%")
+    r.flushdb()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+check_streams.py  —  Entrega al menos una vez del merge con Redis Streams.
+-----------------------------------------------------------------------
+1. Lanza merge_argus_zeek.py --use_stream y publica solo la mitad Argus de
+   N flujos sintéticos: todos quedan aparcados esperando pareja, sin XACK.
+2. Mata el proceso (SIGKILL: sin snapshot ni limpieza) y lo relanza con el
+   mismo --consumer, que relee su PEL y reconstruye la caché.
+3. Publica la mitad Zeek y comprueba que salen los N flujos fusionados y
+   que las PEL de los streams de entrada quedan vacías.
+Con --shards N hace lo mismo con N workers y la etapa ct_*.
+
+Uso (el Redis indicado se vacía con FLUSHDB):
+    python check_streams.py --redis 127.0.0.1:6379 [--flows 5000] [--shards 1]
+"""
+from __future__ import annotations
+
+import argparse, json, os, shutil, signal, subprocess, sys, tempfile, time
+
+import redis
+
+from bench_shards import synthetic_flows
+from merge_argus_zeek import build_key, shard_of, shard_queue
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def wait_for(cond, timeout: float, what: str) -> None:
+    t0 = time.monotonic()
+    while not cond():
+        if time.monotonic() - t0 > timeout:
+            raise SystemExit(f"❌ Tiempo agotado esperando {what}")
+        time.sleep(0.05)
+
+
+def pending(r: redis.Redis, stream: str, group: str = "merge") -> int:
+    try:
+        return r.xpending(stream, group)["pending"]
+    except redis.exceptions.ResponseError:
+        return 0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Caída y recuperación del merge con Redis Streams")
+    ap.add_argument("--redis", required=True, help="host:puerto de un Redis de pruebas")
+    ap.add_argument("--flows", type=int, default=5000)
+    ap.add_argument("--shards", type=int, default=1)
+    ap.add_argument("--timeout", type=float, default=120.0)
+    args = ap.parse_args()
+
+    host, port = args.redis.rsplit(":", 1)
+    r = redis.Redis(host=host, port=int(port))
+    r.flushdb()
+    out_dir = tempfile.mkdtemp(prefix="check_streams_")
+    base = [sys.executable, os.path.join(HERE, "merge_argus_zeek.py"), "--use_stream",
+            "--redis_host", host, "--redis_port", port, "--output_dir", out_dir,
+            "--argus_queue", "chk_argus", "--zeek_queue", "chk_zeek", "--merge_queue", "chk_merge",
+            "--ct_queue", "chk_ct", "--shards", str(args.shards), "--max_wait", "0.05",
+            "--spill_snapshot_every", "0", "--log_every", "3600"]
+    cmds = [base + ["--shard", str(i), "--consumer", f"w{i}"] for i in range(args.shards)]
+    if args.shards > 1:
+        cmds.append(base + ["--ct_stage", "--consumer", "ct"])
+    inputs = [shard_queue(q, i, args.shards) for q in ("chk_argus", "chk_zeek") for i in range(args.shards)]
+
+    def launch():
+        return [subprocess.Popen(c, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for c in cmds]
+
+    def publish(side: int, stream: str) -> None:
+        pipe = r.pipeline(transaction=False)
+        for flow in flows:
+            s = shard_of(build_key(argus=flow[0]), args.shards)
+            pipe.xadd(shard_queue(stream, s, args.shards), {"data": json.dumps(flow[side])})
+        pipe.execute()
+
+    flows = synthetic_flows(args.flows)
+    procs = launch()
+    try:
+        publish(0, "chk_argus")
+        wait_for(lambda: sum(pending(r, q) for q in inputs) == len(flows), args.timeout,
+                 "a que todo Argus quede aparcado sin XACK")
+        print(f"1) {len(flows)} registros Argus aparcados sin XACK")
+        for p in procs:
+            p.send_signal(signal.SIGKILL)
+            p.wait()
+        print("2) SIGKILL a los workers; se relanzan con los mismos consumidores")
+        procs = launch()
+        publish(1, "chk_zeek")
+        wait_for(lambda: r.xlen("chk_merge") >= len(flows), args.timeout,
+                 f"a los {len(flows)} fusionados (hay {r.xlen('chk_merge')})")
+        time.sleep(0.5)
+        merged = r.xlen("chk_merge")
+        left = {q: pending(r, q) for q in inputs + (["chk_ct"] if args.shards > 1 else [])}
+    finally:
+        for p in procs:
+            p.terminate()
+            p.wait()
+        shutil.rmtree(out_dir, ignore_errors=True)
+        r.flushdb()
+
+    print(f"3) Fusionados {merged}/{len(flows)} · sin XACK al final: {left}")
+    if merged != len(flows) or any(left.values()):
+        print("❌ Se han perdido o duplicado registros, o quedan mensajes sin confirmar")
+        sys.exit(1)
+    print("✅ Sin pérdidas tras la caída")
+
+
+if __name__ == "__main__":
+    main()
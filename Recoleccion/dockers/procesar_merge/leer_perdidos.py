@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+leer_perdidos.py  —  Consulta y compacta el registro de perdidos del merge.
+-----------------------------------------------------------------------
+`merge_argus_zeek.py` guarda los registros sin pareja de cada ejecución en
+`<OUTPUT_DIR>/perdidos/<ts>/` como snapshot + diario incremental
+(`argus.snapshot.jsonl`, `argus.journal.jsonl`, ídem para zeek). Este
+script reconstruye el conjunto vigente y lo imprime como JSON Lines (el
+mismo formato que los antiguos `argus.log` / `zeek.log`), o lo compacta
+(con el merge parado: el diario vigente se vacía tras la compactación).
+
+Uso:
+    python leer_perdidos.py <dir_perdidos> [--src argus|zeek] [--compact]
+    python leer_perdidos.py merged_logs/perdidos/20250611_041445 --src zeek > zeek.log
+"""
+from __future__ import annotations
+
+import argparse, json, os, sys
+
+from merge_argus_zeek import compact_spill, load_spill
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Reconstruye/compacta los perdidos del merge")
+    ap.add_argument("lost_dir")
+    ap.add_argument("--src", choices=("argus", "zeek"), action="append",
+                    help="Caché a procesar (por defecto ambas)")
+    ap.add_argument("--compact", action="store_true",
+                    help="Funde diario y snapshot en un único snapshot")
+    args = ap.parse_args()
+
+    if not os.path.isdir(args.lost_dir):
+        sys.exit(f"❌ Directorio no encontrado: {args.lost_dir}")
+
+    for name in args.src or ("argus", "zeek"):
+        if args.compact:
+            n = compact_spill(args.lost_dir, name)
+            print(f"✅ {name}: {n} registros sin pareja compactados", file=sys.stderr)
+        else:
+            for rec in load_spill(args.lost_dir, name).values():
+                sys.stdout.write(json.dumps(rec) + "\n")
+
+
+if __name__ == "__main__":
+    main()
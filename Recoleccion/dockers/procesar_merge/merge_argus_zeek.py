@@ -3,10 +3,14 @@
 merge_argus_zeek_v2.py  —  Fusiona en caliente los flujos de Argus y Zeek.
 -----------------------------------------------------------------------
 • Consume dos colas Redis (Argus y Zeek) tal y como ya hacía el script
-  original.
+  original, en lotes de hasta --batch_size mensajes por cola y round-trip
+  (BLMPOP bloqueante cuando ambas están vacías).
 • Correlaciona los eventos usando la clave compuesta
       (stime≈ts, proto, saddr, sport, daddr, dport),
-  tolerando ±1e-4 s entre stime (Argus) y ts (Zeek).
+  tolerando ±--match_tolerance s (1e-4 por defecto) entre stime (Argus) y ts (Zeek).
+  Un log de aplicación (http, ftp) casa con el registro de Argus cuyo
+  intervalo [stime, ltime] contiene su ts; de varios candidatos gana el
+  más cercano en el tiempo.
 • Al encontrar match:
     → Parte del JSON de Argus y añade:
          service (si existe en Zeek o "-"),
@@ -14,17 +18,45 @@ merge_argus_zeek_v2.py  —  Fusiona en caliente los flujos de Argus y Zeek.
          ct_src_dport_ltm, ct_dst_sport_ltm, ct_dst_src_ltm
     → Escribe el resultado en <OUTPUT_DIR>/merge/<ts>/merge_conn.jsonl
 • Sin match inmediato:
-    → Guarda el mensaje en la cola circular correspondiente
-      (tamaño configurable, p.e. 100 000).
+    → Guarda el mensaje en la caché de sin-match correspondiente,
+      indexada por clave y cubeta de tiempo.
+    → Caduca cuando el otro flujo avanza más de --match_ttl segundos
+      (marca de agua de tiempo de evento); --queue_size solo es un tope.
+      Los caducados sin pareja se cuentan en la línea de estadísticas.
+    → Registra altas/bajas de esa caché en <OUTPUT_DIR>/perdidos/<ts>/
+      como diario incremental + snapshot periódico (ver leer_perdidos.py).
 • Vuelve a intentar correlacionar cada vez que llega un nuevo mensaje.
+• El estado por flujo (acumulación HTTP, ct_flw_http_mthd, ct_ftp_cmd)
+  caduca tras --flow_state_ttl s sin actividad y cada tabla se limita a
+  --flow_state_max flujos (LRU): la memoria no crece en ejecuciones largas.
+• Con --shards N (MERGE_SHARDS) los productores reparten cada registro en
+  <cola>:<i> según shard_of (hash de la 5-tupla sin sentido) y cada worker
+  (--shard i) fusiona solo su shard. Los ct_* miran las últimas
+  --ct_window conexiones de todo el tráfico, así que los workers mandan lo
+  fusionado a --ct_queue y una única etapa (--ct_stage) lo reordena por
+  stime (--ct_reorder s de margen), calcula los ct_*, escribe el merge
+  JSON y publica en --merge_queue (ver bench_shards.py).
+• Con --use_stream (REDIS_STREAMS=1) las colas son Redis Streams: lee con
+  XREADGROUP (--group/--consumer) y confirma con XACK en la misma
+  transacción que publica la salida (XADD con MAXLEN ~). Lo que espera
+  pareja en memoria no se confirma hasta que sale de la caché, así que
+  tras una caída se vuelve a entregar (al menos una vez); al arrancar se
+  relee la PEL propia y cada --claim_every s se reclama con XAUTOCLAIM lo
+  abandonado por otro consumidor. La correlación necesita los dos lados de
+  cada flujo en el mismo proceso: para repartir carga se usan --shards, y
+  un segundo consumidor del mismo grupo hace de reserva.
+• Con --merge_format record (MERGE_FORMAT) la salida hacia ML no es una
+  línea CSV sino un registro binario de tamaño fijo (RECORD_FIELDS) que
+  ml_processor lee con np.frombuffer (ML_FORMAT=record). proto/state van
+  como índice en string_indexer_maps/ (el mismo vocabulario en los dos lados).
 
-Dependencias: redis, python-dateutil.
+Dependencias: redis (servidor ≥ 7.0), python-dateutil.
 """
 from __future__ import annotations
 
-import argparse, collections, json, logging, os, sys, time
-from typing import Deque, Any, Dict, Optional, Tuple
-from collections import Counter, deque
+import argparse, atexit, heapq, json, logging, math, os, socket, struct, sys, time, zlib
+from typing import Deque, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import Counter, OrderedDict, deque
 
 import redis
 from dateutil import parser as dtparser
@@ -40,12 +72,27 @@ ML_CSV_COLUMNS = (
 ML_COLS = ML_CSV_COLUMNS.split(',')
 
 # --- Configurables -----------------------------------------------------------
-LAST_100: Deque[dict] = deque(maxlen=100)
+# UNSW-NB15 define los ct_* sobre "las últimas 100 conexiones"
+CT_WINDOW = 100
+# Con shards, segundos de tiempo de evento que la etapa ct_* retiene cada
+# registro para reordenarlo por stime antes de la ventana (los lotes de los
+# workers llegan intercalados)
+CT_REORDER = 1.0
+# Correlación: |stime - ts| máximo, cubeta del índice temporal (s) y tiempo
+# que un registro espera pareja tras la marca de agua del otro flujo (s). El
+# TTL debe cubrir el retraso con el que Zeek emite conn.log (al cerrar la
+# conexión o por inactividad: 5 min en TCP)
+MATCH_TOLERANCE = 1e-4
+MATCH_BUCKET = 1.0
+MATCH_TTL = 600.0
+# Estado por flujo (acumulación HTTP, ct_flw_http_mthd, ct_ftp_cmd): segundos
+# sin actividad hasta caducar y tope de entradas por tabla (LRU)
+FLOW_STATE_TTL = 600.0
+FLOW_STATE_MAX = 200_000
+# Con Redis Streams: entradas máximas (aprox.) de cada stream de salida
+STREAM_MAXLEN = 1_000_000
 
 Key5 = Tuple[Any, Any, Any, Any, Any]
-MAP_COUNT_HTTP: Counter[Key5, int] = Counter()
-MAP_COUNT_FTP: Counter[Key5, int] = Counter()
-HTTP_ACC: dict[Key5, dict] = {}
 
 ZEOK_EXTRA = (
     "ct_srv_src","ct_srv_dst","ct_dst_ltm","ct_src_ltm",
@@ -62,6 +109,22 @@ OUTPUT_FIELDS = [
     "ct_dst_src_ltm"
 ]
 
+# Formato binario de la cola hacia ml_processor (--merge_format record): un
+# registro de tamaño fijo por flujo con el orden de ML_COLS, little-endian y
+# sin relleno. stime/ltime f8, proto/state u2 (índice en los mapas de
+# string_indexer_maps/, len(mapa) si es desconocido), IPs 16 bytes (IPv4
+# como ::ffff:a.b.c.d) y el resto f4 (el modelo trabaja en float32).
+# Copia de IA_Predictor/batch_parser.RECORD_FIELDS: deben coincidir.
+RECORD_FIELDS = tuple(
+    (col, "d" if col in ("stime", "ltime") else "H" if col in ("proto", "state")
+     else "16s" if col in ("saddr", "daddr") else "f")
+    for col in ML_COLS
+)
+RECORD_STRUCT = struct.Struct("<" + "".join(code for _, code in RECORD_FIELDS))
+RECORD_MAPS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "string_indexer_maps")
+V4_MAPPED = b"\0" * 10 + b"\xff\xff"
+F4_MAX = 3.4028234663852886e38
+
 # --- Helper ------------------------------------------------------------------
 
 def to_float(ts_val):
@@ -75,6 +138,14 @@ def to_float(ts_val):
             return dtparser.parse(ts_val).timestamp()
     raise TypeError(f"No puedo convertir {ts_val!r} a float")
 
+def event_time(ts_val: Any, default: float) -> float:
+    """Tiempo de evento (epoch) de stime/ltime/ts; `default` si falta o no es válido."""
+    try:
+        t = to_float(ts_val)
+    except (TypeError, ValueError, OverflowError):
+        return default
+    return t if math.isfinite(t) else default
+
 def cast_port(val: Any) -> int:
     if val is None: return 0
     if isinstance(val, str) and val.lower().startswith("0x"):
@@ -116,6 +187,760 @@ def build_key(argus: Optional[dict] = None, zeek: Optional[dict] = None) -> tupl
         )
     raise ValueError("Se necesita argus o zeek")
 
+def shard_of(key: tuple, shards: int) -> int:
+    """
+    Shard de un flujo: crc32 de la clave de build_key con los extremos
+    ordenados (los dos sentidos caen en el mismo shard). Los productores
+    (ra_to_redis.py, zeek_to_redis.py) tienen una copia que debe coincidir.
+    """
+    if shards <= 1:
+        return 0
+    if len(key) == 3:
+        lo, hi = sorted((str(key[1]), str(key[2])))
+        ident = f"{key[0]}|{lo}|{hi}"
+    else:
+        (lo_h, lo_p), (hi_h, hi_p) = sorted(((str(key[1]), key[2]), (str(key[3]), key[4])))
+        ident = f"{key[0]}|{lo_h}|{lo_p}|{hi_h}|{hi_p}"
+    return zlib.crc32(ident.encode()) % shards
+
+def shard_queue(queue: str, shard: int, shards: int) -> str:
+    """Cola Redis de un shard (`<cola>:<i>`); sin shards, la cola de siempre."""
+    return queue if shards <= 1 else f"{queue}:{shard}"
+
+# --- Estado por flujo --------------------------------------------------------
+
+class FlowState:
+    """
+    Estado por flujo (clave → valor) con caducidad por tiempo de evento y
+    tope de entradas con expulsión LRU.
+
+    Cada acceso (`get`, `setdefault`, `incr`) renueva la entrada con su
+    tiempo de evento y la pasa al final del OrderedDict; `expire` retira por
+    delante las que llevan más de `ttl` segundos sin tocarse según la marca
+    de agua, y al superar `maxlen` se expulsa la menos usada. Así la memoria
+    depende de los flujos activos y no de todos los vistos en la ejecución.
+    """
+
+    def __init__(self, name: str, ttl: float = FLOW_STATE_TTL, maxlen: int = FLOW_STATE_MAX):
+        self.name = name
+        self.ttl = ttl
+        self.maxlen = maxlen
+        self._data: "OrderedDict[Key5, list]" = OrderedDict()   # clave → [valor, último t]
+        self.expired = 0        # caducadas por inactividad
+        self.evicted = 0        # expulsadas por el tope (LRU)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Key5) -> bool:
+        return key in self._data
+
+    def _touch(self, key: Key5, t: float) -> list:
+        entry = self._data[key]
+        self._data.move_to_end(key)
+        entry[1] = max(entry[1], t)
+        return entry
+
+    def _insert(self, key: Key5, value: Any, t: float) -> list:
+        entry = self._data[key] = [value, t]
+        if len(self._data) > self.maxlen:
+            self._data.popitem(last=False)
+            self.evicted += 1
+        return entry
+
+    def get(self, key: Key5, default: Any = None, t: Optional[float] = None) -> Any:
+        if key not in self._data:
+            return default
+        return self._touch(key, t if t is not None else -math.inf)[0]
+
+    def setdefault(self, key: Key5, factory, t: float) -> Any:
+        """Valor de `key` (creado con factory() si no existe)."""
+        if key in self._data:
+            return self._touch(key, t)[0]
+        return self._insert(key, factory(), t)[0]
+
+    def pop(self, key: Key5, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def incr(self, key: Key5, t: float, n: int = 1) -> int:
+        """Contador de `key` += n; devuelve el nuevo valor."""
+        if key in self._data:
+            entry = self._touch(key, t)
+            entry[0] += n
+        else:
+            entry = self._insert(key, n, t)
+        return entry[0]
+
+    def expire(self, watermark: float) -> int:
+        """Retira las entradas sin actividad desde watermark - ttl (por orden de uso)."""
+        limit = watermark - self.ttl
+        n = 0
+        while self._data:
+            key, entry = next(iter(self._data.items()))
+            if entry[1] >= limit:
+                break
+            del self._data[key]
+            n += 1
+        self.expired += n
+        return n
+
+    def stats(self) -> str:
+        return f"{self.name}={len(self)} (caducadas {self.expired}, expulsadas {self.evicted})"
+
+
+# Nº de peticiones HTTP / comandos FTP por flujo y acumulación de las
+# transacciones HTTP hasta que llega el registro de Argus del flujo
+MAP_COUNT_HTTP = FlowState("ct_flw_http_mthd")
+MAP_COUNT_FTP = FlowState("ct_ftp_cmd")
+HTTP_ACC = FlowState("http_acc")
+FLOW_STATES = (HTTP_ACC, MAP_COUNT_HTTP, MAP_COUNT_FTP)
+
+
+def accumulate_http(key: Key5, z_data: dict, t: float) -> dict:
+    """Acumula response_body_len y guarda el mensaje de mayor trans_depth del flujo."""
+    depth = int(z_data.get("trans_depth", 0))
+    body_len = int(z_data.get("response_body_len", 0))
+
+    acc = HTTP_ACC.setdefault(key, lambda: {"sum_len": 0, "max_depth": 0, "last_z": None}, t)
+    acc["sum_len"] += body_len
+    if depth > acc["max_depth"]:
+        acc["max_depth"] = depth
+
+    acc["last_z"] = z_data.copy()
+    return acc
+
+# --- Caché de registros sin pareja -----------------------------------------
+
+class SpillLog:
+    """
+    Registro incremental en disco de una caché de sin-match.
+
+    En lugar de reescribir la caché completa en cada cambio, cada alta o baja
+    se añade como un evento al diario `<name>.journal.jsonl`; cada
+    `snapshot_every` eventos se compacta volcando el estado actual a
+    `<name>.snapshot.jsonl` y vaciando el diario. El coste por mensaje es
+    constante (amortizado) y `load_spill()` reconstruye el conjunto vigente.
+    """
+
+    def __init__(self, directory: str, name: str, snapshot_every: int = 10000):
+        self.snapshot_path, self.journal_path = spill_paths(directory, name)
+        self.snapshot_every = snapshot_every
+        self._events = 0
+        self._fh = open(self.journal_path, "a", buffering=1)
+
+    def add(self, seq: int, rec: dict) -> None:
+        self._fh.write(json.dumps({"op": "add", "seq": seq, "rec": rec}) + "\n")
+        self._events += 1
+
+    def remove(self, seq: int) -> None:
+        self._fh.write(json.dumps({"op": "del", "seq": seq}) + "\n")
+        self._events += 1
+
+    def due(self) -> bool:
+        return self.snapshot_every > 0 and self._events >= self.snapshot_every
+
+    def snapshot(self, entries: Iterable[Tuple[int, dict]]) -> None:
+        """Vuelca `entries` (seq, rec) como snapshot y vacía el diario."""
+        write_spill_snapshot(self.snapshot_path, entries)
+        self._fh.close()
+        self._fh = open(self.journal_path, "w", buffering=1)
+        self._events = 0
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+def spill_paths(directory: str, name: str) -> Tuple[str, str]:
+    return (
+        os.path.join(directory, f"{name}.snapshot.jsonl"),
+        os.path.join(directory, f"{name}.journal.jsonl"),
+    )
+
+def write_spill_snapshot(path: str, entries: Iterable[Tuple[int, dict]]) -> None:
+    # Escritura atómica: si caemos a mitad, el snapshot anterior sigue válido
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fh:
+        for seq, rec in entries:
+            fh.write(json.dumps({"seq": seq, "rec": rec}) + "\n")
+    os.replace(tmp, path)
+
+def load_spill(directory: str, name: str) -> "OrderedDict[int, dict]":
+    """Reconstruye los registros sin-match vigentes (seq → rec) de `name`."""
+    snapshot_path, journal_path = spill_paths(directory, name)
+    state: "OrderedDict[int, dict]" = OrderedDict()
+    if os.path.isfile(snapshot_path):
+        with open(snapshot_path) as fh:
+            for line in fh:
+                if line.strip():
+                    ev = json.loads(line)
+                    state[ev["seq"]] = ev["rec"]
+    if os.path.isfile(journal_path):
+        with open(journal_path) as fh:
+            for line in fh:
+                try:
+                    ev = json.loads(line)
+                except json.JSONDecodeError:
+                    # Última línea a medias tras una caída
+                    continue
+                # Los eventos son idempotentes: un diario ya incluido en el
+                # snapshot (caída entre snapshot y vaciado) no altera el estado
+                if ev["op"] == "add":
+                    state[ev["seq"]] = ev["rec"]
+                else:
+                    state.pop(ev["seq"], None)
+    return state
+
+def compact_spill(directory: str, name: str) -> int:
+    """Compacta snapshot + diario en un único snapshot; devuelve nº de registros."""
+    state = load_spill(directory, name)
+    snapshot_path, journal_path = spill_paths(directory, name)
+    write_spill_snapshot(snapshot_path, state.items())
+    open(journal_path, "w").close()
+    return len(state)
+
+class Pending:
+    """Registro en espera de pareja con su intervalo de tiempo de evento."""
+    __slots__ = ("key", "rec", "t0", "t1", "app", "hits")
+
+    def __init__(self, key: tuple, rec: dict, t0: float, t1: float, app: bool):
+        self.key, self.rec, self.t0, self.t1, self.app = key, rec, t0, t1, app
+        self.hits = 0
+
+
+def fits(a: Pending, t0: float, t1: float, app: bool, tolerance: float) -> bool:
+    """
+    ¿Casan en el tiempo? conn ↔ Argus: stime ≈ ts (±tolerance). Un log de
+    aplicación de Zeek (http, ftp) lleva el ts de la petición, que cae dentro
+    del registro de Argus: basta con que los intervalos se solapen.
+    """
+    if a.app or app:
+        return a.t0 - tolerance <= t1 and t0 - tolerance <= a.t1
+    return abs(a.t0 - t0) <= tolerance
+
+
+class MatchCache:
+    """
+    Registros pendientes de correlar, indexados por clave y cubeta de tiempo.
+
+    Cada registro guarda su intervalo de tiempo de evento [t0, t1] (stime y
+    ltime en Argus, ts en Zeek) y `match` devuelve el candidato de la misma
+    clave más cercano en el tiempo que cumpla `fits`: así una 5-tupla de
+    larga duración (Argus emite un registro de estado cada 5 s) ya no casa
+    con el registro equivocado. Un OrderedDict (seq → Pending) conserva el
+    orden de llegada y un montículo (t1, seq) el de caducidad: `expire`
+    descarta lo que la marca de agua del otro flujo ha dejado atrás más de
+    `ttl` segundos, así que la memoria depende de la ventana en vuelo;
+    `maxlen` queda como tope de seguridad (se expulsa el más antiguo).
+    """
+
+    def __init__(self, maxlen: int, spill: Optional[SpillLog] = None,
+                 tolerance: float = MATCH_TOLERANCE, ttl: float = MATCH_TTL,
+                 bucket: float = MATCH_BUCKET, acks: Optional["AckTracker"] = None):
+        self.maxlen = maxlen
+        self.spill = spill
+        self.acks = acks
+        self.tolerance = tolerance
+        self.ttl = ttl
+        self.bucket = bucket
+        self._by_key: Dict[tuple, Dict[int, List[int]]] = {}    # clave → cubeta → seqs
+        self._order: "OrderedDict[int, Pending]" = OrderedDict()
+        self._heap: List[Tuple[float, int]] = []                 # (t1, seq), con borrado perezoso
+        self._max_span = 0.0
+        self._seq = 0
+        self.expired = 0        # caducados sin haber casado nunca
+        self.overflow = 0       # expulsados por superar maxlen
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __iter__(self) -> Iterator[Tuple[tuple, dict]]:
+        # Del más antiguo al más reciente
+        return ((p.key, p.rec) for p in self._order.values())
+
+    def append(self, key: tuple, rec: dict, t0: float, t1: Optional[float] = None,
+               app: bool = False) -> Optional[Tuple[tuple, dict]]:
+        """Añade `rec`; si se supera `maxlen` devuelve el (clave, registro) expulsado."""
+        t1 = t0 if t1 is None or t1 < t0 else t1
+        seq = self._seq
+        self._seq += 1
+        pending = Pending(key, rec, t0, t1, app)
+        self._order[seq] = pending
+        self._by_key.setdefault(key, {}).setdefault(int(t0 // self.bucket), []).append(seq)
+        heapq.heappush(self._heap, (t1, seq))
+        if len(self._heap) > 2 * len(self._order) + 1024:
+            # Demasiadas entradas ya casadas en el montículo: se reconstruye
+            self._heap = [(p.t1, s) for s, p in self._order.items()]
+            heapq.heapify(self._heap)
+        self._max_span = max(self._max_span, t1 - t0)
+        if self.spill:
+            self.spill.add(seq, rec)
+        if self.acks:
+            self.acks.hold(rec)
+        evicted = None
+        if len(self._order) > self.maxlen:
+            old_seq = next(iter(self._order))
+            old = self._remove(old_seq)
+            self.overflow += 1
+            evicted = (old.key, old.rec)
+        self._maybe_snapshot()
+        return evicted
+
+    def match(self, key: tuple, t0: float, t1: Optional[float] = None, app: bool = False,
+              keep: bool = False) -> Optional[dict]:
+        """Devuelve el registro de `key` más cercano a t0 que case (y lo retira salvo `keep`)."""
+        buckets = self._by_key.get(key)
+        if not buckets:
+            return None
+        t1 = t0 if t1 is None or t1 < t0 else t1
+        lo = int((t0 - self.tolerance - self._max_span) // self.bucket)
+        hi = int((t1 + self.tolerance) // self.bucket)
+        # Con pocas cubetas en la clave sale más barato recorrerlas todas
+        ids = buckets if hi - lo + 1 > len(buckets) else range(lo, hi + 1)
+        best, best_dist = None, None
+        for b in ids:
+            for seq in buckets.get(b, ()):
+                p = self._order[seq]
+                if fits(p, t0, t1, app, self.tolerance):
+                    dist = abs(p.t0 - t0)
+                    if best is None or dist < best_dist or (dist == best_dist and seq < best):
+                        best, best_dist = seq, dist
+        if best is None:
+            return None
+        pending = self._order[best]
+        pending.hits += 1
+        if not keep:
+            self._remove(best)
+            self._maybe_snapshot()
+        return pending.rec
+
+    def expire(self, watermark: float) -> int:
+        """Retira lo que terminó antes de `watermark - ttl`; devuelve cuántos no casaron nunca."""
+        expired = 0
+        limit = watermark - self.ttl
+        while self._heap and self._heap[0][0] < limit:
+            _, seq = heapq.heappop(self._heap)
+            if seq in self._order:
+                if not self._remove(seq).hits:
+                    expired += 1
+        self.expired += expired
+        if expired:
+            self._maybe_snapshot()
+        return expired
+
+    def snapshot(self) -> None:
+        """Compacta el registro en disco con el contenido actual."""
+        if self.spill:
+            self.spill.snapshot((seq, p.rec) for seq, p in self._order.items())
+
+    def _remove(self, seq: int) -> Pending:
+        pending = self._order.pop(seq)
+        buckets = self._by_key[pending.key]
+        b = int(pending.t0 // self.bucket)
+        buckets[b].remove(seq)
+        if not buckets[b]:
+            del buckets[b]
+            if not buckets:
+                del self._by_key[pending.key]
+        if self.spill:
+            self.spill.remove(seq)
+        if self.acks:
+            self.acks.release(pending.rec)
+        return pending
+
+    def _maybe_snapshot(self) -> None:
+        if self.spill and self.spill.due():
+            self.snapshot()
+
+# --- Ventana de conexiones para ct_* ----------------------------------------
+
+# (contador, campos que deben coincidir con la conexión actual)
+CT_FIELDS = (
+    ("ct_srv_src", ("service", "saddr", "ltime")),
+    ("ct_srv_dst", ("service", "daddr", "ltime")),
+    ("ct_dst_ltm", ("daddr", "ltime")),
+    ("ct_src_ltm", ("saddr", "ltime")),
+    ("ct_src_dport_ltm", ("saddr", "dport", "ltime")),
+    ("ct_dst_sport_ltm", ("daddr", "sport", "ltime")),
+    ("ct_dst_src_ltm", ("saddr", "daddr", "ltime")),
+)
+
+class ConnWindow:
+    """
+    Últimas `size` conexiones con un contador por cada combinación de ct_*.
+
+    Cada conexión añadida incrementa un Counter por ct_* con la tupla de sus
+    campos, y la que sale de la ventana los decrementa, así que los siete
+    ct_* se obtienen con búsquedas O(1) en vez de recorrer el histórico.
+    Las claves guardan los valores tal cual están en el histórico y se
+    consultan con los de la conexión actual (puertos con cast_port), igual
+    que la comparación h.get(f) == v original.
+    """
+
+    def __init__(self, size: int = CT_WINDOW):
+        self.size = size
+        self._window: Deque[Tuple[tuple, ...]] = deque()
+        self._counts: Tuple[Counter, ...] = tuple(Counter() for _ in CT_FIELDS)
+
+    def __len__(self) -> int:
+        return len(self._window)
+
+    def features(self, rec: dict) -> dict:
+        # Aseguro que ltime en el registro corriente es int
+        if "ltime" in rec:
+            try:
+                rec["ltime"] = int(rec["ltime"])
+            except Exception:
+                pass
+
+        query = {
+            "service": rec.get("service", "-"),
+            "saddr": rec.get("saddr"),
+            "daddr": rec.get("daddr"),
+            "sport": cast_port(rec.get("sport")),
+            "dport": cast_port(rec.get("dport")),
+            "ltime": rec.get("ltime"),
+        }
+        return {
+            name: counts[tuple(query[f] for f in fields)]
+            for (name, fields), counts in zip(CT_FIELDS, self._counts)
+        }
+
+    def append(self, rec: dict) -> None:
+        keys = tuple(tuple(rec.get(f) for f in fields) for _, fields in CT_FIELDS)
+        for key, counts in zip(keys, self._counts):
+            counts[key] += 1
+        self._window.append(keys)
+        if len(self._window) > self.size:
+            for key, counts in zip(self._window.popleft(), self._counts):
+                counts[key] -= 1
+                if not counts[key]:
+                    del counts[key]
+
+class ReorderBuffer:
+    """
+    Devuelve los registros ordenados por tiempo de evento con un retraso
+    acotado: un registro sale cuando la marca de agua (máximo tiempo visto)
+    lo supera en `slack` segundos, o con drain() cuando la entrada se para.
+    """
+
+    def __init__(self, slack: float = CT_REORDER):
+        self.slack = slack
+        self.watermark = -math.inf
+        self._heap: List[Tuple[float, int, dict]] = []
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, t: float, rec: dict) -> List[dict]:
+        self._seq += 1
+        heapq.heappush(self._heap, (t, self._seq, rec))
+        self.watermark = max(self.watermark, t)
+        out = []
+        while self._heap and self._heap[0][0] <= self.watermark - self.slack:
+            out.append(heapq.heappop(self._heap)[2])
+        return out
+
+    def drain(self) -> List[dict]:
+        return [heapq.heappop(self._heap)[2] for _ in range(len(self._heap))]
+
+def wire_float(val: Any) -> float:
+    """Valor numérico tal y como lo leería BatchParser de la línea CSV (str2f)."""
+    if type(val) in (int, float):
+        return float(val)
+    try:
+        return float(str(val)) if val not in (None, "") else 0.0
+    except ValueError:
+        return 0.0
+
+def wire_time(val: Any) -> float:
+    """
+    Como wire_float, pero NaN si no es numérico: el modelo lo ve como 0.0
+    (igual que en CSV) y ml_processor no calcula su latencia.
+    """
+    if type(val) in (int, float):
+        return float(val)
+    try:
+        return float(str(val))
+    except ValueError:
+        return math.nan
+
+def pack_ip(val: Any) -> bytes:
+    try:
+        if ":" in str(val):
+            return socket.inet_pton(socket.AF_INET6, str(val))
+        return V4_MAPPED + socket.inet_pton(socket.AF_INET, str(val))
+    except OSError:
+        return bytes(16)
+
+class RecordEncoder:
+    """Registro binario de RECORD_FIELDS para un flujo fusionado."""
+
+    def __init__(self, maps_dir: str = RECORD_MAPS_DIR):
+        vocab = {}
+        for cat in ("proto", "state"):
+            with open(os.path.join(maps_dir, f"string_indexer_{cat}_map.json")) as fh:
+                mapping = json.load(fh)
+            vocab[cat] = ({k: int(v) for k, v in mapping.items()}, len(mapping))
+        # Conversión de cada columna, precalculada: encode es una sola pasada
+        self._conv = []
+        for col, code in RECORD_FIELDS:
+            if code == "H":
+                index, unknown = vocab[col]
+                conv = lambda v, index=index, unknown=unknown: index.get(str(v), unknown)
+            elif code == "16s":
+                conv = pack_ip
+            elif code == "d":
+                conv = wire_time
+            else:
+                conv = wire_float
+            self._conv.append((col, conv))
+        self._pack = RECORD_STRUCT.pack
+
+    def encode(self, rec: dict) -> bytes:
+        get = rec.get
+        values = [conv(get(col, "")) for col, conv in self._conv]
+        try:
+            return self._pack(*values)
+        except OverflowError:
+            # f4 no representa el valor: ±inf, como al pasar el CSV a float32
+            values = [math.copysign(math.inf, v) if type(v) is float and abs(v) > F4_MAX else v
+                      for v in values]
+            return self._pack(*values)
+
+def finish_merged(rec: dict, conn_window: ConnWindow,
+                  encoder: Optional[RecordEncoder] = None) -> Tuple[str, Any]:
+    """
+    Añade los ct_* de `conn_window`; devuelve (JSON del merge, salida para
+    ML): línea CSV, o registro binario si hay `encoder`.
+    """
+    ct = conn_window.features(rec)
+    for k in ZEOK_EXTRA:
+        rec[k] = ct[k]
+    ordered = { key: rec.get(key) for key in OUTPUT_FIELDS }
+    if encoder is not None:
+        conn_window.append(rec)
+        return json.dumps(ordered), encoder.encode(rec)
+    csv_line = ",".join(str(rec.get(c, "")) for c in ML_COLS)
+    # Registramos la conexión en la ventana (para contar conexiones futuras)
+    conn_window.append(rec)
+    return json.dumps(ordered), csv_line
+
+def run_ct_stage(args, r: redis.Redis, ts_run: str) -> None:
+    """
+    Etapa única tras los workers con shards: los ct_* cuentan sobre las
+    últimas --ct_window conexiones de TODO el tráfico, así que se calculan
+    aquí, sobre los registros ya fusionados que llegan de todos los shards,
+    reordenados por stime con un retraso de --ct_reorder s. Escribe el merge
+    JSON y publica la salida para ML (CSV o registros), como el merge sin shards.
+    """
+    merge_dir = os.path.join(args.output_dir, "merge")
+    os.makedirs(merge_dir, exist_ok=True)
+    merge_log_path = os.path.join(merge_dir, f"{ts_run}.jsonl")
+    merge_fh = open(merge_log_path, "a", buffering=1)
+    logging.info("Etapa ct_*: %s → %s · merge JSON en %s",
+                 args.ct_queue, args.merge_queue, merge_log_path)
+    conn_window = ConnWindow(args.ct_window)
+    encoder = RecordEncoder() if args.merge_format == "record" else None
+    reorder = ReorderBuffer(args.ct_reorder)
+    acks = AckTracker()
+    if args.use_stream:
+        reader = StreamReader(r, (args.ct_queue,), args.group, args.consumer, args.batch_size,
+                              args.max_wait, args.claim_idle, args.claim_every,
+                              held=lambda stream, msg_id: msg_id in acks.held)
+
+    def fetch() -> List[Tuple[Optional[str], bytes]]:
+        if args.use_stream:
+            return reader.read()[args.ct_queue]
+        batch = r.lpop(args.ct_queue, args.batch_size) or []
+        if not batch:
+            res = r.blmpop(args.max_wait, 1, args.ct_queue, direction="LEFT", count=args.batch_size)
+            batch = res[1] if res else []
+        return [(None, payload) for payload in batch]
+
+    n_in = 0
+    t_stats = t_input = time.monotonic()
+    while True:
+        batch = fetch()
+        ready = []
+        for msg_id, payload in batch:
+            try:
+                rec = json.loads(payload)
+            except Exception as e:
+                logging.error("Error procesando registro fusionado: %s", e)
+                if msg_id:
+                    acks.done(msg_id)
+                continue
+            # Retenido (sin XACK) hasta que salga del búfer de reordenación
+            rec["_id"] = msg_id
+            acks.hold(rec)
+            t = rec.pop("_t", None)
+            if t is None:
+                t = event_time(rec.get("stime"), reorder.watermark)
+            ready.extend(reorder.push(t, rec))
+        if batch:
+            t_input = time.monotonic()
+        elif reorder and time.monotonic() - t_input >= args.ct_reorder:
+            # Sin entrada durante el margen (en vivo, tiempo de evento ≈ reloj):
+            # ya no va a llegar nada anterior, se vacía el búfer
+            ready = reorder.drain()
+        out = []
+        for rec in ready:
+            acks.release(rec)
+            try:
+                merged_json, csv_line = finish_merged(rec, conn_window, encoder)
+            except Exception as e:
+                logging.error("Error procesando registro fusionado: %s", e)
+                continue
+            merge_fh.write(merged_json + "\n")
+            out.append(csv_line)
+        if args.flush_each and out:
+            merge_fh.flush()
+            os.fsync(merge_fh.fileno())
+        publish(r, args.merge_queue, out, args, acks=((args.ct_queue, acks),), left=True)
+        n_in += len(batch)
+        elapsed = time.monotonic() - t_stats
+        if elapsed >= args.log_every:
+            if n_in:
+                logging.info("📊 ct_*: %.0f reg/s", n_in / elapsed)
+            n_in = 0
+            t_stats = time.monotonic()
+
+# --- Redis Streams -----------------------------------------------------------
+
+def ensure_group(r: redis.Redis, stream: str, group: str) -> None:
+    """Crea el grupo de consumidores (y el stream vacío) si no existen."""
+    try:
+        r.xgroup_create(stream, group, id="0", mkstream=True)
+    except redis.exceptions.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+class AckTracker:
+    """
+    IDs de un stream leídos por este consumidor y aún sin XACK.
+
+    Un mensaje se confirma cuando su efecto es durable: publicado aguas
+    abajo, o descartado. Lo que se queda esperando en memoria (pareja en una
+    MatchCache, búfer de reordenación) se retiene con hold() y sigue en la
+    PEL del grupo hasta release(): tras una caída se vuelve a entregar.
+    """
+
+    def __init__(self):
+        self.held: set = set()
+        self._ready: List[str] = []
+
+    def hold(self, rec: dict) -> None:
+        if rec.get("_id") is not None:
+            self.held.add(rec["_id"])
+
+    def release(self, rec: dict) -> None:
+        msg_id = rec.get("_id")
+        if msg_id in self.held:
+            self.held.discard(msg_id)
+            self._ready.append(msg_id)
+
+    def done(self, msg_id: str) -> None:
+        """Mensaje ya procesado: se confirma salvo que haya quedado retenido."""
+        if msg_id not in self.held:
+            self._ready.append(msg_id)
+
+    def take(self) -> List[str]:
+        ready, self._ready = list(dict.fromkeys(self._ready)), []
+        return ready
+
+class StreamReader:
+    """
+    Lectura por lotes de varios streams con XREADGROUP (`count` por stream).
+
+    Al arrancar vuelve a entregar la PEL propia (lo leído y no confirmado
+    antes de una caída); después lee lo nuevo (">") bloqueando hasta `block`
+    s, y cada `claim_every` s reclama con XAUTOCLAIM lo que cualquier
+    consumidor del grupo lleva más de `claim_idle` s sin confirmar, salvo lo
+    que este mismo retiene (`held(stream, id)`). Las entradas ya recortadas
+    por MAXLEN se confirman sin más. read() → {stream: [(id, data)]}.
+    """
+
+    def __init__(self, r: redis.Redis, streams: Iterable[str], group: str, consumer: str,
+                 count: int, block: float, claim_idle: float, claim_every: float, held=None):
+        self.r = r
+        self.streams = list(streams)
+        self.group, self.consumer = group, consumer
+        self.count = count
+        self.block_ms = max(1, int(block * 1000))
+        self.claim_idle_ms = int(claim_idle * 1000)
+        self.claim_every = claim_every
+        self.held = held or (lambda stream, msg_id: False)
+        for stream in self.streams:
+            ensure_group(r, stream, group)
+        self._recover = {stream: "0" for stream in self.streams}
+        self._cursor = {stream: "0-0" for stream in self.streams}
+        self._next_claim = time.monotonic() + claim_every
+        self.recovered = self.claimed = 0
+
+    def read(self) -> Dict[str, List[Tuple[str, bytes]]]:
+        out: Dict[str, List[Tuple[str, bytes]]] = {stream: [] for stream in self.streams}
+        if self._recover:
+            res = dict(self.r.xreadgroup(self.group, self.consumer, self._recover, count=self.count) or [])
+            for stream in list(self._recover):
+                msgs = res.get(stream.encode()) or []
+                if not msgs:
+                    del self._recover[stream]
+                    continue
+                self._recover[stream] = msgs[-1][0]
+                self.recovered += self._collect(out[stream], stream, msgs)
+            return out
+        if self.claim_every > 0 and time.monotonic() >= self._next_claim:
+            self._next_claim = time.monotonic() + self.claim_every
+            for stream in self.streams:
+                res = self.r.xautoclaim(stream, self.group, self.consumer, self.claim_idle_ms,
+                                        start_id=self._cursor[stream], count=self.count)
+                self._cursor[stream] = res[0]
+                msgs = [m for m in res[1] if m[0] is not None
+                        and not self.held(stream, m[0].decode())]
+                self.claimed += self._collect(out[stream], stream, msgs)
+            if any(out.values()):
+                return out
+        res = self.r.xreadgroup(self.group, self.consumer, {s: ">" for s in self.streams},
+                                count=self.count, block=self.block_ms) or []
+        for stream, msgs in res:
+            stream = stream.decode()
+            self._collect(out[stream], stream, msgs)
+        return out
+
+    def _collect(self, out: list, stream: str, msgs) -> int:
+        gone = []
+        for msg_id, fields in msgs:
+            data = fields.get(b"data") if fields else None
+            if data is None:
+                gone.append(msg_id)
+            else:
+                out.append((msg_id.decode(), data))
+        if gone:
+            self.r.xack(stream, self.group, *gone)
+        return len(msgs) - len(gone)
+
+def publish(r: redis.Redis, queue: str, payloads: List, args, acks=(), left: bool = False) -> None:
+    """
+    Publica `payloads` en `queue`: RPUSH/LPUSH en modo lista; en modo stream
+    XADD con MAXLEN ~ y, en la misma transacción, el XACK de lo confirmado
+    (`acks`: pares (stream, AckTracker)).
+    """
+    if not args.use_stream:
+        if payloads:
+            (r.lpush if left else r.rpush)(queue, *payloads)
+        return
+    pipe = r.pipeline(transaction=True)
+    for payload in payloads:
+        pipe.xadd(queue, {"data": payload}, maxlen=args.stream_maxlen, approximate=True)
+    for stream, tracker in acks:
+        ids = tracker.take()
+        if ids:
+            pipe.xack(stream, args.group, *ids)
+    if len(pipe):
+        pipe.execute()
+
 # --- Main --------------------------------------------------------------------
 
 def main():
@@ -125,11 +950,36 @@ def main():
     ap.add_argument("--argus_queue", default=os.getenv("REDIS_QUEUE_ARGUS", "argus_data_stream"))
     ap.add_argument("--zeek_queue", default=os.getenv("REDIS_QUEUE_ZEEK", "zeek_data_stream"))
     ap.add_argument("--merge_queue", default=os.getenv("REDIS_QUEUE_MERGE", "merge_data_stream"))
+    ap.add_argument("--shards", type=int, default=int(os.getenv("MERGE_SHARDS", 1)), help="Nº de shards del merge (los productores deben usar el mismo)")
+    ap.add_argument("--shard", type=int, default=int(os.getenv("MERGE_SHARD", 0)), help="Shard que atiende este worker (0..shards-1)")
+    ap.add_argument("--ct_stage", action="store_true", default=os.getenv("MERGE_CT_STAGE") == "1", help="Ejecuta la etapa única de ct_* tras los shards")
+    ap.add_argument("--ct_reorder", type=float, default=float(os.getenv("MERGE_CT_REORDER", CT_REORDER)), help="Segundos de tiempo de evento que la etapa ct_* retiene cada registro para ordenarlo por stime")
+    ap.add_argument("--ct_queue", default=os.getenv("REDIS_QUEUE_CT", "merge_ct_stream"), help="Cola de los workers con shards hacia la etapa de ct_*")
+    ap.add_argument("--use_stream", action="store_true", default=os.getenv("REDIS_STREAMS") == "1", help="Redis Streams con grupo de consumidores en vez de listas (entrega al menos una vez)")
+    ap.add_argument("--stream_maxlen", type=int, default=int(os.getenv("STREAM_MAXLEN", STREAM_MAXLEN)), help="MAXLEN ~ de los XADD hacia la siguiente etapa")
+    ap.add_argument("--group", default=os.getenv("MERGE_GROUP", "merge"), help="Grupo de consumidores en los streams de entrada")
+    ap.add_argument("--consumer", default=os.getenv("MERGE_CONSUMER", socket.gethostname()), help="Nombre del consumidor (estable entre reinicios para recuperar su PEL)")
+    ap.add_argument("--claim_idle", type=float, default=float(os.getenv("MERGE_CLAIM_IDLE", 0)) or None, help="Segundos sin XACK tras los que se reclama un mensaje de otro consumidor (por defecto --match_ttl + 60)")
+    ap.add_argument("--claim_every", type=float, default=float(os.getenv("MERGE_CLAIM_EVERY", 30)), help="Segundos entre pasadas de XAUTOCLAIM (0 = nunca)")
+    ap.add_argument("--merge_format", choices=("csv", "record"), default=os.getenv("MERGE_FORMAT", "csv"), help="Salida hacia ML: líneas CSV o registros binarios de tamaño fijo (RECORD_FIELDS)")
     ap.add_argument("--output_dir", default=os.getenv("OUTPUT_DIR", "/app/output_logs"))
-    ap.add_argument("--queue_size", type=int, default=int(os.getenv("QUEUE_SIZE", 100000)), help="Tamaño máximo de las colas internas de sin-match")
+    ap.add_argument("--queue_size", type=int, default=int(os.getenv("QUEUE_SIZE", 100000)), help="Tope de seguridad de las cachés de sin-match (la caducidad la marca --match_ttl)")
+    ap.add_argument("--match_tolerance", type=float, default=float(os.getenv("MATCH_TOLERANCE", MATCH_TOLERANCE)), help="Diferencia máxima (s) entre stime de Argus y ts de Zeek")
+    ap.add_argument("--match_ttl", type=float, default=float(os.getenv("MATCH_TTL", MATCH_TTL)), help="Segundos de tiempo de evento que un registro espera pareja")
+    ap.add_argument("--match_bucket", type=float, default=float(os.getenv("MATCH_BUCKET", MATCH_BUCKET)), help="Anchura (s) de las cubetas del índice temporal")
+    ap.add_argument("--flow_state_ttl", type=float, default=float(os.getenv("FLOW_STATE_TTL", FLOW_STATE_TTL)), help="Segundos sin actividad tras los que caduca el estado HTTP/FTP de un flujo")
+    ap.add_argument("--flow_state_max", type=int, default=int(os.getenv("FLOW_STATE_MAX", FLOW_STATE_MAX)), help="Tope de flujos por tabla de estado (expulsión LRU)")
+    ap.add_argument("--ct_window", type=int, default=int(os.getenv("CT_WINDOW", CT_WINDOW)), help="Nº de conexiones previas sobre las que se calculan los ct_*")
+    ap.add_argument("--spill_snapshot_every", type=int, default=int(os.getenv("SPILL_SNAPSHOT_EVERY", 10000)), help="Eventos del diario de perdidos entre snapshots (0 = solo al salir)")
+    ap.add_argument("--batch_size", type=int, default=int(os.getenv("MERGE_BATCH", 256)), help="Máximo de mensajes leídos de cada cola por round-trip")
+    ap.add_argument("--max_wait", type=float, default=float(os.getenv("MERGE_MAX_WAIT", 0.5)), help="Segundos de espera bloqueante (BLMPOP) con las colas vacías")
+    ap.add_argument("--log_every", type=float, default=float(os.getenv("LOG_EVERY", 10)), help="Segundos entre líneas de estadísticas de rendimiento")
     ap.add_argument("--flush_each", action="store_true")
     ap.add_argument("--log_level", default=os.getenv("LOG_LEVEL", "INFO"))
     args = ap.parse_args()
+    if args.claim_idle is None:
+        # Un registro puede esperar pareja (sin XACK) hasta --match_ttl
+        args.claim_idle = args.match_ttl + 60
 
     logging.basicConfig(
         level=getattr(logging, args.log_level.upper(), logging.INFO),
@@ -145,6 +995,27 @@ def main():
         sys.exit(1)
 
     ts_run = time.strftime("%Y%m%d_%H%M%S")
+    if args.use_stream:
+        logging.info("Redis Streams: grupo %s, consumidor %s, MAXLEN ~%d, XAUTOCLAIM tras %g s",
+                     args.group, args.consumer, args.stream_maxlen, args.claim_idle)
+    if args.merge_format == "record":
+        logging.info("Salida hacia ML en registros binarios de %d bytes", RECORD_STRUCT.size)
+    if args.ct_stage:
+        run_ct_stage(args, r, ts_run)
+        return
+
+    # Con shards este worker solo lee sus colas, y los ct_* (ventana global)
+    # quedan para la etapa --ct_stage
+    sharded = args.shards > 1
+    if sharded and not 0 <= args.shard < args.shards:
+        logging.error("❌ --shard %d fuera de rango (shards=%d)", args.shard, args.shards)
+        sys.exit(1)
+    argus_queue = shard_queue(args.argus_queue, args.shard, args.shards)
+    zeek_queue = shard_queue(args.zeek_queue, args.shard, args.shards)
+    out_queue = args.ct_queue if sharded else args.merge_queue
+    if sharded:
+        ts_run = f"{ts_run}_s{args.shard}"
+        logging.info("Shard %d/%d: %s + %s → %s", args.shard, args.shards, argus_queue, zeek_queue, out_queue)
     
     # --- Zeek: único fichero JSON Lines ---
     zeek_dir = os.path.join(args.output_dir, "zeek")
@@ -160,43 +1031,70 @@ def main():
     argus_fh = open(argus_log_path, "a", buffering=1)
     logging.info("Fichero Argus JSON creado: %s", argus_log_path)
     
-    # --- Merge: único fichero JSON Lines ---
-    merge_dir = os.path.join(args.output_dir, "merge")
-    os.makedirs(merge_dir, exist_ok=True)
-    merge_log_path = os.path.join(merge_dir, f"{ts_run}.jsonl")
-    merge_fh = open(merge_log_path, "a", buffering=1)
-    logging.info("Escribiendo flujos fusionados JSON en: %s", merge_log_path)
+    # --- Merge: único fichero JSON Lines (con shards lo escribe la etapa ct_*) ---
+    if not sharded:
+        merge_dir = os.path.join(args.output_dir, "merge")
+        os.makedirs(merge_dir, exist_ok=True)
+        merge_log_path = os.path.join(merge_dir, f"{ts_run}.jsonl")
+        merge_fh = open(merge_log_path, "a", buffering=1)
+        logging.info("Escribiendo flujos fusionados JSON en: %s", merge_log_path)
     
-    # --- Perdidos: único fichero JSON Lines ---
+    # --- Perdidos: snapshot + diario incremental por caché ---
     lost_dir = os.path.join(args.output_dir, "perdidos", ts_run)
     os.makedirs(lost_dir, exist_ok=True)
-    path_a = os.path.join(lost_dir, "argus.log")
-    path_z = os.path.join(lost_dir, "zeek.log")
+    logging.info("Registro de perdidos en: %s (snapshot cada %d eventos)",
+                 lost_dir, args.spill_snapshot_every)
 
-    # Colas circulares para sin-match
-    argus_cache: Deque[Tuple[float, tuple, dict]] = collections.deque(maxlen=args.queue_size)
-    zeek_cache: Deque[Tuple[float, tuple, dict]] = collections.deque(maxlen=args.queue_size)
-    
-    def dump_deques():
-        # Reescribe archivos de registros de colas perdidas
-        with open(path_a, "w", buffering=1) as af:
-            for _, rec in argus_cache:
-                af.write(json.dumps(rec) + "\n")
-        with open(path_z, "w", buffering=1) as zf:
-            for _, rec in zeek_cache:
-                zf.write(json.dumps(rec) + "\n")
+    # Cachés indexadas por clave y tiempo para sin-match
+    match_opts = dict(tolerance=args.match_tolerance, ttl=args.match_ttl, bucket=args.match_bucket)
+    # Con streams, lo aparcado en las cachés queda sin XACK hasta salir de ellas
+    argus_acks, zeek_acks = AckTracker(), AckTracker()
+    argus_cache = MatchCache(args.queue_size, SpillLog(lost_dir, "argus", args.spill_snapshot_every),
+                             acks=argus_acks if args.use_stream else None, **match_opts)
+    zeek_cache = MatchCache(args.queue_size, SpillLog(lost_dir, "zeek", args.spill_snapshot_every),
+                            acks=zeek_acks if args.use_stream else None, **match_opts)
+    for state in FLOW_STATES:
+        state.ttl, state.maxlen = args.flow_state_ttl, args.flow_state_max
+    logging.info("Correlación: ±%g s, caducidad %g s de tiempo de evento, cubetas de %g s",
+                 args.match_tolerance, args.match_ttl, args.match_bucket)
+
+    def close_spills():
+        # Compactación final para dejar un snapshot limpio al salir
+        for cache in (argus_cache, zeek_cache):
+            cache.snapshot()
+            cache.spill.close()
+        logging.info("Caducados sin pareja: argus=%d zeek=%d (pendientes al salir: %d / %d)",
+                     argus_cache.expired, zeek_cache.expired, len(argus_cache), len(zeek_cache))
+    atexit.register(close_spills)
 
 
-    def try_match_from_caches(key: tuple, src: str, keep_on_match: bool = False) -> Optional[dict]:
+    # Histórico de conexiones para los ct_*
+    conn_window = ConnWindow(args.ct_window)
+    encoder = RecordEncoder() if args.merge_format == "record" and not sharded else None
+
+    # Líneas CSV fusionadas del lote en curso (un único LPUSH por lote); con
+    # shards, registros fusionados en JSON para la etapa ct_* (RPUSH)
+    pending_out: list = []
+
+    def emit(rec: dict) -> None:
+        if sharded:
+            pending_out.append(json.dumps(rec))
+            return
+        merged_json, csv_line = finish_merged(rec, conn_window, encoder)
+        merge_fh.write(merged_json + "\n")
+        if args.flush_each:
+            merge_fh.flush()
+            os.fsync(merge_fh.fileno())
+        pending_out.append(csv_line)
+
+    # Marcas de agua (mayor tiempo de evento visto) de cada flujo: los
+    # pendientes de un lado caducan según avanza el otro
+    watermark = {"argus": -math.inf, "zeek": -math.inf}
+
+    def try_match_from_caches(key: tuple, src: str, t0: float, t1: float, app: bool = False,
+                              keep_on_match: bool = False) -> Optional[dict]:
         other = zeek_cache if src == "argus" else argus_cache
-        for idx, (ok, rec) in enumerate(other):
-            if key == ok:
-                if not keep_on_match:
-                    other.rotate(-idx)
-                    other.popleft()
-                    dump_deques()
-                return rec
-        return None
+        return other.match(key, t0, t1, app, keep=keep_on_match)
     
     def calc_latency(data):
         current_time = time.time()
@@ -208,40 +1106,6 @@ def main():
                 return "ErrorConvTiempo"
         return "N/A"
     
-    def connection_features(rec: dict, history: Deque[dict]) -> dict:
-        # Aseguro que ltime en el registro corriente es int
-        if "ltime" in rec:
-            try:
-                rec["ltime"] = int(rec["ltime"])
-            except Exception:
-                pass
-
-        saddr, daddr = rec.get("saddr"), rec.get("daddr")
-        sport, dport = cast_port(rec.get("sport")), cast_port(rec.get("dport"))
-        service = rec.get("service", "-")
-
-        def same(field_vals):
-            cnt = 0
-            for h in history:
-                if "ltime" in h:
-                    try:
-                        h["ltime"] = int(h["ltime"])
-                    except Exception:
-                        pass
-                if all(h.get(f) == v for f, v in field_vals):
-                    cnt += 1
-            return cnt
-
-        return {
-            "ct_srv_src": same([("service", service), ("saddr", saddr), ("ltime", rec.get("ltime"))]),
-            "ct_srv_dst": same([("service", service), ("daddr", daddr), ("ltime", rec.get("ltime"))]),
-            "ct_dst_ltm": same([("daddr", daddr), ("ltime", rec.get("ltime"))]),
-            "ct_src_ltm": same([("saddr", saddr), ("ltime", rec.get("ltime"))]),
-            "ct_src_dport_ltm": same([("saddr", saddr), ("dport", dport), ("ltime", rec.get("ltime"))]),
-            "ct_dst_sport_ltm": same([("daddr", daddr), ("sport", sport), ("ltime", rec.get("ltime"))]),
-            "ct_dst_src_ltm": same([("saddr", saddr), ("daddr", daddr), ("ltime", rec.get("ltime"))]),
-        }
-        
     def merge_records(argus_j: dict, zeek_j: dict):
         merged = argus_j.copy()
         
@@ -252,6 +1116,7 @@ def main():
         )
 
         key = build_key(argus=merged)
+        t_flow = event_time(merged.get("stime"), time.time())
         # 2. Inicializamos a 0 todos los campos “no comunes”
         merged["trans_depth"] = 0
         merged["response_body_len"] = 0
@@ -262,13 +1127,12 @@ def main():
         # 3. Ajuste según tipo de log de Zeek
         if  zeek_j["zeek_log"] == "http":
             # ➜ HTTP
-            MAP_COUNT_HTTP[key] += 1
             merged["service"] = "http"
             merged["trans_depth"] = int(zeek_j.get("trans_depth", 0))
             merged["response_body_len"] = int(zeek_j.get("response_body_len", 0))
 
             # ct_flw_http_mthd: contamos en el buffer HTTP
-            merged["ct_flw_http_mthd"] = MAP_COUNT_HTTP[key]
+            merged["ct_flw_http_mthd"] = MAP_COUNT_HTTP.incr(key, t_flow)
             
         elif zeek_j["zeek_log"] == "ftp":
             # ➜ FTP
@@ -285,156 +1149,209 @@ def main():
             # ct_ftp_cmd: contamos en el buffer FTP
             cmd = zeek_j.get("command", "")
             if isinstance(cmd, str) and cmd.strip():
-                MAP_COUNT_FTP[key] += 1
-                
-            merged["ct_ftp_cmd"] = MAP_COUNT_FTP[key]
+                merged["ct_ftp_cmd"] = MAP_COUNT_FTP.incr(key, t_flow)
+            else:
+                merged["ct_ftp_cmd"] = MAP_COUNT_FTP.get(key, 0, t_flow)
             
         else:
             # ➜ CONN
             merged["service"] = zeek_j.get("service", "-")
         
-        # 4. Ahora calculamos los 7 contadores CT* usando el histórico de conexiones
-        ct = connection_features(merged, LAST_100)
-        for k in ZEOK_EXTRA:
-            merged[k] = ct[k]
-
-        # 5. Escritura y alineamiento de campos
-        ordered = { key: merged.get(key) for key in OUTPUT_FIELDS }
-        merge_fh.write(json.dumps(ordered) + "\n")
-        if args.flush_each:
-            merge_fh.flush()
-            os.fsync(merge_fh.fileno())
-            
-        # 6) Publicación en Redis para GPU (como CSV)
-        csv_line = ",".join(str(merged.get(c,"")) for c in ML_COLS)
-        r.lpush(args.merge_queue, csv_line)
-
-        # 6. Registramos en el buffer global (para contar conexiones futuras)
-        LAST_100.append(merged)
+        # 4. ct_* con el histórico de conexiones, escritura y publicación
+        #    en Redis para GPU (como CSV); con shards, en la etapa ct_*
+        emit(merged)
 
     # --- Bucle principal -----------------------------------------------------
     skip_first_argus = True
-    while True:
-        processed = False
-        # Argus primero
-        payload_a = r.lpop(args.argus_queue)
-        if payload_a:
-            processed = True
+
+    def handle_argus(payload_a: bytes, msg_id: Optional[str] = None) -> None:
+        nonlocal skip_first_argus
+        try:
+            a_data = json.loads(payload_a.decode())
             if skip_first_argus:
                 skip_first_argus = False
-                logging.info("Omitiendo cabecera de Argus")
-            else:
-                try:
-                    a_data = json.loads(payload_a.decode())
-                    for t in ("stime", "ltime"):
-                        if t in a_data:
-                            try:
-                                a_data[t] = int(round(to_float(a_data[t])))
-                            except Exception:
-                                pass
-                    argus_fh.write(json.dumps(a_data) + "\n")
-                    if args.flush_each:
-                        argus_fh.flush()
-                        os.fsync(argus_fh.fileno())
-                        
-                    proto = str(a_data.get("proto", "")).lower()
-                    if proto == "tcp":
-                        key_a = build_key(argus=a_data)
-
-                        # Si había acumulación HTTP para esta key → merge final
-                        if key_a in HTTP_ACC:
-                            final = HTTP_ACC.pop(key_a)
-                            z_final = final["last_z"]
-                            # Sobreescribimos con los valores agregados
-                            z_final["trans_depth"]       = final["max_depth"]
-                            z_final["response_body_len"] = final["sum_len"]
-                            merge_records(a_data, z_final)
-
-                        else:
-                            # Si no era un HTTP pendiente, seguimos con el proceso normal
-                            z_match = try_match_from_caches(key_a, "argus")
-                            if z_match:
-                                merge_records(a_data, z_match)
-                            else:
-                                argus_cache.append((key_a, a_data))
-                                dump_deques()
-                                
-                    elif proto not in ("tcp", "udp", "icmp"):
-                        a_data["is_sm_ips_ports"] = int(
-                            a_data.get("saddr") == a_data.get("daddr")
-                            and cast_port(a_data.get("sport")) == cast_port(a_data.get("dport"))
-                        )
-
-                        a_data["trans_depth"] = 0
-                        a_data["response_body_len"] = 0
-                        a_data["ct_flw_http_mthd"] = 0
-                        a_data["is_ftp_login"] = 0
-                        a_data["ct_ftp_cmd"] = 0
-
-                        ct = connection_features(a_data, LAST_100)
-                        a_data.update(ct)
-                        
-                        ordered = { key: a_data.get(key) for key in OUTPUT_FIELDS }
-                        merge_fh.write(json.dumps(ordered) + "\n")
-                        if args.flush_each:
-                            merge_fh.flush(); os.fsync(merge_fh.fileno())
-
-                        LAST_100.append(a_data)
-                        csv_line = ",".join(str(a_data.get(c,"")) for c in ML_COLS)
-                        r.lpush(args.merge_queue, csv_line)
-                        continue 
-                    else:
-                        key_a = build_key(argus=a_data)
-                        z_match = try_match_from_caches(key_a, "argus")
-                        if z_match:
-                            merge_records(a_data, z_match)
-                        else:
-                            argus_cache.append((key_a, a_data))
-                            dump_deques()
-                except Exception as e:
-                    logging.error("Error procesando Argus: %s", e)
-
-        # Luego Zeek
-        payload_z = r.lpop(args.zeek_queue)
-        if payload_z:
-            processed = True
-            try:
-                z_data = json.loads(payload_z.decode())
-                zeek_fh.write(json.dumps(z_data) + "\n")
-                if args.flush_each:
-                    zeek_fh.flush()
-                    os.fsync(zeek_fh.fileno())
-                    
-                key_z = build_key(zeek=z_data)
-                
-                zeek_type = z_data.get("zeek_log", "").lower()
-                if zeek_type == "http":
-                    # 1) Acumula response_body_len y guarda el mensaje de mayor trans_depth
-                    depth = int(z_data.get("trans_depth", 0))
-                    body_len = int(z_data.get("response_body_len", 0))
-
-                    acc = HTTP_ACC.setdefault(key_z, {"sum_len": 0, "max_depth": 0, "last_z": None})
-                    acc["sum_len"] += body_len
-                    if depth > acc["max_depth"]:
-                        acc["max_depth"] = depth
-                        
-                    acc["last_z"] = z_data.copy()
-
-                    zeek_cache.append((key_z, z_data))
-                    dump_deques()
+                # Cabecera de ra (-L0): su stime no es un número. Con shards
+                # solo le llega a uno de los workers
+                if math.isnan(event_time(a_data.get("stime"), math.nan)):
+                    logging.info("Omitiendo cabecera de Argus")
+                    return
+            # Tiempo de evento con la precisión de ra, antes de redondear
+            t0 = event_time(a_data.get("stime"), time.time())
+            t1 = event_time(a_data.get("ltime"), t0)
+            watermark["argus"] = max(watermark["argus"], t0)
+            for t in ("stime", "ltime"):
+                if t in a_data:
+                    try:
+                        a_data[t] = int(round(to_float(a_data[t])))
+                    except Exception:
+                        pass
+            argus_fh.write(json.dumps(a_data) + "\n")
+            if args.flush_each:
+                argus_fh.flush()
+                os.fsync(argus_fh.fileno())
+            if sharded:
+                # stime sin redondear para que la etapa ct_* reordene
+                a_data["_t"] = t0
+            if msg_id:
+                a_data["_id"] = msg_id
+
+            proto = str(a_data.get("proto", "")).lower()
+            if proto == "tcp":
+                key_a = build_key(argus=a_data)
+
+                # Si había acumulación HTTP para esta key → merge final
+                if key_a in HTTP_ACC:
+                    final = HTTP_ACC.pop(key_a)
+                    z_final = final["last_z"]
+                    # Sobreescribimos con los valores agregados
+                    z_final["trans_depth"]       = final["max_depth"]
+                    z_final["response_body_len"] = final["sum_len"]
+                    merge_records(a_data, z_final)
+
                 else:
-                    keep = zeek_type == "ftp"
-                    a_match = try_match_from_caches(key_z, "zeek", keep_on_match=keep)
-                    if a_match:
-                        merge_records(a_match, z_data)
+                    # Si no era un HTTP pendiente, seguimos con el proceso normal
+                    z_match = try_match_from_caches(key_a, "argus", t0, t1)
+                    if z_match:
+                        merge_records(a_data, z_match)
                     else:
-                        zeek_cache.append((key_z, z_data))
-                        dump_deques()
-            except Exception as e:
-                logging.error("Error procesando Zeek: %s", e)
+                        argus_cache.append(key_a, a_data, t0, t1)
+
+            elif proto not in ("tcp", "udp", "icmp"):
+                a_data["is_sm_ips_ports"] = int(
+                    a_data.get("saddr") == a_data.get("daddr")
+                    and cast_port(a_data.get("sport")) == cast_port(a_data.get("dport"))
+                )
+
+                a_data["trans_depth"] = 0
+                a_data["response_body_len"] = 0
+                a_data["ct_flw_http_mthd"] = 0
+                a_data["is_ftp_login"] = 0
+                a_data["ct_ftp_cmd"] = 0
+
+                emit(a_data)
+            else:
+                key_a = build_key(argus=a_data)
+                z_match = try_match_from_caches(key_a, "argus", t0, t1)
+                if z_match:
+                    merge_records(a_data, z_match)
+                else:
+                    argus_cache.append(key_a, a_data, t0, t1)
+        except Exception as e:
+            logging.error("Error procesando Argus: %s", e)
+
+    def handle_zeek(payload_z: bytes, msg_id: Optional[str] = None) -> None:
+        try:
+            z_data = json.loads(payload_z.decode())
+            zeek_fh.write(json.dumps(z_data) + "\n")
+            if args.flush_each:
+                zeek_fh.flush()
+                os.fsync(zeek_fh.fileno())
+            if msg_id:
+                z_data["_id"] = msg_id
+
+            key_z = build_key(zeek=z_data)
+            t_z = event_time(z_data.get("ts"), time.time())
+            watermark["zeek"] = max(watermark["zeek"], t_z)
+
+            zeek_type = z_data.get("zeek_log", "").lower()
+            app = zeek_type in ("http", "ftp")
+            if zeek_type == "http":
+                # 1) Acumula response_body_len y guarda el mensaje de mayor trans_depth
+                accumulate_http(key_z, z_data, t_z)
+
+                zeek_cache.append(key_z, z_data, t_z, app=True)
+            else:
+                keep = zeek_type == "ftp"
+                a_match = try_match_from_caches(key_z, "zeek", t_z, t_z, app, keep_on_match=keep)
+                if a_match:
+                    merge_records(a_match, z_data)
+                else:
+                    zeek_cache.append(key_z, z_data, t_z, app=app)
+        except Exception as e:
+            logging.error("Error procesando Zeek: %s", e)
+
+    if args.use_stream:
+        acks_of = {argus_queue: argus_acks, zeek_queue: zeek_acks}
+        reader = StreamReader(r, (argus_queue, zeek_queue), args.group, args.consumer,
+                              args.batch_size, args.max_wait, args.claim_idle, args.claim_every,
+                              held=lambda stream, msg_id: msg_id in acks_of[stream].held)
+
+    def fetch_batch() -> Tuple[list, list]:
+        """Hasta batch_size mensajes de cada cola como (id de stream | None, payload)."""
+        if args.use_stream:
+            res = reader.read()
+            return res[argus_queue], res[zeek_queue]
+        # Un único round-trip para hasta batch_size mensajes de cada cola
+        pipe = r.pipeline(transaction=False)
+        pipe.lpop(argus_queue, args.batch_size)
+        pipe.lpop(zeek_queue, args.batch_size)
+        batch_a, batch_z = pipe.execute()
+        batch_a, batch_z = batch_a or [], batch_z or []
+        if not batch_a and not batch_z:
+            # Sin datos: bloqueamos hasta que llegue algo a cualquiera de las
+            # dos colas (o venza max_wait), en vez de dormir a ciegas
+            res = r.blmpop(args.max_wait, 2, argus_queue, zeek_queue,
+                           direction="LEFT", count=args.batch_size)
+            if res:
+                key, items = res
+                if key.decode() == argus_queue:
+                    batch_a = items
+                else:
+                    batch_z = items
+        return [(None, p) for p in batch_a], [(None, p) for p in batch_z]
+
+    n_argus = n_zeek = n_merged = n_batches = 0
+    t_stats = time.monotonic()
+    while True:
+        batch_a, batch_z = fetch_batch()
+        # Mismo orden que el bucle de un mensaje: Argus, Zeek, Argus, Zeek…
+        for i in range(max(len(batch_a), len(batch_z))):
+            for batch, handle, acks in ((batch_a, handle_argus, argus_acks),
+                                        (batch_z, handle_zeek, zeek_acks)):
+                if i < len(batch):
+                    msg_id, payload = batch[i]
+                    handle(payload, msg_id)
+                    if msg_id:
+                        acks.done(msg_id)
+
+        # Caducidad por marca de agua: lo que el otro flujo ya ha dejado atrás
+        argus_cache.expire(watermark["zeek"])
+        zeek_cache.expire(watermark["argus"])
+        now = max(watermark.values())
+        for state in FLOW_STATES:
+            state.expire(now)
+
+        # Salida del lote y, con streams, XACK de lo ya publicado o descartado
+        n_merged_batch = len(pending_out)
+        publish(r, out_queue, pending_out, args, left=not sharded,
+                acks=((argus_queue, argus_acks), (zeek_queue, zeek_acks)))
+        pending_out.clear()
 
-        if not processed:
-            time.sleep(0.05)
+        if batch_a or batch_z:
+            n_argus += len(batch_a)
+            n_zeek += len(batch_z)
+            n_merged += n_merged_batch
+            n_batches += 1
+        elapsed = time.monotonic() - t_stats
+        if elapsed >= args.log_every:
+            if n_batches:
+                logging.info(
+                    "📊 %.0f reg/s (argus=%d zeek=%d fusionados=%d, lote medio=%.1f)",
+                    (n_argus + n_zeek) / elapsed, n_argus, n_zeek, n_merged,
+                    (n_argus + n_zeek) / n_batches,
+                )
+            logging.info(
+                "⏳ Pendientes argus=%d zeek=%d · caducados sin pareja argus=%d zeek=%d"
+                " · expulsados por tope argus=%d zeek=%d",
+                len(argus_cache), len(zeek_cache), argus_cache.expired, zeek_cache.expired,
+                argus_cache.overflow, zeek_cache.overflow,
+            )
+            logging.info("🧠 Estado por flujo: %s", " · ".join(st.stats() for st in FLOW_STATES))
+            if args.use_stream:
+                logging.info("📬 Streams: sin XACK argus=%d zeek=%d · recuperados %d · reclamados %d",
+                             len(argus_acks.held), len(zeek_acks.held), reader.recovered, reader.claimed)
+            n_argus = n_zeek = n_merged = n_batches = 0
+            t_stats = time.monotonic()
 
 if __name__ == "__main__":
     try:
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 # filepath: /home/ruben/TFG/Recoleccion/dockers/procesar_ra/ra_to_redis.py
-import os, sys, csv, json, redis, argparse, logging, socket
+import os, sys, csv, json, redis, argparse, logging, socket, threading, time, zlib
 
 logging.basicConfig(
     level=logging.INFO,
@@ -8,12 +8,155 @@ logging.basicConfig(
     datefmt="%Y-%m-%d %H:%M:%S",
 )
 
+def cast_port(val) -> int:
+    if val is None: return 0
+    if isinstance(val, str) and val.lower().startswith("0x"):
+        try: return int(val, 16)
+        except: pass
+    try: return int(val)
+    except: return 0
+
+def flow_shard(row: dict, shards: int) -> int:
+    """
+    Shard del flujo: crc32 de la clave de build_key con los extremos
+    ordenados. Copia de merge_argus_zeek.shard_of: deben coincidir.
+    """
+    if shards <= 1:
+        return 0
+    proto = str(row.get("proto", "")).lower()
+    if proto == "icmp":
+        lo, hi = sorted((str(row.get("saddr")), str(row.get("daddr"))))
+        ident = f"{proto}|{lo}|{hi}"
+    else:
+        (lo_h, lo_p), (hi_h, hi_p) = sorted(((str(row.get("saddr")), cast_port(row.get("sport"))),
+                                             (str(row.get("daddr")), cast_port(row.get("dport")))))
+        ident = f"{proto}|{lo_h}|{lo_p}|{hi_h}|{hi_p}"
+    return zlib.crc32(ident.encode()) % shards
+
+class BufferedPublisher:
+    """
+    Acumula filas y las publica con un pipeline de Redis cada `max_rows`
+    filas o cada `max_ms` milisegundos (lo que ocurra antes), de modo que la
+    latencia queda acotada con poco tráfico y el rendimiento escala con mucho.
+    Con shards cada fila va a su cola (`key` en add) en el mismo pipeline.
+    Con `maxlen` las colas son Redis Streams: XADD con MAXLEN ~ en lugar de RPUSH.
+    """
+
+    def __init__(self, r: redis.Redis, key: str, max_rows: int, max_ms: float, maxlen: int = 0):
+        if max_ms <= 0:
+            # wait(0) haría girar el temporizador al 100 % de CPU sobre el lock
+            raise ValueError(f"max_ms debe ser > 0 (es {max_ms})")
+        self.r = r
+        self.key = key
+        self.maxlen = maxlen
+        self.max_rows = max_rows
+        self.max_s = max_ms / 1000.0
+        self._buf: list = []
+        self._first_ts = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.reset_stats()
+        self._timer = threading.Thread(target=self._timer_loop, daemon=True)
+        self._timer.start()
+
+    def reset_stats(self) -> None:
+        self.stats_t0 = time.monotonic()
+        self.stats_rows = 0
+        self.stats_flushes = 0
+        self.stats_max_flush = 0
+        self.stats_lat_total = 0.0
+        self.stats_lat_max = 0.0
+
+    def add(self, payload: bytes, key: str = None) -> None:
+        with self._lock:
+            if not self._buf:
+                self._first_ts = time.monotonic()
+            self._buf.append((key or self.key, payload))
+            if len(self._buf) >= self.max_rows:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._timer.join()
+        self.flush()
+
+    def _timer_loop(self) -> None:
+        # Vacía el búfer si la fila más antigua lleva más de max_ms esperando.
+        # Un fallo de Redis no puede matar el hilo (se perdería la cota de
+        # latencia): las filas vuelven al búfer y se reintenta en el siguiente
+        # tick; si el búfer se llena, el flush de add() propaga el error.
+        while not self._stop.wait(self.max_s / 2):
+            with self._lock:
+                if self._buf and time.monotonic() - self._first_ts >= self.max_s:
+                    try:
+                        self._flush_locked()
+                    except (redis.RedisError, socket.error) as e:
+                        logging.error("Flush por tiempo fallido (%d filas en espera, se reintenta): %s",
+                                      len(self._buf), e)
+
+    def _flush_locked(self) -> None:
+        if not self._buf:
+            return
+        rows, self._buf = self._buf, []
+        by_key: dict = {}
+        for key, payload in rows:
+            by_key.setdefault(key, []).append(payload)
+        t0 = time.perf_counter()
+        pipe = self.r.pipeline(transaction=False)
+        for key, payloads in by_key.items():
+            if self.maxlen:
+                for payload in payloads:
+                    pipe.xadd(key, {"data": payload}, maxlen=self.maxlen, approximate=True)
+            else:
+                pipe.rpush(key, *payloads)
+        try:
+            pipe.execute()
+        except Exception:
+            # Las filas no se pierden: vuelven al principio del búfer
+            self._buf = rows + self._buf
+            raise
+        lat = time.perf_counter() - t0
+        self.stats_rows += len(rows)
+        self.stats_flushes += 1
+        self.stats_max_flush = max(self.stats_max_flush, len(rows))
+        self.stats_lat_total += lat
+        self.stats_lat_max = max(self.stats_lat_max, lat)
+
+    def stats_line(self) -> str:
+        with self._lock:
+            elapsed = max(time.monotonic() - self.stats_t0, 1e-9)
+            flushes = max(self.stats_flushes, 1)
+            line = (
+                f"{self.stats_rows / elapsed:.0f} filas/s; "
+                f"flush medio={self.stats_rows / flushes:.1f} filas (máx {self.stats_max_flush}); "
+                f"latencia flush media={self.stats_lat_total / flushes * 1000:.2f} ms "
+                f"(máx {self.stats_lat_max * 1000:.2f} ms)"
+            )
+            self.reset_stats()
+        return line
+
 def main() -> None:
     p = argparse.ArgumentParser()
     p.add_argument("--redis_host", default=os.getenv("REDIS_HOST", "redis"))
     p.add_argument("--redis_port", type=int, default=int(os.getenv("REDIS_PORT", 6379)))
     p.add_argument("--redis_key",  default=os.getenv("REDIS_QUEUE_ARGUS", "argus_data_stream"))
+    p.add_argument("--batch_rows", type=int, default=int(os.getenv("RA_BATCH_ROWS", 500)),
+                   help="Filas máximas por pipeline")
+    p.add_argument("--flush_ms", type=float, default=float(os.getenv("RA_FLUSH_MS", 50)),
+                   help="Espera máxima (ms) de una fila en el búfer")
+    p.add_argument("--shards", type=int, default=int(os.getenv("MERGE_SHARDS", 1)),
+                   help="Nº de shards del merge: cada fila va a <redis_key>:<shard>")
+    p.add_argument("--use_stream", action="store_true", default=os.getenv("REDIS_STREAMS") == "1",
+                   help="XADD a un Redis Stream en vez de RPUSH a una lista")
+    p.add_argument("--stream_maxlen", type=int, default=int(os.getenv("STREAM_MAXLEN", 1_000_000)),
+                   help="MAXLEN ~ del stream (entradas)")
     args = p.parse_args()
+    if args.flush_ms <= 0:
+        p.error("--flush_ms (RA_FLUSH_MS) debe ser > 0")
 
     # Obtener el orden definido en RA_FIELDS
     field_list = os.getenv("RA_FIELDS")
@@ -31,18 +174,32 @@ def main() -> None:
         logging.exception("¿Redis caído?: %s", e)
         sys.exit(2)
 
+    maxlen = args.stream_maxlen if args.use_stream else 0
+    publisher = BufferedPublisher(r, args.redis_key, args.batch_rows, args.flush_ms, maxlen)
+    logging.info("Publicando (%s) en lotes de hasta %d filas o cada %.0f ms",
+                 f"XADD MAXLEN ~{maxlen}" if maxlen else "RPUSH", args.batch_rows, args.flush_ms)
+    shard_keys = [f"{args.redis_key}:{i}" for i in range(args.shards)] if args.shards > 1 else None
+    if shard_keys:
+        logging.info("Repartiendo por flujo en %d shards (%s:0..%d)",
+                     args.shards, args.redis_key, args.shards - 1)
+
     # Leer stdin como CSV con los fieldnames
     reader = csv.DictReader(sys.stdin, fieldnames=fieldnames)
     total = 0
 
-    for row in reader:
-        # Reconstruir la fila con el orden correcto
-        row_ordered = {fn: row.get(fn, "") for fn in fieldnames}
-        r.rpush(args.redis_key, json.dumps(row_ordered).encode())
-        total += 1
+    try:
+        for row in reader:
+            # Reconstruir la fila con el orden correcto
+            row_ordered = {fn: row.get(fn, "") for fn in fieldnames}
+            key = shard_keys[flow_shard(row_ordered, args.shards)] if shard_keys else None
+            publisher.add(json.dumps(row_ordered).encode(), key)
+            total += 1
 
-        if total % 100 == 0:
-            logging.info("Enviadas %d filas; última stime=%s", total, row_ordered.get("stime"))
+            if total % 100 == 0:
+                logging.info("Enviadas %d filas; última stime=%s; %s",
+                             total, row_ordered.get("stime"), publisher.stats_line())
+    finally:
+        publisher.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+check_follower.py  —  LogFollower frente a un fichero local que se escribe,
+rota y trunca como lo hace Zeek.
+-----------------------------------------------------------------------
+1. El fichero aparece después de crear el follower.
+2. Línea partida: la mitad sin '\\n' no sale hasta que se completa.
+3. Rotación por renombrado: se termina el antiguo y se sigue con el nuevo.
+4. Truncado en el sitio con contenido más corto que lo ya leído.
+5. Truncado y reescrito hasta más allá de lo ya leído (mismo tamaño o más).
+6. Lectura en bloques más pequeños que una línea.
+
+Uso:
+    python check_follower.py
+"""
+from __future__ import annotations
+
+import os, shutil, sys, tempfile
+
+from zeek_to_redis import LogFollower
+
+failures = 0
+
+
+def check(what: str, got, expected) -> None:
+    global failures
+    if got == expected:
+        print(f"✅ {what}")
+    else:
+        failures += 1
+        print(f"❌ {what}: {got!r} (se esperaba {expected!r})")
+
+
+def append(path: str, data: bytes) -> None:
+    with open(path, "ab") as fh:
+        fh.write(data)
+
+
+def rewrite(path: str, data: bytes) -> None:
+    # Truncado en el sitio (mismo inodo), como copytruncate
+    with open(path, "r+b") as fh:
+        fh.truncate(0)
+        fh.write(data)
+
+
+def main() -> None:
+    tmp = tempfile.mkdtemp(prefix="check_follower_")
+    path = os.path.join(tmp, "conn.log")
+    try:
+        f = LogFollower(path)
+        check("1) sin fichero no hay líneas", f.poll(), [])
+        append(path, b'{"n": 1}\n')
+        check("1) el fichero nuevo se lee desde el principio", f.poll(), [b'{"n": 1}'])
+
+        append(path, b'{"n": 2, "par')
+        check("2) línea a medias retenida", f.poll(), [])
+        append(path, b'tial": true}\n{"n": 3}\n')
+        check("2) línea completada", f.poll(), [b'{"n": 2, "partial": true}', b'{"n": 3}'])
+
+        append(path, b'{"n": 4}\n')
+        os.rename(path, path + ".1")
+        append(path + ".1", b'{"n": 5}\n')
+        append(path, b'{"n": 6}\n')
+        check("3) rotación: resto del antiguo y luego el nuevo", f.poll(),
+              [b'{"n": 4}', b'{"n": 5}', b'{"n": 6}'])
+
+        append(path, b'{"n": 7, "relleno": "' + b"x" * 64 + b'"}\n')
+        f.poll()
+        rewrite(path, b'{"m": 1}\n')
+        check("4) truncado más corto: desde el principio", f.poll(), [b'{"m": 1}'])
+
+        new = [b'{"t": %d, "relleno": "%s"}' % (i, b"y" * 40) for i in range(3)]
+        assert len(b"\n".join(new)) + 1 >= f.offset
+        rewrite(path, b"\n".join(new) + b"\n")
+        check("5) truncado y reescrito más largo: las 3 líneas nuevas", f.poll(), new)
+
+        small = LogFollower(path, chunk_size=7)
+        lines = [b'{"c": %d, "relleno": "%s"}' % (i, b"z" * 30) for i in range(5)]
+        append(path, b"\n".join(lines) + b"\n")
+        check("6) bloques de 7 bytes", small.poll(), lines)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if failures:
+        print(f"❌ {failures} comprobaciones fallidas")
+        sys.exit(1)
+    print("✅ LogFollower correcto en todos los casos")
+
+
+if __name__ == "__main__":
+    main()
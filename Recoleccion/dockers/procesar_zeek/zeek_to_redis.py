@@ -1,19 +1,26 @@
 #!/usr/bin/env python3
 """
-Lee en modo tail -F conn.log, http.log y ftp.log de Zeek usando subprocess.
-Cada log corre en su propio hilo leyendo directamente de `tail -F`.
-Al encontrar JSON válido, lo envía a Redis.
+Sigue conn.log, http.log y ftp.log de Zeek dentro del propio proceso
+(sin `tail -F`), leyendo los ficheros en bloques binarios grandes.
+Cada log corre en su propio hilo con un LogFollower que detecta la
+rotación/truncado de /output_zeek/current/*.log. A cada línea JSON se le
+añade la etiqueta `zeek_log` sin decodificarla y se envían a Redis en
+lotes con un pipeline. Con --shards N cada línea va a la cola
+`<redis_key>:<shard>` de su flujo (hash de la 5-tupla, como el merge).
+Con --use_stream (REDIS_STREAMS=1) se publica con XADD + MAXLEN ~ en un
+Redis Stream, que el merge lee con un grupo de consumidores.
 """
 
 import os
 import json
+import zlib
 import redis
 import time
 import logging
 import argparse
 import socket
 import threading
-import subprocess
+from typing import Dict, List, Optional
 
 LOG_DIR = "/output_zeek/current"
 TARGETS = {
@@ -21,6 +28,9 @@ TARGETS = {
     "http.log": "http",
     "ftp.log": "ftp",
 }
+CHUNK_SIZE = 1 << 20
+HEAD_BYTES = 1024          # inicio del fichero que identifica su contenido
+RETRY_MIN, RETRY_MAX = 0.5, 30.0   # espera (s) entre reintentos si Redis falla
 
 logging.basicConfig(
     level=logging.INFO,
@@ -28,36 +38,216 @@ logging.basicConfig(
     datefmt="%Y-%m-%d %H:%M:%S",
 )
 
-def tail_worker(path: str, kind: str, r: redis.Redis, redis_key: str, use_stream: bool):
-    cmd = ["tail", "-n", "0", "-F", path]
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
-    logging.info("Arrancado tail -F %s → hilo %s", path, kind)
-    for raw in proc.stdout:
-        line = raw.rstrip("\n")
-        if not line or line.startswith("#"):
-            continue
+class LogFollower:
+    """
+    Equivalente en proceso a `tail -n 0 -F path`.
+
+    `poll()` devuelve las líneas completas (bytes, sin '\\n') escritas desde
+    la llamada anterior. Si Zeek rota el fichero (otro inodo en `path`) se
+    termina de leer el antiguo y se continúa con el nuevo desde el principio;
+    si se trunca, se vuelve al inicio. El truncado se detecta porque el
+    tamaño baja de lo ya leído o porque cambian los primeros HEAD_BYTES
+    bytes (truncado y reescrito hasta más allá de lo leído); no se detecta
+    si el contenido nuevo empieza exactamente igual que el anterior.
+    Ver check_follower.py.
+    """
+
+    def __init__(self, path: str, chunk_size: int = CHUNK_SIZE, from_start: bool = False):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._fh = None
+        self._ino: Optional[int] = None
+        self._pending = b""
+        self._head = b""
+        self.offset = 0
+        self._open(from_start)
+
+    def _open(self, from_start: bool) -> bool:
+        try:
+            fh = open(self.path, "rb")
+        except FileNotFoundError:
+            return False
+        if self._fh:
+            self._fh.close()
+        self._fh = fh
+        self._ino = os.fstat(fh.fileno()).st_ino
+        self._pending = b""
+        self.offset = 0 if from_start else fh.seek(0, os.SEEK_END)
+        self._remember_head()
+        return True
+
+    def _remember_head(self) -> None:
+        # Solo bytes ya vistos: si luego cambian, el fichero se ha reescrito
+        if len(self._head) < HEAD_BYTES and self.offset > len(self._head):
+            self._head = os.pread(self._fh.fileno(), min(HEAD_BYTES, self.offset), 0)
+
+    def _rewritten(self, size: int) -> bool:
+        if size < self.offset:
+            return True
+        return bool(self._head) and os.pread(self._fh.fileno(), len(self._head), 0) != self._head
+
+    def _rewind(self) -> None:
+        self._fh.seek(0)
+        self.offset = 0
+        self._pending = b""
+        self._head = b""
+
+    def lag_bytes(self) -> int:
+        """Bytes escritos en el fichero que aún no se han leído."""
+        try:
+            return max(os.stat(self.path).st_size - self.offset, 0)
+        except FileNotFoundError:
+            return 0
+
+    def _read_available(self) -> List[bytes]:
+        lines: List[bytes] = []
+        while True:
+            chunk = self._fh.read(self.chunk_size)
+            if not chunk:
+                return lines
+            self.offset += len(chunk)
+            data = self._pending + chunk
+            parts = data.split(b"\n")
+            self._pending = parts.pop()
+            lines.extend(parts)
+
+    def poll(self) -> List[bytes]:
+        if self._fh is None:
+            # Aún no existía: lo que aparezca es contenido nuevo
+            lines = self._read_available() if self._open(from_start=True) else []
+            if self._fh:
+                self._remember_head()
+            return lines
+
+        # Truncado en el sitio: antes de leer, o se tomaría el final del
+        # contenido nuevo como continuación del anterior
+        if self._rewritten(os.fstat(self._fh.fileno()).st_size):
+            self._rewind()
+        lines = self._read_available()
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._remember_head()
+            return lines  # rotado y todavía sin sustituto
+        if st.st_ino != self._ino:
+            # Rotado: lo que quedaba del antiguo ya está en `lines`
+            if self._open(from_start=True):
+                lines.extend(self._read_available())
+        self._remember_head()
+        return lines
+
+def tag_line(line: bytes, tag: bytes) -> Optional[bytes]:
+    """Inserta `"zeek_log": tag` en el objeto JSON de `line` sin decodificarlo."""
+    line = line.strip()
+    if not line or line.startswith(b"#"):
+        return None
+    if not (line.startswith(b"{") and line.endswith(b"}")):
+        return None
+    body = line[:-1].rstrip()
+    sep = b"" if body == b"{" else b", "
+    return body + sep + b'"zeek_log": "' + tag + b'"}'
+
+def cast_port(val) -> int:
+    if val is None: return 0
+    if isinstance(val, str) and val.lower().startswith("0x"):
+        try: return int(val, 16)
+        except: pass
+    try: return int(val)
+    except: return 0
+
+def flow_shard(rec: dict, kind: str, shards: int) -> int:
+    """
+    Shard del flujo: crc32 de la clave de build_key con los extremos
+    ordenados. Copia de merge_argus_zeek.shard_of: deben coincidir.
+    """
+    if shards <= 1:
+        return 0
+    proto = "tcp" if kind in ("http", "ftp") else str(rec.get("proto", "")).lower()
+    if proto == "icmp":
+        lo, hi = sorted((str(rec.get("id.orig_h")), str(rec.get("id.resp_h"))))
+        ident = f"{proto}|{lo}|{hi}"
+    else:
+        (lo_h, lo_p), (hi_h, hi_p) = sorted(((str(rec.get("id.orig_h")), cast_port(rec.get("id.orig_p"))),
+                                             (str(rec.get("id.resp_h")), cast_port(rec.get("id.resp_p")))))
+        ident = f"{proto}|{lo_h}|{lo_p}|{hi_h}|{hi_p}"
+    return zlib.crc32(ident.encode()) % shards
+
+def route(payloads: List[bytes], kind: str, redis_key: str, shards: int) -> Dict[str, List[bytes]]:
+    """Agrupa las líneas por cola de destino (una sola cola sin shards)."""
+    if shards <= 1:
+        return {redis_key: payloads}
+    out: Dict[str, List[bytes]] = {}
+    for payload in payloads:
         try:
-            rec = json.loads(line)
-        except json.JSONDecodeError:
-            logging.debug("JSON inválido (%s): %s", kind, line)
-            continue
-
-        rec["zeek_log"] = kind
-        payload = json.dumps(rec).encode()
-        if use_stream:
-            r.xadd(redis_key, {"data": payload})
-        else:
-            r.rpush(redis_key, payload)
-        logging.debug("Enviado %s → Redis (%d bytes)", kind, len(payload))
-    proc.stdout.close()
-    proc.wait()
+            shard = flow_shard(json.loads(payload), kind, shards)
+        except ValueError:
+            logging.warning("Línea %s no es JSON válido; va al shard 0", kind)
+            shard = 0
+        out.setdefault(f"{redis_key}:{shard}", []).append(payload)
+    return out
+
+class FollowStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lines = 0
+        self.lag = 0
+
+def publish(r: redis.Redis, groups: Dict[str, List[bytes]], maxlen: int, kind: str) -> None:
+    """
+    Envía `groups` (cola → líneas) en un pipeline. Si Redis falla se
+    reintenta con espera creciente sin soltar las líneas: el hilo no muere
+    y, mientras tanto, el fichero se sigue acumulando (crece el lag).
+    """
+    delay = RETRY_MIN
+    while True:
+        pipe = r.pipeline(transaction=False)
+        for key, group in groups.items():
+            if maxlen:
+                for payload in group:
+                    pipe.xadd(key, {"data": payload}, maxlen=maxlen, approximate=True)
+            else:
+                pipe.rpush(key, *group)
+        try:
+            pipe.execute()
+            return
+        except (redis.RedisError, socket.error) as e:
+            logging.error("Envío de %d líneas %s fallido (reintento en %.1f s): %s",
+                          sum(map(len, groups.values())), kind, delay, e)
+            time.sleep(delay)
+            delay = min(delay * 2, RETRY_MAX)
+
+def follow_worker(path: str, kind: str, r: redis.Redis, redis_key: str, maxlen: int,
+                  stats: FollowStats, chunk_size: int, poll_interval: float, shards: int = 1):
+    follower = LogFollower(path, chunk_size)
+    tag = kind.encode()
+    logging.info("Siguiendo %s → hilo %s", path, kind)
+    while True:
+        payloads = [p for p in (tag_line(l, tag) for l in follower.poll()) if p]
+        if payloads:
+            publish(r, route(payloads, kind, redis_key, shards), maxlen, kind)
+            logging.debug("Enviados %d %s → Redis", len(payloads), kind)
+        with stats.lock:
+            stats.lines += len(payloads)
+            stats.lag = follower.lag_bytes()
+        if not payloads:
+            time.sleep(poll_interval)
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--redis_host", default=os.getenv("REDIS_HOST", "redis"))
     ap.add_argument("--redis_port", type=int, default=int(os.getenv("REDIS_PORT", 6379)))
     ap.add_argument("--redis_key",  default=os.getenv("REDIS_QUEUE_ZEEK", "zeek_data_stream"))
-    ap.add_argument("--use_stream", action="store_true")
+    ap.add_argument("--use_stream", action="store_true", default=os.getenv("REDIS_STREAMS") == "1",
+                    help="XADD a un Redis Stream en vez de RPUSH a una lista")
+    ap.add_argument("--stream_maxlen", type=int, default=int(os.getenv("STREAM_MAXLEN", 1_000_000)),
+                    help="MAXLEN ~ del stream (entradas)")
+    ap.add_argument("--log_dir", default=os.getenv("ZEEK_LOG_DIR", LOG_DIR))
+    ap.add_argument("--chunk_size", type=int, default=CHUNK_SIZE, help="Bytes por lectura")
+    ap.add_argument("--poll_interval", type=float, default=0.05, help="Segundos de espera sin datos nuevos")
+    ap.add_argument("--stats_every", type=float, default=float(os.getenv("STATS_EVERY", 30)),
+                    help="Segundos entre líneas de métricas por log")
+    ap.add_argument("--shards", type=int, default=int(os.getenv("MERGE_SHARDS", 1)),
+                    help="Nº de shards del merge: cada línea va a <redis_key>:<shard>")
     args = ap.parse_args()
 
     try:
@@ -67,33 +257,55 @@ def main():
         logging.exception("Redis no disponible")
         return
 
-    mode = "XADD" if args.use_stream else "RPUSH"
+    maxlen = args.stream_maxlen if args.use_stream else 0
+    mode = f"XADD MAXLEN ~{maxlen}" if maxlen else "RPUSH"
     logging.info("Publicando en %s:%s/%s (%s)",
                  args.redis_host, args.redis_port, args.redis_key, mode)
+    if args.shards > 1:
+        logging.info("Repartiendo por flujo en %d shards (%s:0..%d)",
+                     args.shards, args.redis_key, args.shards - 1)
 
     # Lanzamos un hilo **en cuanto** aparezca cada fichero,
     # sin bloquear el arranque de los demás.
     started = {}  # kind → Thread
+    stats = {kind: FollowStats() for kind in TARGETS.values()}
+    last_stats = time.monotonic()
+
+    def report():
+        nonlocal last_stats
+        elapsed = time.monotonic() - last_stats
+        for kind in started:
+            st = stats[kind]
+            with st.lock:
+                lines, st.lines, lag = st.lines, 0, st.lag
+            logging.info("📊 %s: %.0f líneas/s, lag %d B", kind, lines / elapsed, lag)
+        last_stats = time.monotonic()
+
     while len(started) < len(TARGETS):
         for fname, kind in TARGETS.items():
             if kind in started:
                 continue
-            path = os.path.join(LOG_DIR, fname)
+            path = os.path.join(args.log_dir, fname)
             if os.path.isfile(path):
                 t = threading.Thread(
-                    target=tail_worker,
-                    args=(path, kind, r, args.redis_key, args.use_stream),
+                    target=follow_worker,
+                    args=(path, kind, r, args.redis_key, maxlen,
+                          stats[kind], args.chunk_size, args.poll_interval, args.shards),
                     daemon=True
                 )
                 t.start()
                 started[kind] = t
                 logging.info("Hilo iniciado para %s (%s)", kind, path)
+        if time.monotonic() - last_stats >= args.stats_every:
+            report()
         time.sleep(0.5)
 
     # Una vez estén todos lanzados, mantenemos el proceso vivo.
     try:
         while True:
             time.sleep(1)
+            if time.monotonic() - last_stats >= args.stats_every:
+                report()
     except KeyboardInterrupt:
         logging.info("Ctrl-C recibido, saliendo…")
 